@@ -89,6 +89,10 @@ TEMPLATE_LOADERS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    # Counts the queries of the whole stack, keep it first
+    'cacert_motions.instrumentation.QueryInstrumentationMiddleware',
+    # Sees the writes of the session and authentication middleware
+    'cacert_motions.routers.ReplicaPinningMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -125,11 +129,67 @@ INSTALLED_APPS = (
     'django.contrib.admin',
     # Uncomment the next line to enable admin documentation:
     # 'django.contrib.admindocs',
+    'south',
     'cacert_motions',
 )
 
 SESSION_SERIALIZER = 'django.contrib.sessions.serializers.JSONSerializer'
 
+# Client certificates used to vote are verified against this CA bundle and
+# have to belong to the user entering the vote. Requires the cryptography
+# package, see cacert_motions/certificates.py for the related settings.
+MOTIONS_CA_BUNDLE = None
+MOTIONS_CRL = None
+
+# Request variable the web server passes the client certificate of ballots
+# in, see cacert_motions/ballots.py
+MOTIONS_CLIENT_CERT_VARIABLE = 'SSL_CLIENT_CERT'
+
+# Reads go to the databases besides 'default', which replicate it, writes
+# and reads of clients that just wrote go to 'default'. See
+# cacert_motions/routers.py for the related settings.
+DATABASE_ROUTERS = ['cacert_motions.routers.ReplicaRouter']
+MOTIONS_READ_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+
+# Text search configuration of the full-text index of motions on PostgreSQL
+MOTIONS_SEARCH_CONFIG = 'english'
+
+# Secret signing the checkpoints of the hash chain over the votes, defaults
+# to SECRET_KEY. See cacert_motions/chain.py.
+#MOTIONS_CHAIN_KEY = private_settings.MOTIONS_CHAIN_KEY
+
+# Mail notifications about motions are queued and sent by the
+# send_notifications command, see cacert_motions/notifications.py for the
+# related settings
+MOTIONS_SITE_URL = ''
+
+# Username of the president, whose vote decides ties of motions with the
+# casting vote rule, see cacert_motions/rules.py
+MOTIONS_PRESIDENT = None
+
+# Query budgets of views outside cacert_motions/urls.py, requests over budget
+# are logged, see cacert_motions/instrumentation.py for the related settings.
+MOTIONS_QUERY_BUDGETS = {
+    # Searches count all motions as well for the total
+    'admin:cacert_motions_motion_changelist': 7,
+}
+
+# Subscribers to live tallies poll a counter in the cache and rendered motions
+# are cached, use a cache shared by all workers, see cacert_motions/live.py
+# and cacert_motions/caching.py for the related settings.
+# CACHES = {
+#     'default': {
+#         'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+#         'LOCATION': '127.0.0.1:11211',
+#     }
+# }
+MOTIONS_CACHE_TIMEOUT = 86400
+
+# Level of the request and notification logs on the console, INFO logs the
+# queries and timing of every request and the throughput of every batch of
+# notifications
+MOTIONS_LOG_LEVEL = 'WARNING'
+
 # A sample logging configuration. The only tangible logging
 # performed by this configuration is to send an email to
 # the site admins on every HTTP 500 error when DEBUG=False.
@@ -148,7 +208,15 @@ LOGGING = {
             'level': 'ERROR',
             'filters': ['require_debug_false'],
             'class': 'django.utils.log.AdminEmailHandler'
-        }
+        },
+        'console': {
+            'level': 'DEBUG',
+            'class': 'logging.StreamHandler'
+        },
+        'motions_console': {
+            'level': MOTIONS_LOG_LEVEL,
+            'class': 'logging.StreamHandler'
+        },
     },
     'loggers': {
         'django.request': {
@@ -156,5 +224,13 @@ LOGGING = {
             'level': 'ERROR',
             'propagate': True,
         },
+        'cacert_motions.requests': {
+            'handlers': ['motions_console'],
+            'level': MOTIONS_LOG_LEVEL,
+        },
+        'cacert_motions.notifications': {
+            'handlers': ['motions_console'],
+            'level': MOTIONS_LOG_LEVEL,
+        },
     }
 }
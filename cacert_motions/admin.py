@@ -1,5 +1,9 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.contrib.admin.util import unquote
+from django.http import HttpResponseRedirect
+from django.template.loader import render_to_string
 from .models import Motion, Vote, ProxyVote
+from . import caching, search
 
 class VoteInline(admin.TabularInline):
     model = Vote
@@ -19,17 +23,60 @@ class ProxyVoteInline(admin.TabularInline):
         'justification'
     )
 
+class FrozenVoteInline(admin.TabularInline):
+    model = Vote
+    extra = 0
+    max_num = 0
+    can_delete = False
+    
+    fields = readonly_fields = (
+        'vote', 'voter', 'proxy', 'justification', 'timestamp',
+    )
+
 class MotionAdmin(admin.ModelAdmin):
-    readonly_fields = ('number', 'created', 'modified',)
+    readonly_fields = ('number', 'created', 'modified', 'summary',)
     fields = (
         ('number', 'title', 'withdrawn',),
         'proponent',
         ('created', 'modified', 'due',),
+        ('rule', 'quorum',),
+        'summary',
         'text',
     )
     
     inlines = (VoteInline, ProxyVoteInline,)
     
+    def get_readonly_fields(self, request, obj=None):
+        if obj is not None and obj.finalized:
+            return tuple(f for row in self.fields
+                         for f in (row if isinstance(row, tuple) else (row,)))
+        return self.readonly_fields
+    
+    def get_inline_instances(self, request, obj=None):
+        if obj is not None and obj.finalized:
+            # The votes are part of the result, show them read only
+            return [FrozenVoteInline(self.model, self.admin_site)]
+        return super(MotionAdmin, self).get_inline_instances(request, obj)
+    
+    def change_view(self, request, object_id, form_url='', extra_context=None):
+        '''
+        Finalized motions are shown read only, posting their form saves
+        nothing
+        '''
+        if request.method == 'POST':
+            obj = self.get_object(request, unquote(object_id))
+            if obj is not None and obj.finalized:
+                self.message_user(request, 'Motion %s is finalized and cannot '
+                                  'be changed.' % obj.number, messages.ERROR)
+                return HttpResponseRedirect(request.path)
+        return super(MotionAdmin, self).change_view(request, object_id,
+                                                    form_url, extra_context)
+    
+    def has_delete_permission(self, request, obj=None):
+        if obj is not None and obj.finalized:
+            return False
+        return super(MotionAdmin, self).has_delete_permission(request, obj)
+    
     date_hierarchy = 'created'
     list_display = ('approved',
                     'number',
@@ -45,16 +92,52 @@ class MotionAdmin(admin.ModelAdmin):
     list_filter = ('created', 'due',)
     search_fields = ('title', 'text', 'number')
     
+    def get_queryset(self, request):
+        '''
+        Annotate the outcome so the changelist can be sorted by it, the
+        tallies are already stored on the motions
+        '''
+        return super(MotionAdmin, self).get_queryset(request).with_outcomes()
+    
+    def get_search_results(self, request, queryset, search_term):
+        '''
+        Search the full-text index instead of scanning `search_fields`
+        '''
+        if not search_term.strip():
+            return queryset, False
+        return search.search(queryset, search_term), False
+    
+    def get_ordering(self, request):
+        # Best matches first unless a column was chosen for sorting
+        if request.GET.get('q', '').strip():
+            return ('rank',)
+        return super(MotionAdmin, self).get_ordering(request)
+    
+    def approved(self, motion):
+        return motion.approved()
+    approved.boolean = True
+    approved.admin_order_field = 'outcome'
+    
+    def summary(self, motion):
+        if not motion.number:
+            # Not saved yet
+            return ''
+        return caching.fragment(motion, 'summary', lambda: render_to_string(
+            'cacert_motions/motion_summary.html', {'motion': motion}).strip())
+    
     def ayes__count(self, motion):
-        return motion.ayes().count()
+        return motion.ayes_count
     ayes__count.short_description = 'Ayes'
+    ayes__count.admin_order_field = 'ayes_count'
     
     def nays__count(self, motion):
-        return motion.nays().count()
+        return motion.nays_count
     nays__count.short_description = 'Nays'
+    nays__count.admin_order_field = 'nays_count'
     
     def abstains__count(self, motion):
-        return motion.abstains().count()
+        return motion.abstains_count
     abstains__count.short_description = 'Abstains'
+    abstains__count.admin_order_field = 'abstains_count'
 
 admin.site.register(Motion, MotionAdmin)
\ No newline at end of file
@@ -0,0 +1,156 @@
+'''
+Ballots, the votes of a member on many motions cast at once
+
+A ballot is validated as a whole before anything is written, and then
+cast with bulk inserts in one transaction: either all its votes are
+cast or none. Besides their own votes members may enter proxy votes for
+other members on the same ballot.
+
+The ballot view authenticates members by the client certificate the web
+server passes on. It is taken from the following setting:
+
+MOTIONS_CLIENT_CERT_VARIABLE
+    Name of the request variable holding the PEM encoded client
+    certificate, 'SSL_CLIENT_CERT' by default as set by Apache with
+    `SSLOptions +ExportCertData`. With nginx, pass `$ssl_client_escaped_cert`
+    in a header and use its name, for example 'HTTP_X_SSL_CLIENT_CERT'.
+'''
+from collections import namedtuple
+import urllib
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction, IntegrityError
+
+from . import certificates, chain
+
+# `voter` is None for a vote of the member entering the ballot, else the
+# member enters a proxy vote for `voter`
+BallotEntry = namedtuple('BallotEntry', ('motion', 'vote', 'voter',
+                                         'justification'))
+
+
+def client_certificate(request):
+    '''
+    PEM encoded client certificate of `request`
+    :rtype: unicode or None
+    :raises ValueError: if the certificate is not ASCII
+    '''
+    pem = request.META.get(getattr(settings, 'MOTIONS_CLIENT_CERT_VARIABLE',
+                                   'SSL_CLIENT_CERT'))
+    if not pem:
+        return None
+    if isinstance(pem, unicode):
+        pem = pem.encode('utf-8')
+    # URL encoded by nginx, PEM contains no percent signs
+    return urllib.unquote(pem).decode('ascii')
+
+
+def authenticate(pem, user=None):
+    '''
+    Member a client certificate belongs to. Without a CA bundle to verify
+    certificates against it is only recorded, the member is `user` then.
+    :param user: user logged in through the session
+    :rtype: User or None if the member is unknown
+    '''
+    verifier = certificates.get_verifier()
+    if verifier is None:
+        if user is not None and user.is_authenticated():
+            return user
+        return None
+    try:
+        user_id = verifier.verify(pem).user_id
+    except ValueError:
+        return None
+    return get_user_model().objects.filter(pk=user_id, is_active=True).first()
+
+
+def cast(member, entries, certificate):
+    '''
+    Cast all votes of a ballot or none of them
+    :param member: the `User` entering the ballot
+    :type  entries: list of BallotEntry
+    :param certificate: Client certificate of the member
+    :type  certificate: unicode or Certificate
+    :rtype: list of Vote in the order of `entries`
+    :raises ValidationError: if any vote cannot be cast, with the problems
+                             by motion number if they concern single votes
+    '''
+    from django.core.exceptions import ValidationError
+    from .models import (Motion, Vote, ProxyVote, Certificate,
+                         adjust_many_tallies, adjust_member_statistics)
+    if not entries:
+        raise ValidationError('The ballot contains no votes.')
+    if not isinstance(certificate, Certificate):
+        certificate = Certificate.from_pem(certificate, member)
+    
+    votes = []
+    for entry in entries:
+        if entry.voter is None:
+            vote = Vote(voter=member)
+        else:
+            vote = ProxyVote(voter=entry.voter, proxy=member,
+                             justification=entry.justification or u'')
+        vote.motion_id = entry.motion
+        vote.vote = entry.vote
+        vote.certificate = certificate
+        votes.append(vote)
+    numbers = set(vote.motion_id for vote in votes)
+    voters = set(vote.voter_id for vote in votes)
+    
+    try:
+        with transaction.atomic():
+            # Finalizing waits for the ballot and the other way round
+            motions = Motion.objects.select_for_update().in_bulk(numbers)
+            voted = set(Vote.objects.filter(motion__in=numbers,
+                                            voter__in=voters)
+                                    .values_list('motion', 'voter'))
+            errors = {}
+            for vote in votes:
+                problems = errors.setdefault(vote.motion_id, [])
+                motion = motions.get(vote.motion_id)
+                if motion is None:
+                    problems.append(u'There is no motion %s.' % vote.motion_id)
+                elif motion.finalized or \
+                        motion.status() != Motion.STATUS_OPEN:
+                    problems.append(u'Motion %s is not open for votes.'
+                                    % vote.motion_id)
+                else:
+                    vote.motion = motion
+                key = (vote.motion_id, vote.voter_id)
+                if key in voted:
+                    problems.append(u'%s already voted on motion %s.' % (
+                        vote.voter.get_username(), vote.motion_id))
+                voted.add(key)
+                try:
+                    vote.clean_fields(exclude=('motion', 'voter', 'proxy',
+                                               'certificate'))
+                    vote.clean()
+                except ValidationError as e:
+                    problems.extend(e.messages)
+            errors = dict((number, problems)
+                          for number, problems in errors.items() if problems)
+            if errors:
+                raise ValidationError(errors)
+            
+            Vote.objects.bulk_create(votes)
+            # Bulk inserts do not return the primary keys
+            keys = dict(((motion, voter), pk) for motion, voter, pk in
+                        Vote.objects.filter(motion__in=numbers,
+                                            voter__in=voters)
+                                    .values_list('motion', 'voter', 'pk'))
+            for vote in votes:
+                vote.pk = keys[vote.motion_id, vote.voter_id]
+                vote._state.adding = False
+            
+            chain.extend(chain.CAST, votes)
+            adjust_many_tallies([(vote.motion_id, vote.vote,
+                                  vote.proxy_id is not None, 1)
+                                 for vote in votes], motions)
+            adjust_member_statistics([(vote.voter_id, vote.vote,
+                                       vote.proxy_id, 1) for vote in votes])
+    except IntegrityError:
+        # A vote of the ballot was cast concurrently
+        raise ValidationError(u'Some of the votes were cast meanwhile, the '
+                              u'ballot was not cast.')
+    return votes
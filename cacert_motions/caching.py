@@ -0,0 +1,146 @@
+'''
+Versioned caching of rendered motions
+
+Cache keys of a motion contain the time it was last saved, the version of
+its votes and its status. `Motion.save()` stamps a new modification time,
+every vote saved or deleted through the models bumps the version and a
+passed due date changes the status, so a changed motion is never looked up
+under its old keys again. Nothing has to be deleted, stale entries expire
+after MOTIONS_CACHE_TIMEOUT. Names of members in the ballots are not part
+of the keys, renamed members show up once the entries expire.
+
+Hits and misses are counted per fragment in the cache as well, the
+`cache_stats` management command reports them. Use a cache shared between
+the workers, with the default per-process cache every worker renders and
+counts on its own.
+
+The following settings are used:
+
+MOTIONS_CACHE_TIMEOUT
+    Seconds rendered fragments and pages are kept (default 86400)
+'''
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+# Fragments counted by `statistics()`
+FRAGMENTS = ('row', 'summary', 'page')
+
+
+def timeout():
+    return getattr(settings, 'MOTIONS_CACHE_TIMEOUT', 86400)
+
+
+def motion_key(motion, fragment, *extra):
+    '''
+    Key of a fragment of `motion` in the state it is in now
+    :param extra: further parts of the key, for fragments rendered in more
+                  than one way
+    :rtype: str
+    '''
+    parts = [fragment, motion.number, motion.modified.isoformat(),
+             str(motion.version), motion.status()]
+    parts.extend(extra)
+    return 'cacert_motions.fragment.%s' % '.'.join(parts)
+
+
+def counter_key(fragment, hit):
+    return 'cacert_motions.cache.%s.%s' % (fragment, 'hits' if hit else 'misses')
+
+
+def count(fragment, hits=0, misses=0):
+    '''
+    Add to the hit and miss counters of `fragment`
+    '''
+    for hit, delta in ((True, int(hits)), (False, int(misses))):
+        if not delta:
+            continue
+        key = counter_key(fragment, hit)
+        try:
+            cache.incr(key, delta)
+        except ValueError:
+            if not cache.add(key, delta, None):
+                cache.incr(key, delta)
+
+
+def statistics(reset=False):
+    '''
+    Hits and misses of every fragment since the counters were last reset
+    :rtype: dict of fragment to dict with `hits`, `misses` and `ratio`
+    '''
+    keys = [counter_key(fragment, hit) for fragment in FRAGMENTS
+            for hit in (True, False)]
+    counters = cache.get_many(keys)
+    if reset:
+        cache.delete_many(keys)
+    result = {}
+    for fragment in FRAGMENTS:
+        hits = counters.get(counter_key(fragment, True), 0)
+        misses = counters.get(counter_key(fragment, False), 0)
+        result[fragment] = {
+            'hits': hits,
+            'misses': misses,
+            'ratio': float(hits) / (hits + misses) if hits + misses else None,
+        }
+    return result
+
+
+def prefetch(motions, fragment):
+    '''
+    Look the fragments of all `motions` up at once, `fragment()` then uses
+    them instead of asking the cache for every motion
+    '''
+    keys = dict((motion_key(motion, fragment), motion) for motion in motions)
+    found = cache.get_many(keys.keys())
+    for key, motion in keys.items():
+        if not hasattr(motion, 'cached_fragments'):
+            motion.cached_fragments = {}
+        # None marks a miss that is already counted
+        motion.cached_fragments[fragment] = found.get(key)
+    count(fragment, hits=len(found), misses=len(keys) - len(found))
+
+
+def fragment(motion, name, render):
+    '''
+    Cached fragment `name` of `motion`, rendered by `render()` and stored
+    on a miss
+    :rtype: unicode
+    '''
+    prefetched = getattr(motion, 'cached_fragments', {})
+    if name in prefetched:
+        content = prefetched[name]
+    else:
+        content = cache.get(motion_key(motion, name))
+        count(name, hits=content is not None, misses=content is None)
+    if content is None:
+        content = render()
+        cache.set(motion_key(motion, name), content, timeout())
+        prefetched[name] = content
+    return content
+
+
+def page(motion, view, render):
+    '''
+    Cached response of `view` for `motion`, rendered by `render()` and
+    stored on a miss if it is successful
+    :param view: name of the view, part of the key
+    :rtype: HttpResponse
+    '''
+    key = motion_key(motion, 'page', view)
+    cached = cache.get(key)
+    count('page', hits=cached is not None, misses=cached is None)
+    if cached is not None:
+        content, content_type = cached
+        return HttpResponse(content, content_type=content_type)
+    
+    def store(response):
+        if response.status_code == 200:
+            cache.set(key, (response.content, response['Content-Type']),
+                      timeout())
+    
+    response = render()
+    if getattr(response, 'is_rendered', True):
+        store(response)
+    else:
+        response.add_post_render_callback(store)
+    return response
@@ -0,0 +1,320 @@
+'''
+Handling of the PEM encoded client certificates votes are cast with
+
+Verification against a CA bundle is optional and needs the `cryptography`
+package. It is enabled by the following settings:
+
+MOTIONS_CA_BUNDLE
+    PEM file with the CA certificates client certificates may be issued by
+MOTIONS_CRL
+    PEM or DER file with the revocation lists of these CAs, reloaded
+    whenever the file changes
+MOTIONS_CERTIFICATE_CACHE_SIZE
+    How many verified certificates are remembered (default 1024)
+MOTIONS_CERTIFICATE_CACHE_TIMEOUT
+    Seconds after which a certificate is verified and mapped to its user
+    again even though it is still valid (default 3600)
+'''
+from collections import namedtuple, OrderedDict
+from datetime import datetime, timedelta
+import binascii
+import hashlib
+import os
+import re
+import threading
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured
+from django.dispatch import receiver
+from django.test.signals import setting_changed
+
+try:
+    from cryptography import x509
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives.asymmetric import dsa, ec, padding, rsa
+except ImportError:
+    x509 = None
+
+PEM_CERTIFICATE = re.compile(
+    r'-----BEGIN CERTIFICATE-----(.*?)-----END CERTIFICATE-----',
+    re.DOTALL,
+)
+BASE64 = re.compile(r'^[A-Za-z0-9+/]+={0,2}$')
+
+def pem_to_der(pem):
+    '''
+    Extract the DER encoded certificate from a PEM string, surrounding text
+    and indentation are ignored
+    :type  pem: unicode
+    :rtype: str
+    :raises ValueError: if `pem` contains no PEM encoded certificate
+    '''
+    match = PEM_CERTIFICATE.search(pem)
+    if not match:
+        raise ValueError('No PEM encoded certificate found')
+    data = ''.join(match.group(1).split())
+    if not BASE64.match(data):
+        raise ValueError('Invalid base64 data in PEM encoded certificate')
+    try:
+        return binascii.a2b_base64(data)
+    except binascii.Error as e:
+        raise ValueError('Invalid base64 data in PEM encoded certificate: %s' % e)
+
+def fingerprint(pem):
+    '''
+    SHA-256 fingerprint of the certificate as lower case hex digits, the
+    same value as `openssl x509 -fingerprint -sha256` without the colons
+    :type  pem: unicode
+    :rtype: str
+    :raises ValueError: if `pem` contains no PEM encoded certificate
+    '''
+    return hashlib.sha256(pem_to_der(pem)).hexdigest()
+
+
+class VerificationError(ValueError):
+    pass
+
+
+VerifiedCertificate = namedtuple('VerifiedCertificate',
+                                 ('fingerprint', 'email', 'user_id', 'expires'))
+
+
+class LRUCache(object):
+    '''
+    Thread safe mapping that forgets the least recently used entries once
+    it holds `size` entries, entries also expire at a given time
+    '''
+    def __init__(self, size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def get(self, key, now):
+        with self._lock:
+            try:
+                value, expires = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            if expires <= now:
+                self.misses += 1
+                return None
+            self._entries[key] = (value, expires)
+            self.hits += 1
+            return value
+    
+    def set(self, key, value, expires):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class Verifier(object):
+    '''
+    Verifies client certificates against a CA bundle and a revocation list
+    and maps them to the user with the certificate's email address.
+    Successful verifications are cached by fingerprint until the
+    certificate expires, the cache times out or the CRL changes.
+    '''
+    def __init__(self, ca_bundle, crl=None, cache_size=1024, cache_timeout=3600):
+        if x509 is None:
+            raise ImproperlyConfigured('Certificate verification requires '
+                                       'the cryptography package')
+        self.crl = crl
+        self.cache = LRUCache(cache_size)
+        self.cache_timeout = timedelta(seconds=cache_timeout)
+        
+        self._cas = {}
+        with open(ca_bundle, 'rb') as f:
+            for match in PEM_CERTIFICATE.finditer(f.read().decode('ascii')):
+                ca = x509.load_der_x509_certificate(pem_to_der(match.group(0)),
+                                                    default_backend())
+                self._cas.setdefault(ca.subject, []).append(ca)
+        if not self._cas:
+            raise ImproperlyConfigured('No CA certificates in %s' % ca_bundle)
+        
+        self._revoked = {}
+        self._crl_mtime = None
+        self._crl_lock = threading.Lock()
+        self._check_crl()
+    
+    def reload_crl(self):
+        '''
+        Read the revocation lists and forget all cached verifications
+        '''
+        with open(self.crl, 'rb') as f:
+            data = f.read()
+        crls = []
+        if b'-----BEGIN' in data:
+            for match in re.finditer(b'-----BEGIN X509 CRL-----.*?'
+                                     b'-----END X509 CRL-----', data, re.DOTALL):
+                crls.append(x509.load_pem_x509_crl(match.group(0),
+                                                   default_backend()))
+        elif data:
+            crls.append(x509.load_der_x509_crl(data, default_backend()))
+        
+        revoked = {}
+        for crl in crls:
+            if not any(crl.is_signature_valid(ca.public_key())
+                       for ca in self._cas.get(crl.issuer, ())):
+                raise VerificationError('CRL of %s is not signed by a known CA'
+                                        % crl.issuer.rfc4514_string())
+            revoked.setdefault(crl.issuer, set()).update(
+                r.serial_number for r in crl)
+        
+        self._revoked = revoked
+        self.cache.clear()
+    
+    def _check_crl(self):
+        if not self.crl:
+            return
+        mtime = os.stat(self.crl).st_mtime
+        if mtime != self._crl_mtime:
+            with self._crl_lock:
+                if mtime != self._crl_mtime:
+                    self.reload_crl()
+                    self._crl_mtime = mtime
+    
+    def verify(self, pem, now=None):
+        '''
+        Verify a client certificate and find the user it belongs to
+        :type  pem: unicode
+        :param now: point in time to check the validity for (UTC)
+        :type  now: datetime.datetime
+        :rtype: VerifiedCertificate
+        :raises VerificationError: if the certificate cannot be trusted or
+                                   belongs to no user
+        :raises ValueError: if `pem` contains no PEM encoded certificate
+        '''
+        if now is None:
+            now = datetime.utcnow()
+        der = pem_to_der(pem)
+        fp = hashlib.sha256(der).hexdigest()
+        
+        self._check_crl()
+        verified = self.cache.get(fp, now)
+        if verified is None:
+            verified = self._verify(der, fp, now)
+            self.cache.set(fp, verified,
+                           min(verified.expires, now + self.cache_timeout))
+        return verified
+    
+    def _verify(self, der, fp, now):
+        try:
+            certificate = x509.load_der_x509_certificate(der, default_backend())
+        except ValueError as e:
+            raise VerificationError('Unreadable certificate: %s' % e)
+        
+        if not certificate.not_valid_before <= now < certificate.not_valid_after:
+            raise VerificationError('Certificate is not valid at %s' % now)
+        
+        issuer = None
+        for ca in self._cas.get(certificate.issuer, ()):
+            if ca.not_valid_before <= now < ca.not_valid_after and \
+                    _is_signed_by(certificate, ca):
+                issuer = ca
+                break
+        if issuer is None:
+            raise VerificationError('Certificate is not issued by a known CA')
+        
+        if certificate.serial_number in self._revoked.get(certificate.issuer, ()):
+            raise VerificationError('Certificate has been revoked')
+        
+        email = _email_address(certificate)
+        if not email:
+            raise VerificationError('Certificate contains no email address')
+        User = get_user_model()
+        try:
+            user_id = User._default_manager.filter(is_active=True) \
+                          .values_list('pk', flat=True).get(email__iexact=email)
+        except User.DoesNotExist:
+            raise VerificationError('No user with the email address %s' % email)
+        except User.MultipleObjectsReturned:
+            raise VerificationError('Several users with the email address %s'
+                                    % email)
+        
+        return VerifiedCertificate(
+            fingerprint=fp,
+            email=email,
+            user_id=user_id,
+            expires=min(certificate.not_valid_after, issuer.not_valid_after),
+        )
+
+
+def _is_signed_by(certificate, ca):
+    key = ca.public_key()
+    args = (certificate.signature, certificate.tbs_certificate_bytes)
+    try:
+        if isinstance(key, rsa.RSAPublicKey):
+            key.verify(*args + (padding.PKCS1v15(),
+                                certificate.signature_hash_algorithm))
+        elif isinstance(key, ec.EllipticCurvePublicKey):
+            key.verify(*args + (ec.ECDSA(certificate.signature_hash_algorithm),))
+        elif isinstance(key, dsa.DSAPublicKey):
+            key.verify(*args + (certificate.signature_hash_algorithm,))
+        else:
+            return False
+    except InvalidSignature:
+        return False
+    return True
+
+def _email_address(certificate):
+    try:
+        san = certificate.extensions.get_extension_for_class(
+            x509.SubjectAlternativeName)
+        emails = san.value.get_values_for_type(x509.RFC822Name)
+        if emails:
+            return emails[0]
+    except x509.ExtensionNotFound:
+        pass
+    emails = certificate.subject.get_attributes_for_oid(
+        x509.oid.NameOID.EMAIL_ADDRESS)
+    if emails:
+        return emails[0].value
+    return None
+
+
+_verifier = None
+_verifier_lock = threading.Lock()
+
+def get_verifier():
+    '''
+    The verifier configured in the settings
+    :rtype: Verifier or None if verification is disabled
+    '''
+    global _verifier
+    ca_bundle = getattr(settings, 'MOTIONS_CA_BUNDLE', None)
+    if not ca_bundle:
+        return None
+    if _verifier is None:
+        with _verifier_lock:
+            if _verifier is None:
+                _verifier = Verifier(
+                    ca_bundle,
+                    crl=getattr(settings, 'MOTIONS_CRL', None),
+                    cache_size=getattr(settings,
+                                       'MOTIONS_CERTIFICATE_CACHE_SIZE', 1024),
+                    cache_timeout=getattr(settings,
+                                          'MOTIONS_CERTIFICATE_CACHE_TIMEOUT',
+                                          3600),
+                )
+    return _verifier
+
+@receiver(setting_changed)
+def _reset_verifier(sender, setting, **kwargs):
+    global _verifier
+    if setting.startswith('MOTIONS_'):
+        _verifier = None
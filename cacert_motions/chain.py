@@ -0,0 +1,269 @@
+'''
+Tamper-evident log of the votes
+
+Every vote that is cast, changed or deleted through the models appends an
+entry to a hash chain, the hash of each entry covers the hash of the entry
+before it and the content of the vote. Appends are serialized by a lock on
+the head of the chain.
+
+Changes to the votes that bypass the models show up as votes that differ
+from their last entry, rewriting the chain to match them requires the key
+that signs the checkpoints. `verify()` rehashes the chain from the last
+checkpoint with a valid signature and compares the votes touched since
+then, or rehashes everything and compares all votes. The `verify_votes`
+management command runs it and stores a checkpoint of the verified head,
+run it regularly to keep incremental verifications short.
+
+The following settings are used:
+
+MOTIONS_CHAIN_KEY
+    Secret used to sign the checkpoints (defaults to SECRET_KEY), keep it
+    away from the database server
+'''
+import hashlib
+
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.db.models import Max, Q
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from . import certificates
+
+GENESIS = '0' * 64
+
+CAST = 'cast'
+CHANGE = 'change'
+DELETE = 'delete'
+
+
+def content(motion, vote):
+    '''
+    Content of a vote in the chain
+    :param motion: number of the motion voted on
+    :param vote: values of `MotionResult.DIGEST_FIELDS` of the vote
+    :type  vote: tuple
+    :rtype: unicode
+    '''
+    from .models import MotionResult
+    return motion + u' ' + MotionResult.digest_line(vote).decode('utf-8')
+
+
+def vote_content(vote):
+    ':type  vote: Vote'
+    return content(vote.motion_id, (
+        vote.pk, vote.voter_id, vote.vote, vote.proxy_id,
+        vote.justification, vote.certificate_id, vote.timestamp))
+
+
+def entry_hash(previous, operation, content):
+    ':rtype: str'
+    return hashlib.sha256((u'%s %s %s' % (previous, operation, content))
+                          .encode('utf-8')).hexdigest()
+
+
+def sign(entry, hash):
+    ':rtype: str'
+    return salted_hmac('cacert_motions.chain', '%d %s' % (entry, hash),
+                       getattr(settings, 'MOTIONS_CHAIN_KEY', None)) \
+        .hexdigest()
+
+
+def _lock_head():
+    from .models import VoteChainHead
+    try:
+        return VoteChainHead.objects.select_for_update().get(pk=1)
+    except VoteChainHead.DoesNotExist:
+        try:
+            with transaction.atomic():
+                return VoteChainHead.objects.create(pk=1, entry=0,
+                                                    hash=GENESIS)
+        except IntegrityError:
+            # Lost the race to create the head, it exists now
+            return _lock_head()
+
+
+def append(operation, vote):
+    '''
+    Append a change of `vote` to the chain, call this inside the
+    transaction that changes the vote
+    :param operation: CAST, CHANGE or DELETE
+    :type  vote: Vote
+    :rtype: VoteChainEntry
+    '''
+    from .models import VoteChainEntry, VoteChainHead
+    head = _lock_head()
+    line = vote_content(vote)
+    entry = VoteChainEntry.objects.create(
+        operation=operation,
+        vote_id=vote.pk,
+        content=line,
+        hash=entry_hash(head.hash, operation, line),
+    )
+    VoteChainHead.objects.filter(pk=1).update(entry=entry.pk, hash=entry.hash)
+    return entry
+
+
+def extend(operation, votes):
+    '''
+    Append the same change of many votes to the chain in their order with
+    one insert, call this inside the transaction that changes the votes
+    :param operation: CAST, CHANGE or DELETE
+    :type  votes: list of Vote
+    :rtype: list of VoteChainEntry
+    '''
+    from .models import VoteChainEntry, VoteChainHead
+    if not votes:
+        return []
+    head = _lock_head()
+    previous, entries = head.hash, []
+    for vote in votes:
+        line = vote_content(vote)
+        previous = entry_hash(previous, operation, line)
+        entries.append(VoteChainEntry(operation=operation, vote_id=vote.pk,
+                                      content=line, hash=previous))
+    VoteChainEntry.objects.bulk_create(entries)
+    # Nobody else appends while the head is locked, the new entries are the
+    # last ones
+    last = VoteChainEntry.objects.filter(pk__gt=head.entry).order_by('-pk') \
+                                 .values_list('pk', flat=True).first()
+    VoteChainHead.objects.filter(pk=1).update(entry=last, hash=previous)
+    return entries
+
+
+def checkpoint(entry, hash):
+    '''
+    Sign a verified entry of the chain
+    :param entry: primary key of the entry
+    :param hash: hash of the entry
+    :rtype: VoteChainCheckpoint
+    '''
+    from .models import VoteChainCheckpoint
+    return VoteChainCheckpoint.objects.create(entry=entry, hash=hash,
+                                              signature=sign(entry, hash))
+
+
+def trusted_checkpoint(problems):
+    '''
+    Newest checkpoint with a valid signature, checkpoints with an invalid
+    one are added to `problems`
+    :rtype: VoteChainCheckpoint or None
+    '''
+    from .models import VoteChainCheckpoint
+    for checkpoint in VoteChainCheckpoint.objects.order_by('-entry', '-pk') \
+                                                 .iterator():
+        if constant_time_compare(checkpoint.signature,
+                                 sign(checkpoint.entry, checkpoint.hash)):
+            return checkpoint
+        problems.append('Checkpoint %d has an invalid signature'
+                        % checkpoint.pk)
+    return None
+
+
+def verify(full=False):
+    '''
+    Rehash the chain and compare the votes with their last entries, from
+    the last trusted checkpoint on unless `full`. Votes changed while
+    verifying are compared by the next run.
+    :rtype: (int number of entries rehashed, (primary key, hash) of the
+            last entry, list of problems found)
+    '''
+    from .models import Vote, VoteChainEntry, VoteChainHead, MotionResult
+    problems = []
+    start, previous = 0, GENESIS
+    if not full:
+        checkpoint = trusted_checkpoint(problems)
+        if checkpoint is not None:
+            start, previous = checkpoint.entry, checkpoint.hash
+            stored = VoteChainEntry.objects.filter(pk=start) \
+                                           .values_list('hash', flat=True) \
+                                           .first()
+            if stored != previous:
+                problems.append('Entry %d does not match checkpoint %d'
+                                % (start, checkpoint.pk))
+    
+    # Entries appended while verifying are left to the next run, the head
+    # is read first and bounds everything read after it
+    head = VoteChainHead.objects.filter(pk=1).values_list('entry', 'hash') \
+                                .first() or (0, GENESIS)
+    entries = VoteChainEntry.objects.filter(pk__gt=start, pk__lte=head[0]) \
+                                    .order_by('pk')
+    count, last = 0, start
+    for pk, operation, line, hash in entries.values_list(
+            'pk', 'operation', 'content', 'hash').iterator():
+        previous = entry_hash(previous, operation, line)
+        if previous != hash:
+            problems.append('Entry %d does not match its hash' % pk)
+            # Continue from the stored hash to find further changes
+            previous = hash
+        count, last = count + 1, pk
+    if head != (last, previous):
+        problems.append('The head of the chain is at entry %d, the last '
+                        'entry is %d' % (head[0], last))
+    
+    # Merge the last entry of every vote with the vote, both in the order
+    # of the votes
+    chained = VoteChainEntry.objects.filter(pk__lte=head[0])
+    entries = chained.order_by('vote_id', 'pk')
+    votes = Vote.objects.order_by('pk')
+    if not full:
+        touched = chained.filter(pk__gt=start).values('vote_id')
+        entries = entries.filter(vote_id__in=touched)
+        # Votes inserted without an entry are newer than all chained votes
+        newest = chained.aggregate(newest=Max('vote_id'))
+        votes = votes.filter(Q(pk__in=touched) |
+                             Q(pk__gt=newest['newest'] or 0))
+    entries = _last_entries(entries.values_list('vote_id', 'operation',
+                                                'content').iterator())
+    votes = votes.values_list('motion', *MotionResult.DIGEST_FIELDS) \
+                 .iterator()
+    entry, vote = next(entries, None), next(votes, None)
+    mismatches = []
+    while entry is not None or vote is not None:
+        if vote is None or (entry is not None and entry[0] < vote[1]):
+            if entry[1] != DELETE:
+                mismatches.append((entry[0], 'Vote %d was deleted'))
+            entry = next(entries, None)
+        elif entry is None or vote[1] < entry[0]:
+            mismatches.append((vote[1], 'Vote %d is not in the chain'))
+            vote = next(votes, None)
+        else:
+            if entry[1] == DELETE:
+                mismatches.append((vote[1], 'Vote %d was deleted but exists'))
+            elif entry[2] != content(vote[0], vote[1:]):
+                mismatches.append((vote[1],
+                                   'Vote %d does not match the chain'))
+            entry, vote = next(entries, None), next(votes, None)
+    if mismatches:
+        # Votes changed through the models since the head was read have
+        # entries after it, they are compared by the next run
+        changed = set(VoteChainEntry.objects.filter(pk__gt=head[0])
+                                            .values_list('vote_id', flat=True))
+        problems.extend(message % pk for pk, message in mismatches
+                        if pk not in changed)
+    
+    if full:
+        from .models import Certificate
+        for fingerprint, pem in Certificate.objects.values_list(
+                'fingerprint', 'pem').iterator():
+            try:
+                valid = certificates.fingerprint(pem) == fingerprint
+            except ValueError:
+                valid = False
+            if not valid:
+                problems.append('Certificate %s does not match its '
+                                'fingerprint' % fingerprint)
+    return count, (last, previous), problems
+
+
+def _last_entries(entries):
+    '''
+    Only the last of the entries of every vote
+    :param entries: (vote_id, operation, content) ordered by vote and entry
+    '''
+    last = None
+    for entry in entries:
+        if last is not None and last[0] != entry[0]:
+            yield last
+        last = entry
+    if last is not None:
+        yield last
@@ -0,0 +1,166 @@
+'''
+Streaming export of motions and their votes
+
+Motions are read in chunks ordered by the (created, number) index, each
+chunk with one query for the motions and one for their votes. Rows are
+produced as the chunks arrive so memory use only depends on the chunk
+size, not on the size of the archive.
+'''
+import csv
+import json
+from datetime import timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+from .models import Motion, Vote
+
+
+CHUNK_SIZE = 500
+
+CSV_FIELDS = (
+    'number', 'title', 'status', 'approved', 'rule', 'quorum', 'proponent',
+    'created', 'due', 'ayes', 'nays', 'abstains', 'proxies', 'digest',
+    'voter', 'vote', 'proxy', 'justification', 'timestamp',
+)
+
+
+def filter_motions(status=None, since=None, until=None):
+    '''
+    Motions to export
+    :param status: one of `Motion.STATUSES`
+    :param since: first day of creation to include
+    :type  since: date
+    :param until: last day of creation to include
+    :type  until: date
+    :rtype: MotionQuerySet
+    '''
+    qs = Motion.objects.all()
+    if status:
+        qs = getattr(qs, status)()
+    # Motion numbers start with the day of creation, m20140101 sorts
+    # before and m20140102 after all motions of 2014-01-01
+    if since:
+        qs = qs.filter(number__gte=since.strftime('m%Y%m%d'))
+    if until:
+        qs = qs.filter(number__lt=(until + timedelta(days=1))
+                                  .strftime('m%Y%m%d'))
+    return qs
+
+
+def iter_motions(motions, chunk_size=CHUNK_SIZE):
+    '''
+    Motions with their votes, oldest first
+    :type  motions: MotionQuerySet
+    :rtype: iterator over (Motion, list of Vote)
+    '''
+    # Motions closing during the export are decided as of its start
+    motions = motions.select_related('proponent', 'result') \
+                     .with_outcomes().order_by('created', 'number')
+    last = None
+    while True:
+        chunk = motions
+        if last is not None:
+            chunk = chunk.filter(Q(created__gt=last.created) |
+                                 Q(created=last.created, number__gt=last.number))
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+        
+        votes = dict((motion.number, []) for motion in chunk)
+        for vote in Vote.objects.filter(motion__in=list(votes)) \
+                                .select_related('voter', 'proxy') \
+                                .order_by('motion', 'timestamp', 'pk') \
+                                .iterator():
+            votes[vote.motion_id].append(vote)
+        for motion in chunk:
+            for vote in votes[motion.number]:
+                vote.motion = motion
+            yield motion, votes[motion.number]
+        last = chunk[-1]
+
+
+def motion_record(motion, votes):
+    '''
+    JSON compatible representation of a motion with its votes, as served by
+    the API
+    :rtype: dict
+    '''
+    return {
+        'number': motion.number,
+        'title': motion.title,
+        'status': motion.status(),
+        'approved': motion.approved(),
+        'rule': motion.rule,
+        'quorum': motion.quorum,
+        'due': motion.due,
+        'tally': [motion.ayes_count, motion.nays_count,
+                  motion.abstains_count, motion.proxies_count],
+        'version': motion.version,
+        'text': motion.text,
+        'proponent': motion.proponent.get_username(),
+        'created': motion.created,
+        'modified': motion.modified,
+        'digest': motion.result.digest if motion.finalized else None,
+        'votes': [{
+            'voter': vote.voter.get_username(),
+            'vote': vote.vote,
+            'proxy': vote.proxy.get_username() if vote.proxy_id else None,
+            'justification': vote.justification,
+            'timestamp': vote.timestamp,
+        } for vote in votes],
+    }
+
+
+def jsonl_lines(motions, chunk_size=CHUNK_SIZE):
+    '''
+    One JSON object per motion and line
+    :rtype: iterator over str
+    '''
+    for motion, votes in iter_motions(motions, chunk_size):
+        yield json.dumps(motion_record(motion, votes), cls=DjangoJSONEncoder,
+                         separators=(',', ':')) + '\n'
+
+
+class _Echo(object):
+    def write(self, value):
+        return value
+
+
+def _encode(value):
+    return '' if value is None else unicode(value).encode('utf-8')
+
+
+def csv_lines(motions, chunk_size=CHUNK_SIZE):
+    '''
+    One CSV row per vote with the columns of its motion repeated, motions
+    without votes get a single row with empty vote columns
+    :rtype: iterator over UTF-8 encoded str
+    '''
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_FIELDS)
+    for motion, votes in iter_motions(motions, chunk_size):
+        row = [
+            motion.number, motion.title, motion.status(), motion.approved(),
+            motion.rule, motion.quorum, motion.proponent.get_username(),
+            motion.created.isoformat(),
+            motion.due.isoformat(), motion.ayes_count, motion.nays_count,
+            motion.abstains_count, motion.proxies_count,
+            motion.result.digest if motion.finalized else None,
+        ]
+        for vote in votes or [None]:
+            if vote is None:
+                vote_row = [None] * 5
+            else:
+                vote_row = [
+                    vote.voter.get_username(), vote.get_vote_display(),
+                    vote.proxy.get_username() if vote.proxy_id else None,
+                    vote.justification, vote.timestamp.isoformat(),
+                ]
+            yield writer.writerow([_encode(value) for value in row + vote_row])
+
+
+FORMATS = {
+    'csv': (csv_lines, 'text/csv; charset=utf-8'),
+    'jsonl': (jsonl_lines, 'application/x-ndjson'),
+}
@@ -0,0 +1,389 @@
+'''
+Streaming import of archived motions and their votes
+
+Reads the CSV and JSON lines formats written by `export`, motions keep
+their numbers. Records are read one motion at a time and handled in
+batches: each batch is validated with a few queries for all its motions,
+members and votes, and written with bulk inserts in one transaction. Only
+the current batch is held in memory, no matter how large the archive is.
+
+Motions that already exist are skipped, so an interrupted import can
+simply be run again. Invalid motions are reported and skipped with all
+their votes. Imported votes are recorded with the certificate of the
+member running the import and appended to the hash chain, imported motions
+are indexed for the search and counted in the member statistics. Closed
+motions are imported without a result, finalize them afterwards with the
+`finalize_motions` command. Their results were announced where they come
+from and are recorded as sent, members get no mail about them.
+
+Motions keep their decision rule and quorum, archives without them get the
+default rule. The outcome of a closed motion is checked against the
+archive; its digest covers the original keys and certificates of the
+votes, which the import does not keep, and is not checked.
+'''
+from collections import namedtuple
+from contextlib import contextmanager
+import csv
+import json
+import re
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import reset_queries, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import (Motion, MotionListVersion, MotionSequence, Vote,
+                     ProxyVote, TALLY_FIELDS, adjust_member_statistics)
+from . import chain, notifications, rules, search
+
+
+# Motions and votes validated and written together, below the limit of 999
+# parameters per query of SQLite
+BATCH_SIZE = 500
+
+MOTION_NUMBER = re.compile(r'^m(\d{4})(\d{2})(\d{2})\.([1-9]\d*)$')
+
+# Vote values by their labels in the CSV format
+CSV_VOTES = dict((label, value) for value, label in Vote.VOTE_CHOICES)
+CSV_OUTCOMES = {'True': True, 'False': False}
+
+Problem = namedtuple('Problem', ('line', 'number', 'message'))
+
+
+class InvalidRecord(ValueError):
+    pass
+
+
+def read_jsonl(lines):
+    '''
+    Records of the JSON lines format
+    :param lines: iterable over the lines of the archive
+    :rtype: iterator over (line number, dict)
+    '''
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            record = {'error': u'Unreadable JSON: %s' % e}
+        yield line_number, record
+
+
+def read_csv(lines):
+    '''
+    Records of the CSV format, the rows of the votes on a motion follow
+    each other
+    :param lines: iterable over the UTF-8 encoded lines of the archive
+    :rtype: iterator over (line number of the first row, dict)
+    '''
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if header is None:
+        return
+    record = None
+    for row in reader:
+        row = dict((field, value.decode('utf-8'))
+                   for field, value in zip(header, row))
+        if record is None or row.get('number') != record['number']:
+            if record is not None:
+                yield start, record
+            start = reader.line_num
+            record = dict(row, votes=[],
+                          approved=CSV_OUTCOMES.get(row.get('approved')))
+            try:
+                record['tally'] = [int(row[field]) for field in
+                                   ('ayes', 'nays', 'abstains', 'proxies')]
+            except (KeyError, ValueError):
+                record['tally'] = None
+        if row.get('voter'):
+            record['votes'].append({
+                'voter': row['voter'],
+                'vote': CSV_VOTES.get(row.get('vote'), row.get('vote')),
+                'proxy': row.get('proxy') or None,
+                'justification': row.get('justification', u''),
+                'timestamp': row.get('timestamp'),
+            })
+    if record is not None:
+        yield start, record
+
+
+FORMATS = {
+    'csv': read_csv,
+    'jsonl': read_jsonl,
+}
+
+
+def batches(records, batch_size=BATCH_SIZE):
+    '''
+    Group records into batches of about `batch_size` motions and votes, a
+    motion is never split
+    '''
+    batch, size = [], 0
+    for line, record in records:
+        batch.append((line, record))
+        size += 1 + len(record.get('votes') or ())
+        if size >= batch_size:
+            yield batch
+            batch, size = [], 0
+    if batch:
+        yield batch
+
+
+def _datetime(value, name):
+    '''
+    Aware datetime in UTC, naive values are taken as local time
+    '''
+    try:
+        moment = parse_datetime(value) if value else None
+    except ValueError:
+        moment = None
+    if moment is None:
+        raise InvalidRecord(u'Invalid %s: %r' % (name, value))
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment, timezone.get_current_timezone())
+    return moment.astimezone(timezone.utc)
+
+
+@contextmanager
+def _original_timestamps():
+    '''
+    Insert the timestamps of the archive instead of the current time. This
+    changes the fields for the whole process, the import runs in its own.
+    '''
+    fields = [Motion._meta.get_field('created'),
+              Motion._meta.get_field('modified'),
+              Vote._meta.get_field('timestamp')]
+    saved = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, saved):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Importer(object):
+    '''
+    Imports batches of records, see `run()`
+    '''
+    def __init__(self, certificate, batch_size=BATCH_SIZE, dry_run=False):
+        '''
+        :param certificate: certificate the votes are recorded with
+        :type  certificate: Certificate
+        :param dry_run: only validate the records
+        '''
+        self.certificate = certificate
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        # Primary keys of members by username, bounded by the number of
+        # members and not by the size of the archive
+        self.members = {}
+    
+    def run(self, records):
+        '''
+        Import all records
+        :param records: (line number, record) as read by `read_csv()` or
+                        `read_jsonl()`
+        :rtype: iterator over the statistics of every batch, a dict with the
+                numbers of `motions` and `votes` imported, the motions
+                `skipped` as they exist, and the list of `problems`
+        '''
+        for batch in batches(records, self.batch_size):
+            yield self.import_batch(batch)
+            # With DEBUG the queries would be kept for the whole import
+            reset_queries()
+    
+    def member(self, username):
+        pk = self.members.get(username)
+        if pk is None:
+            raise InvalidRecord(u'There is no member %s.' % username)
+        return pk
+    
+    def load_members(self, batch):
+        User = get_user_model()
+        usernames = set()
+        for line, record in batch:
+            usernames.add(record.get('proponent'))
+            for vote in record.get('votes') or ():
+                usernames.update((vote.get('voter'), vote.get('proxy')))
+        usernames = sorted(username for username in usernames
+                           if username and username not in self.members)
+        # Voters and proxies may outnumber the rows of the batch
+        for start in range(0, len(usernames), self.batch_size):
+            self.members.update(User.objects.filter(**{
+                '%s__in' % User.USERNAME_FIELD:
+                    usernames[start:start + self.batch_size]
+            }).values_list(User.USERNAME_FIELD, 'pk'))
+    
+    def build(self, record):
+        '''
+        Motion and votes of a record with the tallies counted from the votes
+        :rtype: (Motion, list of Vote)
+        :raises InvalidRecord: if the record is not valid
+        '''
+        from django.core.exceptions import ValidationError
+        if 'error' in record:
+            raise InvalidRecord(record['error'])
+        number = record.get('number') or u''
+        match = MOTION_NUMBER.match(number)
+        if not match:
+            raise InvalidRecord(u'Invalid motion number: %r' % number)
+        created = _datetime(record.get('created'), 'created')
+        if created.strftime('%Y%m%d') != u''.join(match.groups()[:3]):
+            raise InvalidRecord(u'Motion %s was not created on the day of '
+                                u'its number.' % number)
+        rule = record.get('rule') or rules.DEFAULT
+        if rule not in rules.RULES:
+            raise InvalidRecord(u'Unknown rule: %r' % rule)
+        try:
+            quorum = int(record.get('quorum') or 0)
+        except (TypeError, ValueError):
+            quorum = -1
+        if quorum < 0:
+            raise InvalidRecord(u'Invalid quorum: %r' % record['quorum'])
+        motion = Motion(
+            number=number,
+            title=record.get('title') or u'',
+            text=record.get('text') or u'',
+            proponent_id=self.member(record.get('proponent')),
+            created=created,
+            modified=_datetime(record['modified'], 'modified')
+                     if record.get('modified') else created,
+            due=_datetime(record.get('due'), 'due'),
+            withdrawn=record.get('status') == Motion.STATUS_WITHDRAWN,
+            rule=rule,
+            quorum=quorum,
+        )
+        
+        president = getattr(settings, 'MOTIONS_PRESIDENT', None)
+        votes, voters, casting_vote = [], set(), None
+        for data in record.get('votes') or ():
+            voter = self.member(data.get('voter'))
+            if voter in voters:
+                raise InvalidRecord(u'%s voted twice.' % data['voter'])
+            voters.add(voter)
+            if president is not None and data['voter'] == president:
+                casting_vote = data.get('vote')
+            vote = (Vote if data.get('proxy') is None else ProxyVote)(
+                motion_id=number,
+                voter_id=voter,
+                vote=data.get('vote'),
+                proxy_id=self.member(data['proxy'])
+                         if data.get('proxy') else None,
+                justification=data.get('justification') or u'',
+                timestamp=_datetime(data.get('timestamp'), 'timestamp'),
+                certificate=self.certificate,
+            )
+            try:
+                vote.clean_fields(exclude=('motion', 'voter', 'proxy',
+                                           'certificate'))
+                vote.clean()
+            except ValidationError as e:
+                raise InvalidRecord(u'Vote of %s: %s' % (
+                    data['voter'], u' '.join(e.messages)))
+            if vote.vote not in TALLY_FIELDS:
+                raise InvalidRecord(u'Vote of %s: invalid vote %r'
+                                    % (data['voter'], vote.vote))
+            field = TALLY_FIELDS[vote.vote]
+            setattr(motion, field, getattr(motion, field) + 1)
+            if vote.proxy_id is not None:
+                motion.proxies_count += 1
+            motion.version += 1
+            motion.voted = max(motion.voted or vote.timestamp, vote.timestamp)
+            votes.append(vote)
+        
+        tally = [motion.ayes_count, motion.nays_count, motion.abstains_count,
+                 motion.proxies_count]
+        if record.get('tally') is not None and \
+                list(record['tally']) != tally:
+            raise InvalidRecord(u'The votes do not match the tally %s.'
+                                % (record['tally'],))
+        # Only closed motions were exported with an outcome
+        if record.get('approved') is not None:
+            tally = rules.Tally(*tally, casting_vote=casting_vote)
+            if rules.decide(motion, tally) != record['approved']:
+                raise InvalidRecord(u'The votes do not decide the motion as '
+                                    u'archived.')
+        try:
+            # The CSV format has no texts
+            motion.clean_fields(exclude=('proponent',) if 'text' in record
+                                        else ('proponent', 'text'))
+        except ValidationError as e:
+            raise InvalidRecord(u' '.join(e.messages))
+        return motion, votes
+    
+    def import_batch(self, batch):
+        '''
+        Validate and write one batch
+        :param batch: list of (line number, record)
+        :rtype: dict, see `run()`
+        '''
+        self.load_members(batch)
+        numbers = [record.get('number') for line, record in batch]
+        existing = set(Motion.objects.filter(pk__in=numbers)
+                                     .values_list('pk', flat=True))
+        stats = {'motions': 0, 'votes': 0, 'skipped': 0, 'problems': []}
+        motions, votes, seen = [], [], set()
+        for line, record in batch:
+            number = record.get('number')
+            if number in existing:
+                stats['skipped'] += 1
+                continue
+            try:
+                if number in seen:
+                    raise InvalidRecord(u'Motion %s appears twice.' % number)
+                motion, motion_votes = self.build(record)
+            except InvalidRecord as e:
+                stats['problems'].append(Problem(line, number, unicode(e)))
+                continue
+            seen.add(number)
+            motions.append(motion)
+            votes.extend(motion_votes)
+        
+        if not self.dry_run and motions:
+            with transaction.atomic():
+                self.write(motions, votes)
+        stats['motions'], stats['votes'] = len(motions), len(votes)
+        return stats
+    
+    def write(self, motions, votes):
+        with _original_timestamps():
+            Motion.objects.bulk_create(motions)
+            Vote.objects.bulk_create(votes)
+        # Bulk inserts do not return the primary keys
+        keys = dict(((motion, voter), pk) for motion, voter, pk in
+                    Vote.objects.filter(motion__in=[m.number for m in motions])
+                                .values_list('motion', 'voter', 'pk'))
+        for vote in votes:
+            vote.pk = keys[vote.motion_id, vote.voter_id]
+        chain.extend(chain.CAST, votes)
+        adjust_member_statistics([(vote.voter_id, vote.vote, vote.proxy_id, 1)
+                                  for vote in votes])
+        search.get_backend().index_many(motions)
+        notifications.mark_sent([motion.number for motion in motions],
+                                notifications.RESULT)
+        self.reserve_numbers(motions)
+        MotionListVersion.bump()
+    
+    @staticmethod
+    def reserve_numbers(motions):
+        '''
+        Continue the numbering of every day after the imported motions
+        '''
+        last = {}
+        for motion in motions:
+            match = MOTION_NUMBER.match(motion.number)
+            day = motion.created.date()
+            last[day] = max(last.get(day, 0), int(match.group(4)))
+        sequences = MotionSequence.objects.select_for_update() \
+                                          .in_bulk(list(last))
+        MotionSequence.objects.bulk_create([
+            MotionSequence(day=day, last=index)
+            for day, index in last.items() if day not in sequences])
+        for day, sequence in sequences.items():
+            if sequence.last < last[day]:
+                MotionSequence.objects.filter(day=day) \
+                                      .update(last=last[day])
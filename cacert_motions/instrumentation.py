@@ -0,0 +1,231 @@
+'''
+Query counts, SQL time and response time of requests, checked against
+per-view query budgets
+
+`QueryInstrumentationMiddleware` records every request. Put it first in
+MIDDLEWARE_CLASSES so the queries of the other middleware are counted as
+well. The following settings are used:
+
+MOTIONS_QUERY_BUDGETS
+    Budgets of views that cannot be decorated with `query_budget()`, by URL
+    name including the namespace (for example
+    'admin:cacert_motions_motion_changelist')
+MOTIONS_QUERY_BUDGET_ACTION
+    'warn' to log requests over budget (default), 'fail' to raise
+    `QueryBudgetExceeded`
+MOTIONS_INSTRUMENTATION_HEADERS
+    Whether to add the measurements to the response headers (defaults to
+    DEBUG)
+
+Every request is logged to the 'cacert_motions.requests' logger as a JSON
+object, requests over budget with level WARNING. Streaming responses are
+measured once their body is consumed, without the headers. Queries are
+counted by `QueryCounter`, which keeps none of their SQL.
+'''
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.core.urlresolvers import resolve
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+
+logger = logging.getLogger('cacert_motions.requests')
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(queries):
+    '''
+    Declare the maximum number of queries a view may need
+    '''
+    def decorator(view):
+        view.query_budget = queries
+        return view
+    return decorator
+
+
+def get_budget(view, resolver_match):
+    '''
+    Budget of a view, declared with `query_budget()` or in the setting
+    MOTIONS_QUERY_BUDGETS
+    :rtype: int or None
+    '''
+    budget = getattr(view, 'query_budget', None)
+    if budget is None and resolver_match is not None:
+        budgets = getattr(settings, 'MOTIONS_QUERY_BUDGETS', {})
+        budget = budgets.get(resolver_match.view_name)
+    return budget
+
+
+class CountingCursorWrapper(object):
+    '''
+    Cursor that adds its queries to a `QueryCounter`
+    '''
+    def __init__(self, cursor, counter):
+        self.cursor = cursor
+        self.counter = counter
+    
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+    
+    def __iter__(self):
+        return iter(self.cursor)
+    
+    def execute(self, sql, params=None):
+        start = time.time()
+        try:
+            return self.cursor.execute(sql, params)
+        finally:
+            self.counter.add(time.time() - start)
+    
+    def executemany(self, sql, param_list):
+        start = time.time()
+        try:
+            return self.cursor.executemany(sql, param_list)
+        finally:
+            self.counter.add(time.time() - start)
+
+
+class QueryCounter(object):
+    '''
+    Number and time of all queries of a connection, see `get()`. Unlike
+    the debug cursors of Django, which keep the SQL of every query until
+    the end of the request, it keeps two numbers.
+    '''
+    def __init__(self, connection):
+        self.count, self.seconds = 0, 0.0
+        cursor = connection.cursor
+        connection.cursor = lambda: CountingCursorWrapper(cursor(), self)
+    
+    @classmethod
+    def get(cls, connection):
+        '''
+        Counter of `connection`, installed on first use
+        :rtype: QueryCounter
+        '''
+        counter = getattr(connection, 'query_counter', None)
+        if counter is None:
+            counter = connection.query_counter = cls(connection)
+        return counter
+    
+    def add(self, seconds):
+        self.count += 1
+        self.seconds += seconds
+
+
+class QueryInstrumentationMiddleware(object):
+    def process_request(self, request):
+        counters = [QueryCounter.get(connection)
+                    for connection in connections.all()]
+        request._instrumentation = {
+            'start': time.time(),
+            'counters': [(counter, counter.count, counter.seconds)
+                         for counter in counters],
+        }
+    
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = getattr(request, '_instrumentation', None)
+        if state is not None:
+            state['budget'] = get_budget(view_func,
+                                         getattr(request, 'resolver_match',
+                                                 None))
+    
+    def process_response(self, request, response):
+        state = getattr(request, '_instrumentation', None)
+        if state is None:
+            return response
+        del request._instrumentation
+        
+        if response.streaming:
+            # The body is produced after the middleware, by the server
+            response.streaming_content = self.stream(
+                request, response, state, response.streaming_content)
+            return response
+        error = self.finish(request, response, state)
+        if error is not None:
+            raise error
+        return response
+    
+    def stream(self, request, response, state, content):
+        '''
+        Pass on the body of a streaming response, then measure the request
+        '''
+        complete = False
+        try:
+            for chunk in content:
+                yield chunk
+            complete = True
+        finally:
+            error = self.finish(request, response, state)
+        if complete and error is not None:
+            raise error
+    
+    def finish(self, request, response, state):
+        '''
+        Log the measurements of a request and add them to the headers
+        :rtype: QueryBudgetExceeded to raise or None
+        '''
+        count, sql_time = 0, 0.0
+        for counter, start_count, start_seconds in state['counters']:
+            count += counter.count - start_count
+            sql_time += counter.seconds - start_seconds
+        total_time = time.time() - state['start']
+        budget = state.get('budget')
+        
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': count,
+            'sql_ms': round(1000 * sql_time, 1),
+            'time_ms': round(1000 * total_time, 1),
+            'budget': budget,
+        }
+        over = budget is not None and count > budget
+        logger.log(logging.WARNING if over else logging.INFO,
+                   json.dumps(record, sort_keys=True),
+                   extra={'instrumentation': record})
+        
+        if getattr(settings, 'MOTIONS_INSTRUMENTATION_HEADERS',
+                   settings.DEBUG) and not response.streaming:
+            response['X-Query-Count'] = str(count)
+            if budget is not None:
+                response['X-Query-Budget'] = str(budget)
+            response['Server-Timing'] = \
+                'sql;dur=%.1f;desc="%d queries", total;dur=%.1f' % (
+                    1000 * sql_time, count, 1000 * total_time)
+        
+        if over and getattr(settings, 'MOTIONS_QUERY_BUDGET_ACTION',
+                            'warn') == 'fail':
+            return QueryBudgetExceeded(
+                '%s needed %d queries, its budget is %d'
+                % (request.path, count, budget))
+        return None
+
+
+class QueryBudgetTestMixin(object):
+    '''
+    Test case mixin to check requests against the query budgets of their
+    views, independent of the middleware
+    '''
+    def assertQueryBudget(self, path, data=None, **extra):
+        '''
+        GET `path` with the test client and fail if it needs more queries
+        than the budget of its view
+        :rtype: HttpResponse
+        '''
+        match = resolve(path)
+        budget = get_budget(match.func, match)
+        self.assertIsNotNone(budget, 'No query budget for %s' % path)
+        with CaptureQueriesContext(connections['default']) as queries:
+            response = self.client.get(path, data or {}, **extra)
+        self.assertLessEqual(
+            len(queries), budget,
+            '%s needed %d queries, its budget is %d:\n%s' % (
+                path, len(queries), budget,
+                '\n'.join(query['sql'] for query in queries)))
+        return response
@@ -0,0 +1,137 @@
+'''
+Live tallies of motions for Server-Sent Events and long polling
+
+Every change to the votes of a motion increments a per-motion counter in the
+cache. Subscribers only poll that counter and read the motion from the
+database once it changed, idle subscribers neither query the database nor
+hold a database connection. Use a cache shared between the workers
+(memcached for example), with the default per-process cache changes made by
+other workers are only noticed by the periodic database check.
+
+Subscribers sleep between polls, to keep hundreds of them per worker run the
+site with cooperative workers, for example gunicorn with `-k gevent`.
+
+The following settings are used:
+
+MOTIONS_LIVE_POLL_INTERVAL
+    Seconds between two polls of the cached counter (default 1)
+MOTIONS_LIVE_CHECK_INTERVAL
+    Seconds after which the database is read even though the counter did
+    not change (default 30)
+MOTIONS_LIVE_KEEPALIVE
+    Seconds without changes after which subscribers are told so, keeps
+    proxies from closing the connection (default 15)
+MOTIONS_LIVE_DURATION
+    Seconds an event stream is kept open, clients reconnect afterwards
+    (default 600)
+MOTIONS_LIVE_TIMEOUT
+    Seconds a long poll waits for a change (default 25)
+'''
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, router
+
+# Number of polls the database is read after the counter changed, the
+# counter may be incremented before the vote is committed
+RETRIES = 5
+
+
+def setting(name, default):
+    return getattr(settings, 'MOTIONS_LIVE_%s' % name, default)
+
+
+def version_key(number):
+    return 'cacert_motions.live.%s' % number
+
+
+def notify(number):
+    '''
+    Tell subscribers that the votes of motion `number` changed
+    '''
+    key = version_key(number)
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def read_state(number):
+    '''
+    Tallies of motion `number`, the connection to the database it was read
+    from, a replica or the primary, is closed afterwards unless it is used
+    by a transaction
+    :rtype: dict or None if the motion does not exist
+    '''
+    from .models import Motion
+    # Routers may choose another replica on every call
+    alias = router.db_for_read(Motion)
+    try:
+        motion = Motion.objects.using(alias).only(
+            'version', 'due', 'withdrawn', 'ayes_count', 'nays_count',
+            'abstains_count', 'proxies_count',
+        ).get(pk=number)
+    except Motion.DoesNotExist:
+        return None
+    finally:
+        if not connections[alias].in_atomic_block:
+            connections[alias].close()
+    return {
+        'number': motion.number,
+        'version': motion.version,
+        'status': motion.status(),
+        'tally': [motion.ayes_count, motion.nays_count,
+                  motion.abstains_count, motion.proxies_count],
+    }
+
+
+def watch(number, version=None, duration=None):
+    '''
+    Follow the tallies of motion `number`
+    :param version: version of the open motion the subscriber already
+                    knows
+    :type  version: int
+    :param duration: seconds after which to stop
+    :rtype: iterator over the state of the motion (see `read_state()`)
+            whenever its version or status changed, None after
+            MOTIONS_LIVE_KEEPALIVE seconds without change. Stops once the
+            motion is no longer open or does not exist.
+    '''
+    poll = setting('POLL_INTERVAL', 1)
+    check = setting('CHECK_INTERVAL', 30)
+    keepalive = setting('KEEPALIVE', 15)
+    
+    start = last_check = last_event = time.time()
+    counter = cache.get(version_key(number))
+    seen = (version, 'open') if version is not None else None
+    pending = 1
+    while True:
+        now = time.time()
+        if pending or now - last_check >= check:
+            state = read_state(number)
+            last_check = now
+            if state is None:
+                return
+            if (state['version'], state['status']) != seen:
+                seen = (state['version'], state['status'])
+                pending = 0
+                yield state
+                last_event = time.time()
+            elif pending:
+                pending -= 1
+            if state['status'] != 'open':
+                return
+        
+        if duration is not None and now - start >= duration:
+            return
+        if now - last_event >= keepalive:
+            yield None
+            last_event = now
+        
+        time.sleep(poll)
+        current = cache.get(version_key(number))
+        if current != counter:
+            counter = current
+            pending = RETRIES
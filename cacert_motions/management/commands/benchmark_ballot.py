@@ -0,0 +1,132 @@
+from optparse import make_option
+import json
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from cacert_motions import ballots
+from cacert_motions.models import Motion
+from cacert_motions.management.commands import benchmark_load
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(benchmark_load.Command):
+    help = 'Time casting the votes of a member on many motions one by one ' \
+           'and as one ballot, report latency percentiles and query counts ' \
+           'as JSON. All data is created in a transaction that is rolled ' \
+           'back.'
+    
+    option_list = BaseCommand.option_list + (
+        make_option('--size',
+                    type='int',
+                    dest='size',
+                    default=10,
+                    help='Number of motions voted on per ballot'),
+        make_option('--members',
+                    type='int',
+                    dest='members',
+                    default=30,
+                    help='Number of members voting'),
+        make_option('--samples',
+                    type='int',
+                    dest='samples',
+                    default=50,
+                    help='Number of ballots timed each way'),
+        make_option('--seed',
+                    type='int',
+                    dest='seed',
+                    default=0,
+                    help='Seed of the generated data'),
+        make_option('--output', '-o',
+                    dest='output',
+                    help='Write the report to this file instead of stdout'),
+    )
+    
+    def handle(self, *args, **options):
+        if options['size'] < 1 or options['samples'] < 1 or \
+                options['members'] < 2:
+            raise CommandError('--size and --samples have to be at least 1, '
+                               '--members at least 2')
+        # Every member votes once on every motion
+        rounds = -(-2 * options['samples'] // options['members'])
+        options.update(motions=rounds * options['size'], votes=0,
+                       proxy_share=0, open_share=1)
+        
+        self.rng = random.Random(options['seed'])
+        try:
+            with benchmark_load.separate_cache(), transaction.atomic():
+                self.generate(options)
+                results = self.measure(options['size'], options['samples'])
+                raise Rollback()
+        except Rollback:
+            pass
+        
+        results['speedup'] = round(results['sequential']['p50_ms'] /
+                                   results['ballot']['p50_ms'], 2)
+        report = {
+            'config': dict((key, options[key]) for key in (
+                'size', 'members', 'samples', 'seed')),
+            'database': connection.vendor,
+            'results': results,
+        }
+        output = json.dumps(report, indent=2, sort_keys=True,
+                            separators=(',', ': '))
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+    
+    def measure(self, size, samples):
+        numbers = list(Motion.objects.order_by('number')
+                                     .values_list('number', flat=True))
+        members = list(get_user_model().objects.filter(pk__in=self.members)
+                                               .order_by('pk'))
+        # Distinct pairs of member and motions for every ballot
+        ballot_list = []
+        for i in range(2 * samples):
+            start = i // len(members) * size
+            ballot_list.append((members[i % len(members)],
+                                numbers[start:start + size]))
+        self.rng.shuffle(ballot_list)
+        
+        def sequential(member, motions):
+            for number in motions:
+                Motion.objects.get(pk=number).vote(
+                    self.rng.choice((True, False, None)), member,
+                    self.certificate)
+        
+        def ballot(member, motions):
+            ballots.cast(member, [
+                ballots.BallotEntry(number, self.rng.choice((True, False, None)),
+                                    None, u'')
+                for number in motions
+            ], self.certificate)
+        
+        results = {}
+        for name, operation in (('sequential', sequential),
+                                ('ballot', ballot)):
+            timings, queries = [], []
+            for i in range(samples):
+                member, motions = ballot_list.pop()
+                with CaptureQueriesContext(connection) as captured:
+                    start = time.time()
+                    operation(member, motions)
+                    timings.append(1000 * (time.time() - start))
+                queries.append(len(captured))
+            timings.sort()
+            results[name] = {
+                'samples': samples,
+                'p50_ms': round(benchmark_load.percentile(timings, 0.5), 3),
+                'p90_ms': round(benchmark_load.percentile(timings, 0.9), 3),
+                'max_ms': round(timings[-1], 3),
+                'queries': round(float(sum(queries)) / samples, 2),
+            }
+        return results
@@ -0,0 +1,139 @@
+from optparse import make_option
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from cacert_motions import chain
+from cacert_motions.models import (Vote, MotionResult, VoteChainEntry,
+                                   VoteChainHead)
+from cacert_motions.management.commands import benchmark_load
+
+
+class Rollback(Exception):
+    pass
+
+
+BATCH_SIZE = 500
+
+
+class Command(benchmark_load.Command):
+    help = 'Time the full and the incremental verification of the vote ' \
+           'chain on generated votes, report the timings as JSON. All data ' \
+           'is created in a transaction that is rolled back.'
+    
+    option_list = BaseCommand.option_list + (
+        make_option('--votes',
+                    type='int',
+                    dest='votes',
+                    default=1000000,
+                    help='Number of votes to generate'),
+        make_option('--motions',
+                    type='int',
+                    dest='motions',
+                    default=50000,
+                    help='Number of motions to spread the votes over'),
+        make_option('--members',
+                    type='int',
+                    dest='members',
+                    default=30,
+                    help='Number of members voting, at least as many as '
+                         'votes per motion'),
+        make_option('--recent',
+                    type='int',
+                    dest='recent',
+                    default=1000,
+                    help='Number of entries after the last checkpoint'),
+        make_option('--seed',
+                    type='int',
+                    dest='seed',
+                    default=0,
+                    help='Seed of the generated data'),
+        make_option('--output', '-o',
+                    dest='output',
+                    help='Write the report to this file instead of stdout'),
+    )
+    
+    def handle(self, *args, **options):
+        if options['motions'] < 1:
+            raise CommandError('--motions has to be at least 1')
+        per_motion = -(-options['votes'] // options['motions'])
+        if options['members'] < per_motion + 1:
+            raise CommandError('--members has to be at least %d for %d votes '
+                               'per motion' % (per_motion + 1, per_motion))
+        if not 0 < options['recent'] <= options['votes']:
+            raise CommandError('--recent has to be between 1 and --votes')
+        options.update(proxy_share=0.1, open_share=0)
+        
+        self.rng = random.Random(options['seed'])
+        results = {}
+        try:
+            with benchmark_load.separate_cache(), transaction.atomic():
+                started = time.time()
+                self.generate(options)
+                self.seed_chain()
+                results['generate_seconds'] = round(time.time() - started, 2)
+                
+                started = time.time()
+                count, head, problems = chain.verify(full=True)
+                results['full'] = self.result(count, problems, started)
+                
+                # Trust the entry `recent` entries before the head
+                entry, hash = VoteChainEntry.objects.order_by('-pk') \
+                                                    .values_list('pk', 'hash') \
+                                                    [options['recent']]
+                chain.checkpoint(entry, hash)
+                started = time.time()
+                count, head, problems = chain.verify()
+                results['incremental'] = self.result(count, problems, started)
+                raise Rollback()
+        except Rollback:
+            pass
+        
+        report = {
+            'config': dict((key, options[key]) for key in (
+                'votes', 'motions', 'members', 'recent', 'seed')),
+            'database': connection.vendor,
+            'results': results,
+        }
+        output = json.dumps(report, indent=2, sort_keys=True,
+                            separators=(',', ': '))
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+    
+    @staticmethod
+    def result(count, problems, started):
+        if problems:
+            raise CommandError('Verification failed: %s' % problems[0])
+        return {
+            'entries': count,
+            'seconds': round(time.time() - started, 3),
+        }
+    
+    def seed_chain(self):
+        '''
+        Append the generated votes to the chain, they were inserted in bulk
+        '''
+        head, created = VoteChainHead.objects.get_or_create(
+            pk=1, defaults={'entry': 0, 'hash': chain.GENESIS})
+        votes = Vote.objects.filter(voter__in=self.members).order_by('pk') \
+                            .values_list('motion', *MotionResult.DIGEST_FIELDS)
+        previous, entries = head.hash, []
+        for vote in votes.iterator():
+            line = chain.content(vote[0], vote[1:])
+            previous = chain.entry_hash(previous, chain.CAST, line)
+            entries.append(VoteChainEntry(operation=chain.CAST,
+                                          vote_id=vote[1], content=line,
+                                          hash=previous))
+            if len(entries) >= BATCH_SIZE:
+                VoteChainEntry.objects.bulk_create(entries)
+                entries = []
+        VoteChainEntry.objects.bulk_create(entries)
+        last = VoteChainEntry.objects.order_by('-pk') \
+                                     .values_list('pk', flat=True)[0]
+        VoteChainHead.objects.filter(pk=1).update(entry=last, hash=previous)
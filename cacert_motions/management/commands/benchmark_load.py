@@ -0,0 +1,343 @@
+from optparse import make_option
+from contextlib import contextmanager
+from datetime import date, timedelta
+import json
+import random
+import time
+
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.cache import get_cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from cacert_motions import caching, live, samples
+from cacert_motions.admin import MotionAdmin
+from cacert_motions.models import Motion, Vote, Certificate, TALLY_FIELDS
+from cacert_motions.views import MotionListView, MotionDetailView
+
+
+class Rollback(Exception):
+    pass
+
+
+# Motion numbers have room for 999 motions a day, stay well below
+MOTIONS_PER_DAY = 500
+BATCH_SIZE = 500
+# Generated motions are numbered from this day on, long before any real
+# motion
+FIRST_NUMBER_DAY = date(1900, 1, 1)
+
+
+def percentile(values, fraction):
+    ':param values: sorted values'
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def number_prefix(day):
+    '''
+    Prefix of the numbers of the motions generated on the `day`th day
+    '''
+    return (FIRST_NUMBER_DAY + timedelta(days=day)).strftime('m%Y%m%d.')
+
+
+@contextmanager
+def separate_cache():
+    '''
+    Keep the cached fragments and live counters of the run in a cache of
+    its own, the rollback does not undo writes to the cache
+    '''
+    separate = get_cache('django.core.cache.backends.locmem.LocMemCache',
+                         LOCATION='cacert_motions-benchmark')
+    saved = caching.cache, live.cache
+    caching.cache = live.cache = separate
+    try:
+        yield
+    finally:
+        caching.cache, live.cache = saved
+        separate.clear()
+
+
+class Command(BaseCommand):
+    help = 'Time the main pages and operations on generated motions and ' \
+           'votes, report latency percentiles and query counts as JSON. ' \
+           'All data is created in a transaction that is rolled back, ' \
+           'with a cache of its own.'
+    
+    option_list = BaseCommand.option_list + (
+        make_option('--motions',
+                    type='int',
+                    dest='motions',
+                    default=5000,
+                    help='Number of motions to generate'),
+        make_option('--votes',
+                    type='int',
+                    dest='votes',
+                    default=100000,
+                    help='Number of votes to generate'),
+        make_option('--members',
+                    type='int',
+                    dest='members',
+                    default=30,
+                    help='Number of members voting, at least as many as '
+                         'votes per motion'),
+        make_option('--proxy-share',
+                    type='float',
+                    dest='proxy_share',
+                    default=0.1,
+                    help='Share of the votes cast by proxy'),
+        make_option('--open-share',
+                    type='float',
+                    dest='open_share',
+                    default=0.05,
+                    help='Share of the motions still open'),
+        make_option('--samples',
+                    type='int',
+                    dest='samples',
+                    default=50,
+                    help='Number of times each operation is timed'),
+        make_option('--seed',
+                    type='int',
+                    dest='seed',
+                    default=0,
+                    help='Seed of the generated data'),
+        make_option('--output', '-o',
+                    dest='output',
+                    help='Write the report to this file instead of stdout'),
+        make_option('--baseline',
+                    dest='baseline',
+                    help='Report of an earlier run to compare with'),
+        make_option('--tolerance',
+                    type='float',
+                    dest='tolerance',
+                    help='Fail if an operation got slower than this factor '
+                         'at the median or needs more queries than in the '
+                         'baseline'),
+    )
+    
+    def handle(self, *args, **options):
+        if options['motions'] < 1:
+            raise CommandError('--motions has to be at least 1')
+        per_motion = -(-options['votes'] // options['motions'])
+        if options['members'] < per_motion + 1:
+            raise CommandError('--members has to be at least %d for %d votes '
+                               'per motion' % (per_motion + 1, per_motion))
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+        
+        self.rng = random.Random(options['seed'])
+        try:
+            with separate_cache(), transaction.atomic():
+                started = time.time()
+                self.generate(options)
+                generated = time.time() - started
+                results = self.measure(options['samples'])
+                raise Rollback()
+        except Rollback:
+            pass
+        
+        report = {
+            'config': dict((key, options[key]) for key in (
+                'motions', 'votes', 'members', 'proxy_share', 'open_share',
+                'samples', 'seed')),
+            'database': connection.vendor,
+            'generate_seconds': round(generated, 2),
+            'results': results,
+        }
+        output = json.dumps(report, indent=2, sort_keys=True,
+                            separators=(',', ': '))
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+        
+        if baseline is not None:
+            self.compare(baseline['results'], results, options['tolerance'])
+    
+    def generate(self, options):
+        '''
+        Members, motions with their votes and the tallies of them, inserted
+        in batches
+        '''
+        rng = self.rng
+        User = get_user_model()
+        User.objects.bulk_create([
+            User(username='benchmark-%d' % i, email='benchmark-%d@example.com' % i)
+            for i in range(options['members'])
+        ])
+        self.members = list(User.objects.filter(username__startswith='benchmark-')
+                                        .values_list('pk', flat=True))
+        self.admin = User.objects.create_superuser(
+            'benchmark-admin', 'benchmark-admin@example.com', 'benchmark')
+        self.certificate = Certificate.from_pem(samples.CLIENT_CERT)
+        
+        now = timezone.now()
+        count = options['motions']
+        days = -(-count // MOTIONS_PER_DAY)
+        # Votes are spread evenly, the first motions get the remainder
+        per_motion, remainder = divmod(options['votes'], count)
+        for start in range(0, count, BATCH_SIZE):
+            motions, votes = [], []
+            for i in range(start, min(start + BATCH_SIZE, count)):
+                day, index = divmod(i, MOTIONS_PER_DAY)
+                created = now - timedelta(days=days - day)
+                if rng.random() < options['open_share']:
+                    due = now + timedelta(days=3)
+                else:
+                    due = created + timedelta(hours=12)
+                motion = Motion(
+                    number='%s%d' % (number_prefix(day), index + 1),
+                    title='Benchmark motion %d' % i,
+                    text='Generated motion %d' % i,
+                    proponent_id=rng.choice(self.members),
+                    due=due,
+                )
+                motions.append(motion)
+                
+                voters = rng.sample(self.members,
+                                    per_motion + (1 if i < remainder else 0))
+                for voter in voters:
+                    vote = Vote(motion_id=motion.number, voter_id=voter,
+                                vote=rng.choice((True, True, False, None)),
+                                certificate=self.certificate)
+                    if rng.random() < options['proxy_share']:
+                        vote.proxy_id = rng.choice(
+                            [m for m in self.members if m != voter])
+                        vote.justification = 'Benchmark proxy vote'
+                        motion.proxies_count += 1
+                    field = TALLY_FIELDS[vote.vote]
+                    setattr(motion, field, getattr(motion, field) + 1)
+                    votes.append(vote)
+            Motion.objects.bulk_create(motions)
+            Vote.objects.bulk_create(votes, batch_size=BATCH_SIZE)
+        
+        # bulk_create stamps all motions with the same time of creation
+        for day in range(days):
+            created = now - timedelta(days=days - day)
+            Motion.objects.filter(
+                number__startswith=number_prefix(day),
+            ).update(created=created, modified=created)
+    
+    def measure(self, samples):
+        rng = self.rng
+        factory = RequestFactory()
+        numbers = list(Motion.objects.values_list('number', flat=True))
+        open_numbers = list(Motion.objects.open()
+                                          .values_list('number', flat=True))
+        model_admin = MotionAdmin(Motion, admin.site)
+        pages = max(1, len(numbers) // model_admin.list_per_page)
+        
+        def render(response):
+            if hasattr(response, 'render'):
+                response.render()
+            assert response.status_code == 200, response.status_code
+        
+        def admin_changelist():
+            request = factory.get('/', {'p': rng.randrange(pages)})
+            request.user = self.admin
+            render(model_admin.changelist_view(request))
+        
+        def motion_list():
+            render(MotionListView.as_view()(factory.get('/')))
+        
+        def motion_list_page():
+            request = factory.get('/', {'before': rng.choice(numbers)})
+            render(MotionListView.as_view()(request))
+        
+        def motion_detail():
+            render(MotionDetailView.as_view()(factory.get('/'),
+                                              pk=rng.choice(numbers)))
+        
+        def approved():
+            Motion.objects.select_related('result') \
+                          .get(pk=rng.choice(numbers)).approved()
+        
+        # Members that did not vote on an open motion yet
+        candidates = []
+        voted = set(Vote.objects.filter(motion__in=open_numbers)
+                                .values_list('motion', 'voter'))
+        for number in open_numbers:
+            candidates.extend((number, member) for member in self.members
+                              if (number, member) not in voted)
+        rng.shuffle(candidates)
+        members = dict((m.pk, m) for m in get_user_model().objects
+                                                          .filter(pk__in=self.members))
+        
+        def cast_vote():
+            number, voter = candidates.pop()
+            Motion.objects.get(pk=number).vote(True, members[voter],
+                                               self.certificate)
+        
+        def cast_proxy_vote():
+            number, voter = candidates.pop()
+            proxy = members[rng.choice([m for m in self.members if m != voter])]
+            Motion.objects.get(pk=number).proxy_vote(
+                False, members[voter], proxy, 'Benchmark proxy vote',
+                self.certificate)
+        
+        def create_motion():
+            Motion(title='Benchmark motion', text='Created by the benchmark',
+                   proponent=self.admin,
+                   due=timezone.now() + timedelta(days=3)).save()
+        
+        operations = [
+            ('admin_changelist', admin_changelist),
+            ('motion_list', motion_list),
+            ('motion_list_page', motion_list_page),
+            ('motion_detail', motion_detail),
+            ('approved', approved),
+            ('create_motion', create_motion),
+        ]
+        if len(candidates) >= 2 * samples:
+            operations += [('vote', cast_vote),
+                           ('proxy_vote', cast_proxy_vote)]
+        else:
+            self.stderr.write('Not enough open motions to time voting')
+        
+        results = {}
+        for name, operation in operations:
+            operation()  # warm up caches
+            timings, queries = [], []
+            for i in range(samples):
+                with CaptureQueriesContext(connection) as captured:
+                    start = time.time()
+                    operation()
+                    timings.append(1000 * (time.time() - start))
+                queries.append(len(captured))
+            timings.sort()
+            results[name] = {
+                'samples': samples,
+                'p50_ms': round(percentile(timings, 0.5), 3),
+                'p90_ms': round(percentile(timings, 0.9), 3),
+                'p99_ms': round(percentile(timings, 0.99), 3),
+                'max_ms': round(timings[-1], 3),
+                'queries': round(float(sum(queries)) / samples, 2),
+            }
+        return results
+    
+    def compare(self, baseline, results, tolerance):
+        '''
+        Print the changes against `baseline`, fail on regressions beyond
+        `tolerance`
+        '''
+        regressions = []
+        self.stderr.write('%-18s %20s %18s' % ('operation', 'p50 ms',
+                                               'queries'))
+        for name in sorted(set(baseline) & set(results)):
+            before, after = baseline[name], results[name]
+            ratio = after['p50_ms'] / before['p50_ms'] \
+                    if before['p50_ms'] else 1
+            self.stderr.write('%-18s %8.2f -> %8.2f %7.2f -> %7.2f  x%.2f' % (
+                name, before['p50_ms'], after['p50_ms'],
+                before['queries'], after['queries'], ratio))
+            if tolerance is not None and \
+                    (ratio > tolerance or after['queries'] > before['queries']):
+                regressions.append(name)
+        if regressions:
+            raise CommandError('Regressions: %s' % ', '.join(regressions))
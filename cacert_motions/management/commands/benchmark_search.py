@@ -0,0 +1,102 @@
+from optparse import make_option
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from cacert_motions.models import Motion
+from cacert_motions import search
+
+
+class Rollback(Exception):
+    pass
+
+
+WORDS = ('board', 'member', 'association', 'certificate', 'assurance',
+         'policy', 'budget', 'server', 'audit', 'committee', 'election',
+         'treasurer', 'minutes', 'meeting', 'delegate', 'arbitration',
+         'infrastructure', 'software', 'donation', 'contract')
+
+
+class Command(BaseCommand):
+    help = 'Compare the full-text index with icontains lookups. ' \
+           'All data is created in a transaction that is rolled back.'
+    
+    option_list = BaseCommand.option_list + (
+        make_option('--motions',
+                    type='int',
+                    dest='motions',
+                    default=5000,
+                    help='Number of motions to search'),
+        make_option('--words',
+                    type='int',
+                    dest='words',
+                    default=300,
+                    help='Number of words in the text of each motion'),
+        make_option('--repeat',
+                    type='int',
+                    dest='repeat',
+                    default=20,
+                    help='Number of times each search is run'),
+    )
+    
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        vocabulary = ['%s%03d' % (word, i) for word in WORDS for i in range(500)]
+        backend = search.get_backend()
+        self.stdout.write('Search backend: %s' % type(backend).__name__)
+        
+        try:
+            with transaction.atomic():
+                proponent = get_user_model().objects.create(
+                    username='benchmark-proponent')
+                for i in range(options['motions']):
+                    # Spread over several days, a day only has room for
+                    # 9999 motion numbers
+                    Motion(
+                        number='m%08d.%d' % (19700101 + i // 999,
+                                             i % 999 + 1),
+                        title=' '.join(rng.sample(vocabulary, 6)),
+                        text=' '.join(rng.choice(vocabulary)
+                                      for j in range(options['words'])),
+                        proponent=proponent,
+                        due=timezone.now(),
+                    ).save(force_insert=True)
+                if connection.vendor == 'postgresql':
+                    connection.cursor().execute('ANALYZE')
+                
+                def icontains(query):
+                    matches = Q()
+                    for term in query.split():
+                        matches &= Q(title__icontains=term) | \
+                                   Q(text__icontains=term)
+                    return Motion.objects.filter(matches) \
+                                         .order_by('-created')
+                
+                def full_text(query):
+                    return search.search(Motion.objects.all(), query) \
+                                 .order_by('rank', '-created')
+                
+                queries = [rng.choice(vocabulary),
+                           ' '.join(rng.sample(vocabulary, 2)),
+                           'missing']
+                for query in queries:
+                    for name, run in (('icontains', icontains),
+                                      ('full-text', full_text)):
+                        start = time.time()
+                        for i in range(options['repeat']):
+                            found = len(list(run(query)[:50]))
+                        elapsed = time.time() - start
+                        self.stdout.write(
+                            '%-28s %-10s %4d results %8.2f ms/search' % (
+                                repr(query), name, found,
+                                1000 * elapsed / options['repeat'],
+                            )
+                        )
+                raise Rollback()
+        except Rollback:
+            pass
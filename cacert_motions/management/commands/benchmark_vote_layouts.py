@@ -0,0 +1,121 @@
+from optparse import make_option
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+# Both ways of storing proxy votes, on scratch tables with the columns that
+# matter for tallies and ballots
+TABLES = (
+    'CREATE TEMPORARY TABLE bench_mti_vote ('
+    'id integer PRIMARY KEY, motion_id integer NOT NULL, vote boolean NULL, '
+    'voter_id integer NOT NULL)',
+    'CREATE INDEX bench_mti_vote_motion ON bench_mti_vote (motion_id)',
+    'CREATE TEMPORARY TABLE bench_mti_proxyvote ('
+    'vote_ptr_id integer PRIMARY KEY, proxy_id integer NOT NULL, '
+    'justification text NOT NULL)',
+    'CREATE TEMPORARY TABLE bench_flat_vote ('
+    'id integer PRIMARY KEY, motion_id integer NOT NULL, vote boolean NULL, '
+    'voter_id integer NOT NULL, proxy_id integer NULL, '
+    'justification text NOT NULL)',
+    'CREATE INDEX bench_flat_vote_motion ON bench_flat_vote (motion_id)',
+)
+
+QUERIES = (
+    ('tally', 'multi-table',
+     'SELECT v.vote, COUNT(*), COUNT(p.vote_ptr_id) FROM bench_mti_vote v '
+     'LEFT OUTER JOIN bench_mti_proxyvote p ON p.vote_ptr_id = v.id '
+     'WHERE v.motion_id = %s GROUP BY v.vote'),
+    ('tally', 'flattened',
+     'SELECT vote, COUNT(*), COUNT(proxy_id) FROM bench_flat_vote '
+     'WHERE motion_id = %s GROUP BY vote'),
+    ('ballots', 'multi-table',
+     'SELECT v.id, v.vote, v.voter_id, p.proxy_id, p.justification '
+     'FROM bench_mti_vote v '
+     'LEFT OUTER JOIN bench_mti_proxyvote p ON p.vote_ptr_id = v.id '
+     'WHERE v.motion_id = %s ORDER BY v.id'),
+    ('ballots', 'flattened',
+     'SELECT id, vote, voter_id, proxy_id, justification FROM bench_flat_vote '
+     'WHERE motion_id = %s ORDER BY id'),
+    ('proxy ballots', 'multi-table',
+     'SELECT v.id, v.vote, v.voter_id, p.proxy_id, p.justification '
+     'FROM bench_mti_vote v '
+     'INNER JOIN bench_mti_proxyvote p ON p.vote_ptr_id = v.id '
+     'WHERE v.motion_id = %s ORDER BY v.id'),
+    ('proxy ballots', 'flattened',
+     'SELECT id, vote, voter_id, proxy_id, justification FROM bench_flat_vote '
+     'WHERE motion_id = %s AND proxy_id IS NOT NULL ORDER BY id'),
+)
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare tally and ballot queries of proxy votes stored in their ' \
+           'own table (multi-table inheritance) and in the vote table. ' \
+           'Runs on temporary tables in a transaction that is rolled back.'
+    
+    option_list = BaseCommand.option_list + (
+        make_option('--motions',
+                    type='int',
+                    dest='motions',
+                    default=200,
+                    help='Number of motions'),
+        make_option('--votes',
+                    type='int',
+                    dest='votes',
+                    default=50,
+                    help='Number of votes per motion'),
+        make_option('--proxy-share',
+                    type='float',
+                    dest='proxy_share',
+                    default=0.2,
+                    help='Share of the votes cast by proxy'),
+    )
+    
+    def handle(self, *args, **options):
+        motions = options['motions']
+        votes = options['votes']
+        rng = random.Random(0)
+        
+        mti_votes, mti_proxy_votes, flat_votes = [], [], []
+        for motion in range(motions):
+            for voter in range(votes):
+                pk = motion * votes + voter + 1
+                vote = rng.choice((True, False, None))
+                proxy = rng.random() < options['proxy_share']
+                mti_votes.append((pk, motion, vote, voter))
+                if proxy:
+                    mti_proxy_votes.append((pk, voter + 1, 'Benchmark'))
+                flat_votes.append((pk, motion, vote, voter,
+                                   voter + 1 if proxy else None,
+                                   'Benchmark' if proxy else ''))
+        
+        try:
+            with transaction.atomic():
+                cursor = connection.cursor()
+                for sql in TABLES:
+                    cursor.execute(sql)
+                cursor.executemany('INSERT INTO bench_mti_vote VALUES '
+                                   '(%s, %s, %s, %s)', mti_votes)
+                cursor.executemany('INSERT INTO bench_mti_proxyvote VALUES '
+                                   '(%s, %s, %s)', mti_proxy_votes)
+                cursor.executemany('INSERT INTO bench_flat_vote VALUES '
+                                   '(%s, %s, %s, %s, %s, %s)', flat_votes)
+                
+                self.stdout.write('%d motions, %d votes, %d by proxy' % (
+                    motions, len(flat_votes), len(mti_proxy_votes)))
+                for name, layout, sql in QUERIES:
+                    start = time.time()
+                    for motion in range(motions):
+                        cursor.execute(sql, (motion,))
+                        cursor.fetchall()
+                    elapsed = time.time() - start
+                    self.stdout.write('%-14s %-12s %8.3f ms/motion' % (
+                        name, layout, elapsed * 1000 / motions))
+                raise Rollback()
+        except Rollback:
+            pass
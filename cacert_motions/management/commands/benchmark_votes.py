@@ -0,0 +1,86 @@
+from optparse import make_option
+from datetime import timedelta
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from cacert_motions import samples
+from cacert_motions.models import Motion, Vote, ProxyVote, Certificate
+from cacert_motions.management.commands import benchmark_load
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare the validated and the fast vote casting paths. ' \
+           'All data is created in a transaction that is rolled back.'
+    
+    option_list = BaseCommand.option_list + (
+        make_option('--votes',
+                    type='int',
+                    dest='votes',
+                    default=200,
+                    help='Number of votes cast per path and kind of vote'),
+    )
+    
+    def handle(self, *args, **options):
+        votes = options['votes']
+        try:
+            with benchmark_load.separate_cache(), transaction.atomic():
+                User = get_user_model()
+                voters = [User.objects.create(username='benchmark-%d' % i)
+                          for i in range(votes)]
+                proxy = User.objects.create(username='benchmark-proxy')
+                certificate = Certificate.from_pem(samples.CLIENT_CERT)
+                
+                def motion():
+                    return Motion.objects.create(
+                        title='Benchmark motion',
+                        text='Benchmark',
+                        proponent=proxy,
+                        due=timezone.now() + timedelta(days=1),
+                    )
+                
+                def validated_vote(m, voter):
+                    Vote(motion=m, vote=True, voter=voter,
+                         certificate=certificate).save()
+                
+                def validated_proxy_vote(m, voter):
+                    ProxyVote(motion=m, vote=True, voter=voter, proxy=proxy,
+                              justification='Benchmark',
+                              certificate=certificate).save()
+                
+                def fast_vote(m, voter):
+                    m.vote(True, voter, certificate)
+                
+                def fast_proxy_vote(m, voter):
+                    m.proxy_vote(True, voter, proxy, 'Benchmark', certificate)
+                
+                for name, cast in (
+                        ('Vote.save()', validated_vote),
+                        ('ProxyVote.save()', validated_proxy_vote),
+                        ('Motion.vote()', fast_vote),
+                        ('Motion.proxy_vote()', fast_proxy_vote),
+                        ):
+                    m = motion()
+                    with CaptureQueriesContext(connection) as queries:
+                        start = time.time()
+                        for voter in voters:
+                            cast(m, voter)
+                        elapsed = time.time() - start
+                    self.stdout.write(
+                        '%-20s %6.2f queries/vote %10.1f votes/s' % (
+                            name,
+                            float(len(queries)) / votes,
+                            votes / elapsed,
+                        )
+                    )
+                raise Rollback()
+        except Rollback:
+            pass
@@ -0,0 +1,27 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from cacert_motions import caching
+
+class Command(BaseCommand):
+    help = 'Report the hits and misses of the cached motion fragments and ' \
+           'pages'
+    
+    option_list = BaseCommand.option_list + (
+        make_option('--reset',
+                    action='store_true',
+                    dest='reset',
+                    default=False,
+                    help='Reset the counters after reporting them'),
+    )
+    
+    def handle(self, *args, **options):
+        self.stdout.write('%-10s %10s %10s %8s' % ('fragment', 'hits',
+                                                  'misses', 'ratio'))
+        for fragment, counters in sorted(
+                caching.statistics(options['reset']).items()):
+            ratio = counters['ratio']
+            self.stdout.write('%-10s %10d %10d %8s' % (
+                fragment, counters['hits'], counters['misses'],
+                '-' if ratio is None else '%.1f%%' % (100 * ratio)))
@@ -0,0 +1,61 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from cacert_motions import export
+from cacert_motions.models import Motion
+
+class Command(BaseCommand):
+    help = 'Write motions and their votes as CSV or JSON lines'
+    
+    option_list = BaseCommand.option_list + (
+        make_option('--format',
+                    dest='format',
+                    default='csv',
+                    choices=sorted(export.FORMATS),
+                    help='Output format: %s' % ', '.join(sorted(export.FORMATS))),
+        make_option('--status',
+                    dest='status',
+                    choices=Motion.STATUSES,
+                    help='Only export motions with this status'),
+        make_option('--since',
+                    dest='since',
+                    help='Only export motions created on or after this '
+                         'day (YYYY-MM-DD)'),
+        make_option('--until',
+                    dest='until',
+                    help='Only export motions created on or before this '
+                         'day (YYYY-MM-DD)'),
+        make_option('--output', '-o',
+                    dest='output',
+                    help='File to write to instead of stdout'),
+        make_option('--chunk-size',
+                    type='int',
+                    dest='chunk_size',
+                    default=export.CHUNK_SIZE,
+                    help='Number of motions read per query'),
+    )
+    
+    def handle(self, *args, **options):
+        dates = []
+        for key in ('since', 'until'):
+            value = options[key]
+            try:
+                date = parse_date(value) if value else None
+            except ValueError:
+                date = None
+            if value and date is None:
+                raise CommandError('Invalid date for --%s: %s' % (key, value))
+            dates.append(date)
+        
+        lines = export.FORMATS[options['format']][0]
+        motions = export.filter_motions(options['status'], *dates)
+        
+        lines = lines(motions, options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'wb') as out:
+                out.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
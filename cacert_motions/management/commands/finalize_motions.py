@@ -0,0 +1,48 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from cacert_motions.models import Motion, MotionResult
+
+class Command(BaseCommand):
+    help = 'Snapshot the results of all closed motions'
+    
+    option_list = BaseCommand.option_list + (
+        make_option('--check',
+                    action='store_true',
+                    dest='check',
+                    default=False,
+                    help='Verify the digests of the existing results '
+                         'instead of finalizing motions'),
+    )
+    
+    def handle(self, *args, **options):
+        verbosity = int(options['verbosity'])
+        
+        if options['check']:
+            wrong = 0
+            for result in MotionResult.objects.order_by('motion'):
+                if result.check_digest():
+                    continue
+                wrong += 1
+                if verbosity >= 1:
+                    self.stdout.write('%s: votes do not match the digest'
+                                      % result.motion_id)
+            if wrong:
+                raise CommandError('%d result(s) with changed votes' % wrong)
+            if verbosity >= 1:
+                self.stdout.write('All results match their votes')
+            return
+        
+        motions = Motion.objects.filter(finalized=False,
+                                        due__lt=timezone.now()) \
+                                .order_by('due', 'number')
+        count = 0
+        for motion in motions.iterator():
+            result = motion.finalize()
+            count += 1
+            if verbosity >= 2:
+                self.stdout.write('%s: %s' % (motion.number, result))
+        if verbosity >= 1:
+            self.stdout.write('%d motion(s) finalized' % count)
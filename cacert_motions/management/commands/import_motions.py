@@ -0,0 +1,95 @@
+from optparse import make_option
+import sys
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from cacert_motions import importer
+from cacert_motions.models import Certificate
+
+class Command(BaseCommand):
+    help = 'Import archived motions and their votes from CSV or JSON lines ' \
+           'as written by export_motions, keeping their numbers. Motions ' \
+           'that exist already are skipped.'
+    args = '<file or - for stdin>'
+    
+    option_list = BaseCommand.option_list + (
+        make_option('--format',
+                    dest='format',
+                    default='csv',
+                    choices=sorted(importer.FORMATS),
+                    help='Input format: %s' % ', '.join(sorted(importer.FORMATS))),
+        make_option('--member',
+                    dest='member',
+                    help='Username of the member importing the votes'),
+        make_option('--certificate',
+                    dest='certificate',
+                    help='PEM file with the client certificate of --member '
+                         'the votes are recorded with'),
+        make_option('--batch-size',
+                    type='int',
+                    dest='batch_size',
+                    default=importer.BATCH_SIZE,
+                    help='Number of motions and votes validated and written '
+                         'together'),
+        make_option('--dry-run',
+                    action='store_true',
+                    dest='dry_run',
+                    default=False,
+                    help='Only validate the archive'),
+    )
+    
+    def handle(self, *args, **options):
+        verbosity = int(options['verbosity'])
+        if len(args) != 1:
+            raise CommandError('Give the file to import, - for stdin')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size has to be at least 1')
+        if not options['member'] or not options['certificate']:
+            raise CommandError('--member and --certificate are required')
+        
+        User = get_user_model()
+        try:
+            member = User.objects.get_by_natural_key(options['member'])
+        except User.DoesNotExist:
+            raise CommandError('There is no member %s' % options['member'])
+        with open(options['certificate']) as f:
+            pem = f.read().decode('ascii')
+        try:
+            certificate = Certificate.from_pem(pem, member)
+        except ValidationError as e:
+            raise CommandError(u' '.join(e.messages))
+        
+        stream = sys.stdin if args[0] == '-' else open(args[0], 'rb')
+        records = importer.FORMATS[options['format']](stream)
+        run = importer.Importer(certificate, options['batch_size'],
+                                options['dry_run'])
+        totals = dict.fromkeys(('motions', 'votes', 'skipped', 'problems'), 0)
+        start = time.time()
+        try:
+            for stats in run.run(records):
+                for problem in stats['problems']:
+                    self.stderr.write(u'Line %d, %s: %s' % problem)
+                stats['problems'] = len(stats['problems'])
+                for key in totals:
+                    totals[key] += stats[key]
+                if verbosity >= 1:
+                    self.stdout.write(
+                        '%(motions)d motion(s) with %(votes)d vote(s), '
+                        '%(skipped)d existing, %(problems)d invalid so far'
+                        % totals)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        
+        if verbosity >= 1:
+            self.stdout.write(
+                '%s %d motion(s) with %d vote(s) in %.1f s, %d existing '
+                'skipped' % ('Validated' if options['dry_run'] else 'Imported',
+                             totals['motions'], totals['votes'],
+                             time.time() - start, totals['skipped']))
+        if totals['problems']:
+            raise CommandError('%d invalid motion(s) were not imported'
+                               % totals['problems'])
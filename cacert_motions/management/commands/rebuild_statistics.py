@@ -0,0 +1,120 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count
+
+from cacert_motions.models import (Vote, MotionResult, MemberStatistics,
+                                   MonthlyStatistics)
+
+class Command(BaseCommand):
+    help = 'Recount the statistics of members and months from the votes ' \
+           'and finalized motions'
+    
+    option_list = BaseCommand.option_list + (
+        make_option('--check',
+                    action='store_true',
+                    dest='check',
+                    default=False,
+                    help='Only report wrong statistics, do not repair them'),
+    )
+    
+    def handle(self, *args, **options):
+        check = options['check']
+        verbosity = int(options['verbosity'])
+        
+        with transaction.atomic():
+            wrong = self.rebuild(MemberStatistics, self.count_members,
+                                 check, verbosity)
+            wrong += self.rebuild(MonthlyStatistics, self.count_months,
+                                  check, verbosity)
+        
+        if check and wrong:
+            raise CommandError('%d row(s) with wrong statistics' % wrong)
+        if verbosity >= 1:
+            self.stdout.write('%d row(s) %s' % (
+                wrong, 'with wrong statistics' if check else 'repaired'))
+    
+    def rebuild(self, model, count, check, verbosity):
+        '''
+        Compare the rows of `model` with the counters computed by `count`
+        and repair them unless only checking
+        :rtype: int number of wrong rows
+        '''
+        fields = model.COUNTER_FIELDS
+        stored = model.objects.values_list('pk', *fields)
+        if not check:
+            # Lock the rows before counting, concurrent changes then wait
+            # for us to finish before they touch the counters
+            stored = stored.select_for_update()
+        stored = dict((row[0], dict(zip(fields, row[1:]))) for row in stored)
+        expected = count()
+        
+        wrong = 0
+        for pk in sorted(set(stored) | set(expected)):
+            counted = expected.get(pk, dict.fromkeys(fields, 0))
+            actual = stored.get(pk)
+            if counted == actual:
+                continue
+            
+            wrong += 1
+            if verbosity >= 1:
+                self.stdout.write('%s %s: stored %s, counted %s' % (
+                    model._meta.verbose_name, pk,
+                    ', '.join('%s=%d' % (f, actual[f]) for f in fields)
+                    if actual is not None else 'nothing',
+                    ', '.join('%s=%d' % (f, counted[f]) for f in fields),
+                ))
+            if not check:
+                if actual is None:
+                    model.objects.create(pk=pk, **counted)
+                else:
+                    model.objects.filter(pk=pk).update(**counted)
+        return wrong
+    
+    @staticmethod
+    def count_members():
+        ':rtype: dict of member primary key to counters'
+        expected = {}
+        def counters(member):
+            return expected.setdefault(
+                member, dict.fromkeys(MemberStatistics.COUNTER_FIELDS, 0))
+        
+        votes = Vote.objects.values_list('voter', 'vote') \
+                            .annotate(count=Count('pk'),
+                                      proxies=Count('proxy')) \
+                            .order_by()
+        for voter, vote, count, proxies in votes:
+            member = counters(voter)
+            member['votes'] += count
+            member[MemberStatistics.TALLY_FIELDS[vote]] += count
+            member['by_proxy'] += proxies
+        
+        as_proxy = Vote.objects.filter(proxy__isnull=False) \
+                               .values_list('proxy') \
+                               .annotate(count=Count('pk')).order_by()
+        for proxy, count in as_proxy:
+            counters(proxy)['as_proxy'] += count
+        
+        decided = Vote.objects.filter(motion__finalized=True,
+                                      motion__withdrawn=False) \
+                              .values_list('voter') \
+                              .annotate(count=Count('pk')).order_by()
+        for voter, count in decided:
+            counters(voter)['decided'] += count
+        return expected
+    
+    @staticmethod
+    def count_months():
+        ':rtype: dict of month to counters'
+        expected = {}
+        results = MotionResult.objects.filter(motion__withdrawn=False) \
+                                      .select_related('motion')
+        for result in results.iterator():
+            month = expected.setdefault(
+                MonthlyStatistics.month_of(result.motion.due),
+                dict.fromkeys(MonthlyStatistics.COUNTER_FIELDS, 0))
+            for field, value in MonthlyStatistics.decision(result.motion,
+                                                           result).items():
+                month[field] += value
+        return expected
@@ -0,0 +1,73 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count
+
+from cacert_motions.models import (Motion, MotionListVersion, Vote,
+                                   TALLY_FIELDS, PROXY_TALLY_FIELD,
+                                   TALLY_FIELD_NAMES)
+
+class Command(BaseCommand):
+    help = 'Recount the denormalized vote tallies of all motions'
+    
+    option_list = BaseCommand.option_list + (
+        make_option('--check',
+                    action='store_true',
+                    dest='check',
+                    default=False,
+                    help='Only report motions with wrong tallies, '
+                         'do not repair them'),
+    )
+    
+    def handle(self, *args, **options):
+        check = options['check']
+        verbosity = int(options['verbosity'])
+        
+        with transaction.atomic():
+            # The tallies of finalized motions are frozen with their result
+            stored = Motion.objects.filter(finalized=False) \
+                                   .values_list('number', *TALLY_FIELD_NAMES)
+            if not check:
+                # Lock the motions before counting, concurrent votes then
+                # wait for us to finish before they touch the tallies
+                stored = stored.select_for_update()
+            stored = list(stored)
+            
+            expected = {}
+            counts = Vote.objects.values_list('motion', 'vote') \
+                                 .annotate(count=Count('pk'),
+                                           proxies=Count('proxy')) \
+                                 .order_by()
+            for motion, vote, count, proxies in counts:
+                tallies = expected.setdefault(motion, {PROXY_TALLY_FIELD: 0})
+                tallies[TALLY_FIELDS[vote]] = count
+                tallies[PROXY_TALLY_FIELD] += proxies
+            
+            wrong = 0
+            for row in stored:
+                number, actual = row[0], dict(zip(TALLY_FIELD_NAMES, row[1:]))
+                tallies = dict.fromkeys(TALLY_FIELD_NAMES, 0)
+                tallies.update(expected.get(number, {}))
+                if tallies == actual:
+                    continue
+                
+                wrong += 1
+                if verbosity >= 1:
+                    self.stdout.write('%s: stored %s, counted %s' % (
+                        number,
+                        ', '.join('%s=%d' % (f, actual[f])
+                                  for f in TALLY_FIELD_NAMES),
+                        ', '.join('%s=%d' % (f, tallies[f])
+                                  for f in TALLY_FIELD_NAMES),
+                    ))
+                if not check:
+                    Motion.objects.filter(pk=number).update(**tallies)
+            if wrong and not check:
+                MotionListVersion.bump()
+        
+        if check and wrong:
+            raise CommandError('%d motion(s) with wrong tallies' % wrong)
+        if verbosity >= 1:
+            self.stdout.write('%d motion(s) %s' % (
+                wrong, 'with wrong tallies' if check else 'repaired'))
@@ -0,0 +1,58 @@
+from optparse import make_option
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cacert_motions import notifications
+
+class Command(BaseCommand):
+    help = 'Queue the due reminders and send the queued notifications'
+    
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size',
+                    type='int',
+                    dest='batch_size',
+                    help='Number of recipients sent over one connection'),
+        make_option('--loop',
+                    action='store_true',
+                    dest='loop',
+                    default=False,
+                    help='Keep running and check the queue every --interval '
+                         'seconds'),
+        make_option('--interval',
+                    type='float',
+                    dest='interval',
+                    default=60,
+                    help='Seconds between two checks of the queue'),
+    )
+    
+    def handle(self, *args, **options):
+        verbosity = int(options['verbosity'])
+        if options['batch_size'] is not None and options['batch_size'] < 1:
+            raise CommandError('--batch-size has to be at least 1')
+        
+        while True:
+            queued = notifications.enqueue_reminders()
+            if verbosity >= 2 and queued:
+                self.stdout.write('%d reminder(s) queued' % queued)
+            
+            messages = batches = failed = 0
+            for stats in notifications.send_pending(options['batch_size']):
+                messages += stats['messages']
+                failed += stats['failed']
+                batches += 1
+                if stats['failed']:
+                    self.stderr.write('%(motion)s %(event)s: %(failed)d '
+                                      'message(s) failed' % stats)
+                elif verbosity >= 2:
+                    self.stdout.write(
+                        '%(motion)s %(event)s: %(messages)d message(s) in '
+                        '%(seconds).3f s (%(per_second)s/s)' % stats)
+            if verbosity >= 1 and (batches or not options['loop']):
+                self.stdout.write('%d message(s) sent in %d batch(es)%s' % (
+                    messages, batches,
+                    ', %d failed' % failed if failed else ''))
+            
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
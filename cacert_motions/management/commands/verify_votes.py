@@ -0,0 +1,43 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cacert_motions import chain
+
+class Command(BaseCommand):
+    help = 'Verify the hash chain of the votes from the last trusted ' \
+           'checkpoint and store a checkpoint of the verified chain'
+    
+    option_list = BaseCommand.option_list + (
+        make_option('--full',
+                    action='store_true',
+                    dest='full',
+                    default=False,
+                    help='Verify the whole chain and all votes instead of '
+                         'starting from the last checkpoint'),
+        make_option('--no-checkpoint',
+                    action='store_false',
+                    dest='checkpoint',
+                    default=True,
+                    help='Do not store a checkpoint after a successful '
+                         'verification'),
+    )
+    
+    def handle(self, *args, **options):
+        verbosity = int(options['verbosity'])
+        
+        count, head, problems = chain.verify(full=options['full'])
+        for problem in problems:
+            if verbosity >= 1:
+                self.stdout.write(problem)
+        if problems:
+            raise CommandError('%d problem(s) in the vote chain'
+                               % len(problems))
+        if verbosity >= 1:
+            self.stdout.write('%d entries verified' % count)
+        
+        if options['checkpoint'] and count:
+            checkpoint = chain.checkpoint(*head)
+            if verbosity >= 1:
+                self.stdout.write('Checkpoint stored at entry %d'
+                                  % checkpoint.entry)
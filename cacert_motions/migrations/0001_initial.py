@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'Motion'
+        db.create_table(u'cacert_motions_motion', (
+            ('number', self.gf('django.db.models.fields.CharField')(max_length=13, primary_key=True)),
+            ('title', self.gf('django.db.models.fields.CharField')(max_length=255)),
+            ('withdrawn', self.gf('django.db.models.fields.BooleanField')(default=False)),
+            ('proponent', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['auth.User'])),
+            ('created', self.gf('django.db.models.fields.DateTimeField')(auto_now_add=True, blank=True)),
+            ('modified', self.gf('django.db.models.fields.DateTimeField')(auto_now=True, blank=True)),
+            ('due', self.gf('django.db.models.fields.DateTimeField')()),
+            ('text', self.gf('django.db.models.fields.TextField')()),
+        ))
+        db.send_create_signal(u'cacert_motions', ['Motion'])
+
+        # Adding model 'Vote'
+        db.create_table(u'cacert_motions_vote', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('motion', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['cacert_motions.Motion'])),
+            ('vote', self.gf('django.db.models.fields.NullBooleanField')(null=True, blank=True)),
+            ('voter', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['auth.User'])),
+            ('timestamp', self.gf('django.db.models.fields.DateTimeField')(auto_now_add=True, blank=True)),
+            ('certificate', self.gf('django.db.models.fields.TextField')()),
+        ))
+        db.send_create_signal(u'cacert_motions', ['Vote'])
+
+        # Adding unique constraint on 'Vote', fields ['motion', 'voter']
+        db.create_unique(u'cacert_motions_vote', ['motion_id', 'voter_id'])
+
+        # Adding model 'ProxyVote'
+        db.create_table(u'cacert_motions_proxyvote', (
+            (u'vote_ptr', self.gf('django.db.models.fields.related.OneToOneField')(to=orm['cacert_motions.Vote'], unique=True, primary_key=True)),
+            ('proxy', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['auth.User'])),
+            ('justification', self.gf('django.db.models.fields.TextField')()),
+        ))
+        db.send_create_signal(u'cacert_motions', ['ProxyVote'])
+
+
+    def backwards(self, orm):
+        # Removing unique constraint on 'Vote', fields ['motion', 'voter']
+        db.delete_unique(u'cacert_motions_vote', ['motion_id', 'voter_id'])
+
+        # Deleting model 'Motion'
+        db.delete_table(u'cacert_motions_motion')
+
+        # Deleting model 'Vote'
+        db.delete_table(u'cacert_motions_vote')
+
+        # Deleting model 'ProxyVote'
+        db.delete_table(u'cacert_motions_proxyvote')
+
+
+    models = {
+        u'auth.group': {
+            'Meta': {'object_name': 'Group'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '80'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': u"orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        u'auth.permission': {
+            'Meta': {'ordering': "(u'content_type__app_label', u'content_type__model', u'codename')", 'unique_together': "((u'content_type', u'codename'),)", 'object_name': 'Permission'},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['contenttypes.ContentType']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        u'auth.user': {
+            'Meta': {'object_name': 'User'},
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'symmetrical': 'False', 'related_name': "u'user_set'", 'blank': 'True', 'to': u"orm['auth.Group']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'symmetrical': 'False', 'related_name': "u'user_set'", 'blank': 'True', 'to': u"orm['auth.Permission']"}),
+            'username': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '30'})
+        },
+        u'cacert_motions.motion': {
+            'Meta': {'object_name': 'Motion'},
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'due': ('django.db.models.fields.DateTimeField', [], {}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'number': ('django.db.models.fields.CharField', [], {'max_length': '13', 'primary_key': 'True'}),
+            'proponent': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['auth.User']"}),
+            'text': ('django.db.models.fields.TextField', [], {}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'voters': ('django.db.models.fields.related.ManyToManyField', [], {'related_name': "'motion_voted_set'", 'symmetrical': 'False', 'through': u"orm['cacert_motions.Vote']", 'to': u"orm['auth.User']"}),
+            'withdrawn': ('django.db.models.fields.BooleanField', [], {'default': 'False'})
+        },
+        u'cacert_motions.proxyvote': {
+            'Meta': {'object_name': 'ProxyVote', '_ormbases': [u'cacert_motions.Vote']},
+            'justification': ('django.db.models.fields.TextField', [], {}),
+            'proxy': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['auth.User']"}),
+            u'vote_ptr': ('django.db.models.fields.related.OneToOneField', [], {'to': u"orm['cacert_motions.Vote']", 'unique': 'True', 'primary_key': 'True'})
+        },
+        u'cacert_motions.vote': {
+            'Meta': {'unique_together': "(('motion', 'voter'),)", 'object_name': 'Vote'},
+            'certificate': ('django.db.models.fields.TextField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'motion': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['cacert_motions.Motion']"}),
+            'timestamp': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'vote': ('django.db.models.fields.NullBooleanField', [], {'null': 'True', 'blank': 'True'}),
+            'voter': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['auth.User']"})
+        },
+        u'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        }
+    }
+
+    complete_apps = ['cacert_motions']
\ No newline at end of file
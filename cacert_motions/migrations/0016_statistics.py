@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'MemberStatistics'
+        db.create_table(u'cacert_motions_memberstatistics', (
+            ('member', self.gf('django.db.models.fields.related.OneToOneField')(related_name='motion_statistics', unique=True, primary_key=True, to=orm['auth.User'])),
+            ('votes', self.gf('django.db.models.fields.PositiveIntegerField')(default=0)),
+            ('ayes', self.gf('django.db.models.fields.PositiveIntegerField')(default=0)),
+            ('nays', self.gf('django.db.models.fields.PositiveIntegerField')(default=0)),
+            ('abstains', self.gf('django.db.models.fields.PositiveIntegerField')(default=0)),
+            ('by_proxy', self.gf('django.db.models.fields.PositiveIntegerField')(default=0)),
+            ('as_proxy', self.gf('django.db.models.fields.PositiveIntegerField')(default=0)),
+            ('decided', self.gf('django.db.models.fields.PositiveIntegerField')(default=0)),
+        ))
+        db.send_create_signal(u'cacert_motions', ['MemberStatistics'])
+
+        # Adding model 'MonthlyStatistics'
+        db.create_table(u'cacert_motions_monthlystatistics', (
+            ('month', self.gf('django.db.models.fields.DateField')(primary_key=True)),
+            ('decided', self.gf('django.db.models.fields.PositiveIntegerField')(default=0)),
+            ('approved', self.gf('django.db.models.fields.PositiveIntegerField')(default=0)),
+            ('decision_seconds', self.gf('django.db.models.fields.BigIntegerField')(default=0)),
+            ('votes', self.gf('django.db.models.fields.PositiveIntegerField')(default=0)),
+            ('proxy_votes', self.gf('django.db.models.fields.PositiveIntegerField')(default=0)),
+        ))
+        db.send_create_signal(u'cacert_motions', ['MonthlyStatistics'])
+
+
+    def backwards(self, orm):
+        # Deleting model 'MemberStatistics'
+        db.delete_table(u'cacert_motions_memberstatistics')
+
+        # Deleting model 'MonthlyStatistics'
+        db.delete_table(u'cacert_motions_monthlystatistics')
+
+
+    models = {
+        u'auth.group': {
+            'Meta': {'object_name': 'Group'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '80'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': u"orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        u'auth.permission': {
+            'Meta': {'ordering': "(u'content_type__app_label', u'content_type__model', u'codename')", 'unique_together': "((u'content_type', u'codename'),)", 'object_name': 'Permission'},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['contenttypes.ContentType']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        u'auth.user': {
+            'Meta': {'object_name': 'User'},
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'symmetrical': 'False', 'related_name': "u'user_set'", 'blank': 'True', 'to': u"orm['auth.Group']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'symmetrical': 'False', 'related_name': "u'user_set'", 'blank': 'True', 'to': u"orm['auth.Permission']"}),
+            'username': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '30'})
+        },
+        u'cacert_motions.certificate': {
+            'Meta': {'object_name': 'Certificate'},
+            'fingerprint': ('django.db.models.fields.CharField', [], {'max_length': '64', 'primary_key': 'True'}),
+            'pem': ('django.db.models.fields.TextField', [], {})
+        },
+        u'cacert_motions.memberstatistics': {
+            'Meta': {'object_name': 'MemberStatistics'},
+            'abstains': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'as_proxy': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'ayes': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'by_proxy': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'decided': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'member': ('django.db.models.fields.related.OneToOneField', [], {'related_name': "'motion_statistics'", 'unique': 'True', 'primary_key': 'True', 'to': u"orm['auth.User']"}),
+            'nays': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'votes': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'})
+        },
+        u'cacert_motions.monthlystatistics': {
+            'Meta': {'object_name': 'MonthlyStatistics'},
+            'approved': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'decided': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'decision_seconds': ('django.db.models.fields.BigIntegerField', [], {'default': '0'}),
+            'month': ('django.db.models.fields.DateField', [], {'primary_key': 'True'}),
+            'proxy_votes': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'votes': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'})
+        },
+        u'cacert_motions.motion': {
+            'Meta': {'object_name': 'Motion', 'index_together': "(('created', 'number'),)"},
+            'abstains_count': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'ayes_count': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'due': ('django.db.models.fields.DateTimeField', [], {}),
+            'finalized': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'nays_count': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'number': ('django.db.models.fields.CharField', [], {'max_length': '13', 'primary_key': 'True'}),
+            'proponent': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['auth.User']"}),
+            'proxies_count': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'text': ('django.db.models.fields.TextField', [], {}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'version': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'voted': ('django.db.models.fields.DateTimeField', [], {'null': 'True'}),
+            'withdrawn': ('django.db.models.fields.BooleanField', [], {'default': 'False'})
+        },
+        u'cacert_motions.motionresult': {
+            'Meta': {'object_name': 'MotionResult'},
+            'abstains': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'approved': ('django.db.models.fields.BooleanField', [], {}),
+            'ayes': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'digest': ('django.db.models.fields.CharField', [], {'max_length': '64'}),
+            'motion': ('django.db.models.fields.related.OneToOneField', [], {'related_name': "'result'", 'unique': 'True', 'primary_key': 'True', 'to': u"orm['cacert_motions.Motion']"}),
+            'nays': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'proxies': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'timestamp': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'})
+        },
+        u'cacert_motions.motionsequence': {
+            'Meta': {'object_name': 'MotionSequence'},
+            'day': ('django.db.models.fields.DateField', [], {'primary_key': 'True'}),
+            'last': ('django.db.models.fields.PositiveIntegerField', [], {})
+        },
+        u'cacert_motions.vote': {
+            'Meta': {'unique_together': "(('motion', 'voter'),)", 'object_name': 'Vote', 'index_together': "(('voter', 'timestamp'), ('proxy', 'timestamp'))"},
+            'certificate': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['cacert_motions.Certificate']", 'on_delete': 'models.PROTECT'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'justification': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'motion': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['cacert_motions.Motion']"}),
+            'proxy': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'proxyvote_set'", 'null': 'True', 'to': u"orm['auth.User']"}),
+            'timestamp': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'vote': ('django.db.models.fields.NullBooleanField', [], {'null': 'True', 'blank': 'True'}),
+            'voter': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['auth.User']"})
+        },
+        u'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        }
+    }
+
+    complete_apps = ['cacert_motions']
\ No newline at end of file
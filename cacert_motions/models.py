@@ -1,24 +1,146 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import F
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django.conf import settings
+from south.signals import pre_migrate
 from datetime import datetime
 from django.utils import timezone
+import hashlib
+
+from . import (certificates, chain, live, notifications, routers, rules,
+               search)
+
+# Denormalized tally column on `Motion` for every possible vote value
+TALLY_FIELDS = {
+    True: 'ayes_count',
+    False: 'nays_count',
+    None: 'abstains_count',
+}
+PROXY_TALLY_FIELD = 'proxies_count'
+TALLY_FIELD_NAMES = tuple(TALLY_FIELDS.values()) + (PROXY_TALLY_FIELD,)
+# Fields of a motion only changed by its votes
+VOTE_STATE_FIELDS = ('finalized', 'version', 'voted')
+# Fields of a motion in the full-text index
+SEARCH_FIELDS = frozenset(('title', 'text'))
+
+class MotionQuerySet(models.query.QuerySet):
+    
+    def open(self):
+        ':rtype: MotionQuerySet'
+        return self.filter(withdrawn=False, due__gte=timezone.now())
+    
+    def closed(self):
+        ':rtype: MotionQuerySet'
+        return self.filter(withdrawn=False, due__lt=timezone.now())
+    
+    def withdrawn(self):
+        ':rtype: MotionQuerySet'
+        return self.filter(withdrawn=True)
+    
+    def with_outcomes(self):
+        '''
+        Decide all motions in the query that loads them, `Motion.approved()`
+        then needs no queries
+        :rtype: MotionQuerySet
+        '''
+        return rules.with_outcomes(self)
+
+
+class MotionManager(models.Manager):
+    
+    def get_queryset(self):
+        return MotionQuerySet(self.model, using=self._db)
+    
+    def open(self):
+        return self.get_queryset().open()
+    
+    def closed(self):
+        return self.get_queryset().closed()
+    
+    def withdrawn(self):
+        return self.get_queryset().withdrawn()
+    
+    def with_outcomes(self):
+        return self.get_queryset().with_outcomes()
+
 
 class Motion(models.Model):
     number = models.CharField(max_length=13, primary_key=True, editable=False)
     title = models.CharField(max_length=255)
     withdrawn = models.BooleanField(default=False)
     proponent = models.ForeignKey(settings.AUTH_USER_MODEL)
-    voters = models.ManyToManyField(settings.AUTH_USER_MODEL,
-                                    through='Vote',
-                                    related_name='motion_voted_set')
     
     # Time stamps
     created = models.DateTimeField(auto_now_add=True, editable=False)
     modified = models.DateTimeField(auto_now=True, editable=False)
-    due = models.DateTimeField()
+    due = models.DateTimeField(db_index=True)
     
     text = models.TextField()
     
+    # How the outcome is decided once the motion is closed, see `rules`
+    rule = models.CharField(max_length=20, choices=rules.CHOICES,
+                            default=rules.DEFAULT)
+    # Minimum number of votes, abstentions included, below which the motion
+    # is declined
+    quorum = models.PositiveIntegerField(default=0)
+    
+    # Tallies, maintained by `Vote.save()` and the vote deletion handlers.
+    # Use the `rebuild_tallies` management command to check or repair them.
+    ayes_count = models.PositiveIntegerField(default=0, editable=False)
+    nays_count = models.PositiveIntegerField(default=0, editable=False)
+    abstains_count = models.PositiveIntegerField(default=0, editable=False)
+    proxies_count = models.PositiveIntegerField(default=0, editable=False)
+    
+    # Set together with the `MotionResult` by `finalize()`, votes cannot be
+    # changed anymore afterwards
+    finalized = models.BooleanField(default=False, editable=False)
+    # Bumped with every change to the votes of the motion, `modified` only
+    # covers the motion itself
+    version = models.PositiveIntegerField(default=0, editable=False)
+    voted = models.DateTimeField(null=True, editable=False)
+    
+    objects = MotionManager()
+    
+    STATUS_OPEN = 'open'
+    STATUS_CLOSED = 'closed'
+    STATUS_WITHDRAWN = 'withdrawn'
+    STATUSES = (STATUS_OPEN, STATUS_CLOSED, STATUS_WITHDRAWN)
+    
+    class Meta:
+        # Keyset pagination of the motion list
+        index_together = (('created', 'number'),)
+    
+    def last_modified(self):
+        '''
+        When the motion, its votes or its status last changed
+        :rtype: datetime
+        '''
+        changes = [self.modified]
+        if self.voted:
+            changes.append(self.voted)
+        if self.due < timezone.now():
+            changes.append(self.due)
+        return max(changes)
+    
+    def status(self):
+        ':rtype: str'
+        if self.withdrawn:
+            return self.STATUS_WITHDRAWN
+        if self.due >= timezone.now():
+            return self.STATUS_OPEN
+        return self.STATUS_CLOSED
+    
+    @property
+    def voters(self):
+        '''
+        Users that voted on the motion. This is no many-to-many field through
+        `Vote` as a vote has a second user, the proxy.
+        :rtype: models.query.QuerySet
+        '''
+        from django.contrib.auth import get_user_model
+        return get_user_model()._default_manager.filter(vote__motion=self)
+    
     def ayes(self):
         ':rtype: models.query.QuerySet'
         return self.vote_set.filter(vote=True)
@@ -33,17 +155,89 @@ class Motion(models.Model):
     
     def approved(self):
         '''
-        Currently only implements simple majority votes
+        Outcome under the rule and quorum of the motion, None while it is
+        open. Finalized motions return the outcome of their `MotionResult`,
+        motions loaded with `MotionQuerySet.with_outcomes()` the outcome
+        decided by that query.
         '''
+        outcome = getattr(self, 'outcome', False)
+        if outcome is not False:
+            return None if outcome is None else bool(outcome)
         if self.due >= timezone.now():
             return None
-        if self.ayes().count() > self.nays().count():
-            return True
-        else:
-            #TODO: implement president casting the deciding vote on a draw
-            return False
+        if self.finalized:
+            return self.result.approved
+        return rules.decide(self)
     approved.boolean = True
     
+    def finalize(self):
+        '''
+        Freeze the tallies, outcome and a digest of the votes of a closed
+        motion into a `MotionResult`. Votes on the motion are rejected from
+        then on.
+        :rtype: MotionResult
+        :raises ValidationError: if the motion is still open
+        '''
+        from django.core.exceptions import ValidationError
+        with transaction.atomic():
+            locked = Motion.objects.select_for_update().get(pk=self.pk)
+            if locked.finalized:
+                self.finalized = True
+                return self.result
+            if locked.due >= timezone.now():
+                raise ValidationError('Motion %s is still open.' % self.number)
+            
+            # Count the votes themselves, the result does not depend on
+            # the maintained tallies
+            tallies = dict.fromkeys(TALLY_FIELD_NAMES, 0)
+            votes = Vote.objects.filter(motion=self).order_by('pk') \
+                                .values_list(*MotionResult.DIGEST_FIELDS)
+            digest = hashlib.sha256()
+            for vote in votes.iterator():
+                tallies[TALLY_FIELDS[vote[2]]] += 1
+                if vote[3] is not None:
+                    tallies[PROXY_TALLY_FIELD] += 1
+                digest.update(MotionResult.digest_line(vote))
+            
+            for field, value in tallies.items():
+                setattr(locked, field, value)
+            result = MotionResult.objects.create(
+                motion=locked,
+                ayes=tallies['ayes_count'],
+                nays=tallies['nays_count'],
+                abstains=tallies['abstains_count'],
+                proxies=tallies[PROXY_TALLY_FIELD],
+                approved=rules.decide(locked, (
+                    tallies['ayes_count'], tallies['nays_count'],
+                    tallies['abstains_count'], tallies[PROXY_TALLY_FIELD])),
+                digest=digest.hexdigest(),
+            )
+            Motion.objects.filter(pk=self.pk).update(
+                finalized=True,
+                version=F('version') + 1,
+                **tallies
+            )
+            MotionListVersion.bump()
+            if not locked.withdrawn:
+                # Queues nothing for motions imported or closed before the
+                # queue existed, their results are recorded as sent
+                notifications.enqueue(locked, notifications.RESULT)
+                _add_to_rollup(MonthlyStatistics,
+                               MonthlyStatistics.month_of(locked.due),
+                               **MonthlyStatistics.decision(locked, result))
+                MemberStatistics.objects.filter(
+                    member__in=Vote.objects.filter(motion=self)
+                                           .values('voter'),
+                ).update(decided=F('decided') + 1)
+        
+        for field, value in tallies.items():
+            setattr(self, field, value)
+        live.notify(self.number)
+        self.finalized = True
+        self.version = locked.version + 1
+        self.result = result
+        return result
+    
     def vote(self, vote, voter, certificate):
         '''
         Vote on the motion
@@ -52,16 +246,18 @@ class Motion(models.Model):
         :param voter: the `User` whos vote is cast
         :type  voter: django.contrib.auth.models.User
         :param certificate: Client certificate of the user that enters the vote
-        :type  certificate: unicode
+        :type  certificate: unicode or Certificate
         :rtype: Vote
         '''
+        if not isinstance(certificate, Certificate):
+            certificate = Certificate.from_pem(certificate, voter)
         v = Vote(
             motion=self,
             vote=vote,
             voter=voter,
             certificate=certificate,
         )
-        v.save()
+        v.cast()
         return v
     
     def proxy_vote(self, vote, voter, proxy, justification, certificate):
@@ -76,9 +272,11 @@ class Motion(models.Model):
         :param justification: why a ProxyVote was cast instead of a normal vote
         :type  justification: unicode
         :param certificate: Client certificate of the user that enters the vote
-        :type certificate: unicode
+        :type certificate: unicode or Certificate
         :rtype: ProxyVote
         '''
+        if not isinstance(certificate, Certificate):
+            certificate = Certificate.from_pem(certificate, proxy)
         v = ProxyVote(
             motion=self,
             vote=vote,
@@ -87,7 +285,7 @@ class Motion(models.Model):
             proxy=proxy,
             justification=justification,
         )
-        v.save()
+        v.cast()
         return v
     
     def __unicode__(self):
@@ -95,13 +293,523 @@ class Motion(models.Model):
         return self.number + ': ' + self.title + withdrawn
     
     def save(self, *args, **kwargs):
-        if not self.number:
-            prefix = u'm{now:%Y%m%d}.'.format(now=datetime.utcnow())
-            self.number = prefix + unicode(
-                Motion.objects.filter(number__startswith=prefix).count() + 1
-            )
-        self.full_clean()
-        return super(Motion, self).save(*args, **kwargs)
+        if self.number:
+            if not self._state.adding and 'update_fields' not in kwargs:
+                # Never write back possibly stale tallies, they are only
+                # ever changed through atomic updates
+                kwargs['update_fields'] = [
+                    f.name for f in self._meta.concrete_fields
+                    if not f.primary_key and
+                       f.name not in TALLY_FIELD_NAMES + VOTE_STATE_FIELDS
+                ]
+            self.full_clean()
+            with transaction.atomic():
+                # Checked on the primary under the lock `finalize()` takes
+                if not self._state.adding and \
+                        Motion.objects.select_for_update() \
+                                      .filter(pk=self.pk) \
+                                      .values_list('finalized', flat=True) \
+                                      .first():
+                    from django.core.exceptions import ValidationError
+                    raise ValidationError(
+                        'Motion %s is finalized and cannot be changed.'
+                        % self.number)
+                result = super(Motion, self).save(*args, **kwargs)
+                update_fields = kwargs.get('update_fields')
+                if update_fields is None or \
+                        SEARCH_FIELDS.intersection(update_fields):
+                    search.get_backend().index(self)
+                MotionListVersion.bump()
+            return result
+        
+        # The number is only taken if the motion is actually saved
+        try:
+            with transaction.atomic():
+                today = datetime.utcnow().date()
+                self.number = u'm{today:%Y%m%d}.{index}'.format(
+                    today=today,
+                    index=MotionSequence.next_index(today),
+                )
+                self.full_clean()
+                kwargs.setdefault('force_insert', True)
+                result = super(Motion, self).save(*args, **kwargs)
+                search.get_backend().index(self)
+                notifications.enqueue(self, notifications.NEW_MOTION)
+                MotionListVersion.bump()
+                return result
+        except Exception:
+            self.number = u''
+            raise
+
+
+class MotionResult(models.Model):
+    '''
+    Snapshot of the result of a finalized motion
+    '''
+    motion = models.OneToOneField(Motion, primary_key=True,
+                                  related_name='result')
+    ayes = models.PositiveIntegerField()
+    nays = models.PositiveIntegerField()
+    abstains = models.PositiveIntegerField()
+    proxies = models.PositiveIntegerField()
+    approved = models.BooleanField()
+    # SHA-256 over the votes, see `digest_line()`
+    digest = models.CharField(max_length=64)
+    timestamp = models.DateTimeField(auto_now_add=True)
+    
+    DIGEST_FIELDS = ('pk', 'voter', 'vote', 'proxy', 'justification',
+                     'certificate', 'timestamp')
+    
+    def __unicode__(self):
+        return u'%s: %s' % (self.motion_id,
+                            u'approved' if self.approved else u'declined')
+    
+    @staticmethod
+    def digest_line(vote):
+        '''
+        Line of a vote in the digest
+        :param vote: values of `DIGEST_FIELDS` of the vote
+        :type  vote: tuple
+        :rtype: str
+        '''
+        pk, voter, value, proxy, justification, certificate, timestamp = vote
+        return (u'%d %d %s %s %s %s %s\n' % (
+            pk, voter, value, proxy, certificate,
+            timestamp.astimezone(timezone.utc).isoformat(),
+            hashlib.sha256(justification.encode('utf-8')).hexdigest(),
+        )).encode('utf-8')
+    
+    def check_digest(self):
+        '''
+        Whether the votes still match the digest
+        :rtype: bool
+        '''
+        digest = hashlib.sha256()
+        votes = Vote.objects.filter(motion=self.motion_id).order_by('pk') \
+                            .values_list(*self.DIGEST_FIELDS)
+        for vote in votes.iterator():
+            digest.update(self.digest_line(vote))
+        return digest.hexdigest() == self.digest
+
+
+class Notification(models.Model):
+    '''
+    Queued mail about a motion, sent by the `send_notifications` command.
+    There is at most one notification per motion and event.
+    '''
+    EVENT_CHOICES = (
+        (notifications.NEW_MOTION, 'New motion'),
+        (notifications.REMINDER, 'Reminder'),
+        (notifications.RESULT, 'Result'),
+    )
+    motion = models.ForeignKey(Motion, related_name='notifications')
+    event = models.CharField(max_length=8, choices=EVENT_CHOICES)
+    created = models.DateTimeField(auto_now_add=True)
+    # Recipients are notified in the order of their primary keys, batch by
+    # batch
+    last_recipient = models.IntegerField(default=0)
+    sent = models.DateTimeField(null=True, blank=True)
+    # Failed attempts to send the current batch, it is not sent again
+    # before `retry_at`
+    attempts = models.PositiveIntegerField(default=0)
+    retry_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        unique_together = ('motion', 'event')
+    
+    def __unicode__(self):
+        return u'%s: %s' % (self.motion_id, self.get_event_display())
+
+
+class MotionSequence(models.Model):
+    '''
+    Last motion index handed out per day, used for the motion numbers
+    '''
+    day = models.DateField(primary_key=True)
+    last = models.PositiveIntegerField()
+    
+    @classmethod
+    def next_index(cls, day):
+        '''
+        Reserve the next motion index of a day. Call this inside the
+        transaction that saves the motion, concurrent callers are serialized
+        by the row lock of the update.
+        :type  day: datetime.date
+        :rtype: int
+        '''
+        if not cls.objects.filter(day=day).update(last=F('last') + 1):
+            # First motion of the day, continue after the motions that
+            # might have been numbered before the sequence existed
+            prefix = u'm{day:%Y%m%d}.'.format(day=day)
+            last = Motion.objects.filter(number__startswith=prefix).count() + 1
+            try:
+                with transaction.atomic():
+                    cls.objects.create(day=day, last=last)
+                return last
+            except IntegrityError:
+                # Lost the race to create the row, it exists now
+                return cls.next_index(day)
+        return cls.objects.filter(day=day).values_list('last', flat=True).get()
+
+
+class MotionListVersion(models.Model):
+    '''
+    Single row counting the changes to any motion or its votes, the motion
+    list is unchanged as long as the count is. Writers update it last in
+    their transaction, votes already wait for each other on the head of
+    the vote chain.
+    '''
+    version = models.PositiveIntegerField()
+    changed = models.DateTimeField()
+    
+    @classmethod
+    def bump(cls):
+        '''
+        Count a change, call this inside the transaction of the change
+        '''
+        now = timezone.now()
+        if not cls.objects.filter(pk=1).update(version=F('version') + 1,
+                                               changed=now):
+            try:
+                with transaction.atomic():
+                    cls.objects.create(pk=1, version=1, changed=now)
+            except IntegrityError:
+                # Lost the race to create the row, it exists now
+                cls.bump()
+    
+    @classmethod
+    def current(cls):
+        '''
+        :rtype: (version, time of the last change), (0, None) before the
+                first change
+        '''
+        return cls.objects.filter(pk=1).values_list('version', 'changed') \
+                                       .first() or (0, None)
+
+
+class MemberStatistics(models.Model):
+    '''
+    Votes of a member, kept up to date with every change to the votes and
+    whenever a motion is finalized. `decided` counts the votes of the member
+    on finalized motions that were not withdrawn, the participation of a
+    member relates it to the `MonthlyStatistics` since the member joined.
+    '''
+    member = models.OneToOneField(settings.AUTH_USER_MODEL, primary_key=True,
+                                  related_name='motion_statistics')
+    votes = models.PositiveIntegerField(default=0)
+    ayes = models.PositiveIntegerField(default=0)
+    nays = models.PositiveIntegerField(default=0)
+    abstains = models.PositiveIntegerField(default=0)
+    # Votes of the member entered by a proxy
+    by_proxy = models.PositiveIntegerField(default=0)
+    # Votes the member entered as proxy for others
+    as_proxy = models.PositiveIntegerField(default=0)
+    decided = models.PositiveIntegerField(default=0)
+    
+    TALLY_FIELDS = {
+        True: 'ayes',
+        False: 'nays',
+        None: 'abstains',
+    }
+    COUNTER_FIELDS = ('votes', 'ayes', 'nays', 'abstains', 'by_proxy',
+                      'as_proxy', 'decided')
+    
+    def __unicode__(self):
+        return u'%s: %d votes' % (self.member_id, self.votes)
+
+
+class MonthlyStatistics(models.Model):
+    '''
+    Motions decided in a month, by the month they were due. Only finalized
+    motions that were not withdrawn are counted, a month is added to when
+    its motions are finalized and never changed otherwise.
+    '''
+    month = models.DateField(primary_key=True)
+    decided = models.PositiveIntegerField(default=0)
+    approved = models.PositiveIntegerField(default=0)
+    # Sum of the time from creation to due date of the decided motions
+    decision_seconds = models.BigIntegerField(default=0)
+    votes = models.PositiveIntegerField(default=0)
+    proxy_votes = models.PositiveIntegerField(default=0)
+    
+    COUNTER_FIELDS = ('decided', 'approved', 'decision_seconds', 'votes',
+                      'proxy_votes')
+    
+    def __unicode__(self):
+        return u'%s: %d decided' % (self.month.strftime('%Y-%m'), self.decided)
+    
+    @staticmethod
+    def month_of(moment):
+        ':rtype: datetime.date'
+        return timezone.localtime(moment).date().replace(day=1)
+    
+    @staticmethod
+    def decision(motion, result):
+        '''
+        Counters a finalized motion adds to its month
+        :rtype: dict
+        '''
+        return {
+            'decided': 1,
+            'approved': 1 if result.approved else 0,
+            # Motions closed early by moving their due date decide at once
+            'decision_seconds': max(0, int(
+                (motion.due - motion.created).total_seconds())),
+            'votes': result.ayes + result.nays + result.abstains,
+            'proxy_votes': result.proxies,
+        }
+
+
+def _add_to_rollup(model, pk, **deltas):
+    '''
+    Atomically add `deltas` to the counters of a statistics row, the row is
+    created if it does not exist yet
+    '''
+    if model.objects.filter(pk=pk).update(
+            **dict((field, F(field) + delta)
+                   for field, delta in deltas.items())):
+        return
+    if min(deltas.values()) < 0:
+        # Nothing to take away from, `rebuild_statistics` repairs the row
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(pk=pk, **deltas)
+    except IntegrityError:
+        # Lost the race to create the row, it exists now
+        _add_to_rollup(model, pk, **deltas)
+
+
+def adjust_member_statistics(changes):
+    '''
+    Atomically apply changes of votes to the `MemberStatistics`
+    :param changes: (voter_id, vote, proxy_id, delta) of every changed vote,
+                    `delta` is 1 for an added vote and -1 for a removed one
+    :type  changes: list of tuples
+    '''
+    deltas = {}
+    for voter, vote, proxy, delta in changes:
+        counters = deltas.setdefault(voter, {})
+        fields = ['votes', MemberStatistics.TALLY_FIELDS[vote]]
+        if proxy is not None:
+            fields.append('by_proxy')
+            proxy_counters = deltas.setdefault(proxy, {})
+            proxy_counters['as_proxy'] = \
+                proxy_counters.get('as_proxy', 0) + delta
+        for field in fields:
+            counters[field] = counters.get(field, 0) + delta
+    # Always in the same order, concurrent votes cannot deadlock
+    for member, counters in sorted(deltas.items()):
+        counters = dict((field, delta) for field, delta in counters.items()
+                        if delta)
+        if counters:
+            _add_to_rollup(MemberStatistics, member, **counters)
+
+
+def adjust_tallies(motion_id, vote, proxy, delta, motion=None):
+    '''
+    Atomically add `delta` to the tallies of a motion and bump its version,
+    a `delta` of 0 only bumps the version
+    :param motion_id: primary key of the motion to update
+    :param vote: aye->True, naye->False, abstain->None
+    :type  vote: bool or None
+    :param proxy: whether the vote was cast by proxy
+    :type  proxy: bool
+    :param delta: 1 for an added vote, -1 for a removed one
+    :type  delta: int
+    :param motion: in-memory instance of the motion to keep in sync
+    :type  motion: Motion
+    :raises ValidationError: if the motion is finalized
+    '''
+    fields = [TALLY_FIELDS[vote]]
+    if proxy:
+        fields.append(PROXY_TALLY_FIELD)
+    
+    now = timezone.now()
+    updated = Motion.objects.filter(pk=motion_id, finalized=False).update(
+        version=F('version') + 1,
+        voted=now,
+        **dict((field, F(field) + delta) for field in fields)
+    )
+    if not updated and \
+            Motion.objects.filter(pk=motion_id, finalized=True).exists():
+        from django.core.exceptions import ValidationError
+        raise ValidationError('Motion %s is finalized, its votes cannot be '
+                              'changed.' % motion_id)
+    if updated:
+        MotionListVersion.bump()
+        live.notify(motion_id)
+    if motion is not None:
+        for field in fields:
+            setattr(motion, field, getattr(motion, field) + delta)
+        motion.version += 1
+        motion.voted = now
+
+
+def adjust_many_tallies(changes, motions=None):
+    '''
+    Apply changes of votes to the tallies of many motions in one query and
+    bump their versions, lock the motions and check that they are not
+    finalized before
+    :param changes: (motion_id, vote, proxy, delta) of every changed vote,
+                    like the arguments of `adjust_tallies()`
+    :type  changes: list of tuples
+    :param motions: in-memory instances of the motions to keep in sync
+    :type  motions: dict of motion number to Motion
+    '''
+    from django.db import connection
+    deltas = {}
+    for motion_id, vote, proxy, delta in changes:
+        counters = deltas.setdefault(motion_id,
+                                     dict.fromkeys(TALLY_FIELD_NAMES, 0))
+        counters[TALLY_FIELDS[vote]] += delta
+        if proxy:
+            counters[PROXY_TALLY_FIELD] += delta
+    if not deltas:
+        return
+    
+    qn = connection.ops.quote_name
+    column = lambda name: qn(Motion._meta.get_field(name).column)
+    numbers = sorted(deltas)
+    sets = ['%s = %s + 1' % (column('version'), column('version')),
+            '%s = %%s' % column('voted')]
+    now = timezone.now()
+    params = [now]
+    for field in TALLY_FIELD_NAMES:
+        if not any(deltas[number][field] for number in numbers):
+            continue
+        sets.append('%s = %s + CASE %s %s ELSE 0 END' % (
+            column(field), column(field), column('number'),
+            ' '.join(['WHEN %s THEN %s'] * len(numbers))))
+        for number in numbers:
+            params += [number, deltas[number][field]]
+    connection.cursor().execute(
+        'UPDATE %s SET %s WHERE %s IN (%s)' % (
+            qn(Motion._meta.db_table), ', '.join(sets), column('number'),
+            ', '.join(['%s'] * len(numbers))),
+        params + numbers,
+    )
+    MotionListVersion.bump()
+    for number in numbers:
+        live.notify(number)
+        motion = (motions or {}).get(number)
+        if motion is not None:
+            for field, delta in deltas[number].items():
+                setattr(motion, field, getattr(motion, field) + delta)
+            motion.version += 1
+            motion.voted = now
+
+
+def member_statistics(member):
+    '''
+    Participation of a member in one aggregate query
+    :type  member: User
+    :rtype: dict with the counts of `votes` cast by the member, split into
+            `ayes`, `nays` and `abstains`, `by_proxy` of them entered by a
+            proxy, `as_proxy` votes entered for other members, and the
+            `participation` in the motions closed since the member joined
+            (None if there were none)
+    '''
+    from django.db import connection
+    now = timezone.now()
+    params = [member.pk] * 7 + [False, now, False, now]
+    # Custom user models may not know when members joined
+    joined = getattr(member, 'date_joined', None)
+    since = ''
+    if joined is not None:
+        since = ' AND %(due)s >= %%s'
+        params.append(joined)
+    params += [member.pk, member.pk]
+    
+    qn = connection.ops.quote_name
+    column = lambda model, name: qn(model._meta.get_field(name).column)
+    names = dict((name, column(Motion, name))
+                 for name in ('number', 'withdrawn', 'due'))
+    names.update((name, column(Vote, name))
+                 for name in ('motion', 'voter', 'vote', 'proxy'))
+    names.update(motions=qn(Motion._meta.db_table),
+                 votes=qn(Vote._meta.db_table))
+    cursor = connection.cursor()
+    cursor.execute((
+        'SELECT '
+        'SUM(CASE WHEN v.%(voter)s = %%s THEN 1 ELSE 0 END), '
+        'SUM(CASE WHEN v.%(voter)s = %%s AND v.%(vote)s THEN 1 ELSE 0 END), '
+        'SUM(CASE WHEN v.%(voter)s = %%s AND NOT v.%(vote)s '
+        'THEN 1 ELSE 0 END), '
+        'SUM(CASE WHEN v.%(voter)s = %%s AND v.%(vote)s IS NULL '
+        'THEN 1 ELSE 0 END), '
+        'SUM(CASE WHEN v.%(voter)s = %%s AND v.%(proxy)s IS NOT NULL '
+        'THEN 1 ELSE 0 END), '
+        'SUM(CASE WHEN v.%(proxy)s = %%s THEN 1 ELSE 0 END), '
+        'SUM(CASE WHEN v.%(voter)s = %%s AND m.%(withdrawn)s = %%s '
+        'AND m.%(due)s < %%s THEN 1 ELSE 0 END), '
+        '(SELECT COUNT(*) FROM %(motions)s '
+        'WHERE %(withdrawn)s = %%s AND %(due)s < %%s' + since + ') '
+        'FROM %(votes)s v '
+        'INNER JOIN %(motions)s m ON m.%(number)s = v.%(motion)s '
+        'WHERE v.%(voter)s = %%s OR v.%(proxy)s = %%s') % names,
+        params,
+    )
+    row = cursor.fetchone()
+    (votes, ayes, nays, abstains, by_proxy, as_proxy,
+     closed_votes) = [value or 0 for value in row[:7]]
+    closed_motions = row[7]
+    return {
+        'votes': votes,
+        'ayes': ayes,
+        'nays': nays,
+        'abstains': abstains,
+        'by_proxy': by_proxy,
+        'as_proxy': as_proxy,
+        'participation': float(closed_votes) / closed_motions
+                         if closed_motions else None,
+    }
+
+
+class Certificate(models.Model):
+    '''
+    Client certificate used to cast votes, each certificate is only stored
+    once no matter how many votes were cast with it
+    '''
+    fingerprint = models.CharField(max_length=64, primary_key=True,
+                                   editable=False)
+    pem = models.TextField(editable=False)
+    
+    def __unicode__(self):
+        return u'SHA-256 ' + self.fingerprint
+    
+    @classmethod
+    def from_pem(cls, pem, user=None):
+        '''
+        Look up the stored certificate by fingerprint and store it if it is
+        not known yet. If a CA bundle is configured the certificate has to
+        verify and belong to `user`.
+        :type  pem: unicode
+        :param user: the `User` entering a vote with the certificate
+        :type  user: django.contrib.auth.models.User
+        :rtype: Certificate
+        :raises ValidationError: if `pem` contains no valid certificate
+        '''
+        from django.core.exceptions import ValidationError
+        verifier = certificates.get_verifier()
+        try:
+            if verifier is None:
+                fingerprint = certificates.fingerprint(pem)
+            else:
+                verified = verifier.verify(pem)
+                fingerprint = verified.fingerprint
+                if user is not None and verified.user_id != user.pk:
+                    raise ValidationError(
+                        u'The certificate of %s may not be used by %s.' % (
+                            verified.email, user.get_username()))
+        except ValueError as e:
+            raise ValidationError(u'Invalid certificate: %s' % e)
+        
+        certificate, created = cls.objects.get_or_create(
+            fingerprint=fingerprint,
+            defaults={'pem': pem.strip()},
+        )
+        return certificate
 
 
 class Vote(models.Model):
@@ -114,30 +822,211 @@ class Vote(models.Model):
     vote = models.NullBooleanField(choices=VOTE_CHOICES)
     voter = models.ForeignKey(settings.AUTH_USER_MODEL)
     timestamp = models.DateTimeField(auto_now_add=True, editable=False)
-    certificate = models.TextField(editable=False)
+    certificate = models.ForeignKey(Certificate, editable=False,
+                                   on_delete=models.PROTECT)
+    
+    # Only set for votes cast by proxy, see `ProxyVote`
+    proxy = models.ForeignKey(settings.AUTH_USER_MODEL,
+                              null=True,
+                              blank=True,
+                              related_name='proxyvote_set')
+    justification = models.TextField(blank=True)
     
     def __unicode__(self):
-        return self.motion.number + ': ' + \
-               self.get_vote_display() + ' from ' + \
-               self.voter.first_name
+        result = self.motion.number + ': ' + \
+                 self.get_vote_display() + ' from ' + \
+                 self.voter.first_name
+        if self.proxy_id is not None:
+            result += ' via ' + self.proxy.first_name
+        return result
+    
+    def is_proxy_vote(self):
+        ':rtype: bool'
+        return self.proxy_id is not None
+    is_proxy_vote.boolean = True
+    
+    def clean(self):
+        from django.core.exceptions import ValidationError
+        if self.proxy_id is not None:
+            if self.voter_id == self.proxy_id:
+                raise ValidationError('You may not enter a proxy vote for yourself.')
+            if not self.justification:
+                raise ValidationError('A proxy vote needs a justification.')
+        super(Vote, self).clean()
     
     def save(self, *args, **kwargs):
         self.full_clean()
-        return super(Vote, self).save(*args, **kwargs)
+        return self._save_with_tallies(*args, **kwargs)
+    
+    def delete(self, *args, **kwargs):
+        # Checked before deleting anything, the post_delete handler only
+        # catches bulk deletes once it is too late to roll back cleanly.
+        # The lock on the motion keeps it from being finalized meanwhile.
+        with transaction.atomic():
+            if Motion.objects.select_for_update() \
+                             .filter(pk=self.motion_id) \
+                             .values_list('finalized', flat=True).first():
+                from django.core.exceptions import ValidationError
+                raise ValidationError('Motion %s is finalized, its votes '
+                                      'cannot be changed.' % self.motion_id)
+            return super(Vote, self).delete(*args, **kwargs)
+    
+    def cast(self):
+        '''
+        Insert a new vote without the validation queries of `save()`.
+        The related objects have to be saved instances, duplicate votes are
+        detected by the unique constraint of the database and reported with
+        the same `ValidationError` as `save()` raises.
+        '''
+        self.clean_fields(exclude=('motion', 'voter', 'proxy', 'certificate'))
+        self.clean()
+        try:
+            return self._save_with_tallies(force_insert=True)
+        except IntegrityError:
+            # Only look for the duplicate once the insert actually failed
+            self.validate_unique()
+            raise
+    
+    def _save_with_tallies(self, *args, **kwargs):
+        with transaction.atomic():
+            previous = None
+            if not self._state.adding:
+                previous = Vote.objects.filter(pk=self.pk).values_list(
+                    'motion', 'vote', 'proxy', 'voter',
+                    'motion__finalized').first()
+                if previous is not None:
+                    if previous[4]:
+                        from django.core.exceptions import ValidationError
+                        raise ValidationError(
+                            'Motion %s is finalized, its votes cannot be '
+                            'changed.' % previous[0])
+                    previous = previous[:4]
+            result = super(Vote, self).save(*args, **kwargs)
+            
+            motion = getattr(self, Vote.motion.cache_name, None)
+            current = (self.motion_id, self.vote, self.proxy_id, self.voter_id)
+            chain.append(chain.CAST if previous is None else chain.CHANGE,
+                         self)
+            if previous is None:
+                adjust_tallies(self.motion_id, self.vote,
+                               self.proxy_id is not None, 1, motion)
+                adjust_member_statistics(
+                    [(self.voter_id, self.vote, self.proxy_id, 1)])
+            elif previous != current:
+                moved = previous[0] != self.motion_id
+                adjust_tallies(previous[0], previous[1],
+                               previous[2] is not None, -1,
+                               None if moved else motion)
+                adjust_tallies(self.motion_id, self.vote,
+                               self.proxy_id is not None, 1, motion)
+                adjust_member_statistics([
+                    (previous[3], previous[1], previous[2], -1),
+                    (self.voter_id, self.vote, self.proxy_id, 1),
+                ])
+            else:
+                adjust_tallies(self.motion_id, self.vote,
+                               self.proxy_id is not None, 0, motion)
+        return result
     
     class Meta:
         unique_together = ('motion', 'voter')
+        # Keyset pagination of the voting history of members
+        index_together = (('voter', 'timestamp'), ('proxy', 'timestamp'))
 
 
-class ProxyVote(Vote):
-    proxy = models.ForeignKey(settings.AUTH_USER_MODEL)
-    justification = models.TextField()
+class ProxyVoteManager(models.Manager):
     
-    def __unicode__(self):
-        return super(ProxyVote, self).__unicode__() + ' via ' + self.proxy.first_name
+    def get_queryset(self):
+        return super(ProxyVoteManager, self).get_queryset() \
+                                            .filter(proxy__isnull=False)
+
+
+class ProxyVote(Vote):
+    '''
+    Vote cast by a proxy for the voter. Proxy votes are stored in the vote
+    table, so tallies and ballots need no join to tell them apart.
+    '''
+    objects = ProxyVoteManager()
     
     def clean(self):
         from django.core.exceptions import ValidationError
-        if self.voter == self.proxy:
-            raise ValidationError('You may not enter a proxy vote for yourself.')
+        if self.proxy_id is None:
+            raise ValidationError('A proxy vote needs a proxy.')
         super(ProxyVote, self).clean()
+    
+    class Meta:
+        proxy = True
+
+
+class VoteChainEntry(models.Model):
+    '''
+    Entry of the hash chain over the changes to the votes, see `chain`.
+    Entries are only ever appended.
+    '''
+    OPERATION_CHOICES = (
+        (chain.CAST, 'Cast'),
+        (chain.CHANGE, 'Change'),
+        (chain.DELETE, 'Delete'),
+    )
+    operation = models.CharField(max_length=6, choices=OPERATION_CHOICES)
+    # Not a foreign key, the entries outlive deleted votes
+    vote_id = models.IntegerField(db_index=True)
+    content = models.TextField()
+    # SHA-256 over the hash of the previous entry, operation and content
+    hash = models.CharField(max_length=64)
+    
+    def __unicode__(self):
+        return u'%d: %s vote %d' % (self.pk, self.operation, self.vote_id)
+
+
+class VoteChainHead(models.Model):
+    '''
+    Last entry of the hash chain, a single row locked by every append
+    '''
+    entry = models.PositiveIntegerField()
+    hash = models.CharField(max_length=64)
+
+
+class VoteChainCheckpoint(models.Model):
+    '''
+    Signed hash of an entry of the chain, verifications start from the last
+    checkpoint with a valid signature
+    '''
+    entry = models.PositiveIntegerField()
+    hash = models.CharField(max_length=64)
+    signature = models.CharField(max_length=64)
+    created = models.DateTimeField(auto_now_add=True)
+    
+    def __unicode__(self):
+        return u'Checkpoint at entry %d' % self.entry
+
+
+@receiver(post_delete, sender=Vote)
+@receiver(post_delete, sender=ProxyVote)
+def _vote_deleted(sender, instance, **kwargs):
+    '''
+    Remove a deleted vote from the tallies and statistics, and log it in
+    the hash chain
+    '''
+    chain.append(chain.DELETE, instance)
+    adjust_tallies(instance.motion_id, instance.vote,
+                   instance.proxy_id is not None, -1)
+    adjust_member_statistics(
+        [(instance.voter_id, instance.vote, instance.proxy_id, -1)])
+
+
+@receiver(post_delete, sender=Motion)
+def _motion_deleted(sender, instance, **kwargs):
+    '''
+    Remove a deleted motion from the full-text index and the motion list
+    '''
+    search.get_backend().remove(instance.number)
+    MotionListVersion.bump()
+
+
+@receiver(pre_migrate)
+def _migrate_on_primary(sender, **kwargs):
+    '''
+    Data migrations read what they wrote, keep them off the replicas
+    '''
+    routers.pin()
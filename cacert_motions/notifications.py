@@ -0,0 +1,246 @@
+'''
+Queued mail notifications about motions
+
+Saving a motion, finalizing it or a motion getting close to its due date
+only queues a `Notification`, at most one per motion and event. The
+`send_notifications` management command works the queue off: it sends the
+mails of a notification in batches of recipients, every batch over a
+single connection of the mail backend, and remembers the last recipient of
+every batch so a restarted worker does not notify anybody twice. A batch
+is claimed in a short transaction and sent after it, a batch that fails
+is logged and retried later while the queue goes on.
+
+The following settings are used:
+
+MOTIONS_NOTIFY_GROUP
+    Name of the group of members to notify, all active users with an email
+    address by default
+MOTIONS_REMINDER_BEFORE
+    Seconds before the due date of a motion at which members that did not
+    vote yet are reminded (default 86400)
+MOTIONS_NOTIFY_BATCH_SIZE
+    Number of recipients sent over one connection (default 100)
+MOTIONS_NOTIFY_CLAIM
+    Seconds other workers leave a batch alone while it is sent, longer than
+    sending a batch takes (default 600)
+MOTIONS_NOTIFY_RETRY_DELAY
+    Seconds before a failed batch is retried, doubled with every failed
+    attempt up to a day (default 60)
+MOTIONS_SITE_URL
+    Scheme and host prepended to the links in the mails, for example
+    'https://motions.example.org'
+'''
+from datetime import timedelta
+import logging
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.urlresolvers import reverse
+from django.db import transaction, IntegrityError
+from django.db.models import Q
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+logger = logging.getLogger('cacert_motions.notifications')
+
+NEW_MOTION = 'motion'
+REMINDER = 'reminder'
+RESULT = 'result'
+
+
+def setting(name, default):
+    return getattr(settings, 'MOTIONS_%s' % name, default)
+
+
+def enqueue(motion, event):
+    '''
+    Queue a notification unless one was already queued for the motion and
+    event, call this inside the transaction that saves the motion
+    :param event: NEW_MOTION, REMINDER or RESULT
+    :rtype: bool whether the notification was queued
+    '''
+    from .models import Notification
+    try:
+        with transaction.atomic():
+            Notification.objects.create(motion_id=motion.pk, event=event)
+        return True
+    except IntegrityError:
+        return False
+
+
+def mark_sent(numbers, event):
+    '''
+    Record `event` as already sent for the motions `numbers` that were
+    not notified about it yet, later calls of `enqueue()` queue nothing
+    for them. Used for motions that were announced elsewhere, like
+    imported ones.
+    :rtype: int number of notifications recorded
+    '''
+    from .models import Notification
+    numbers = set(numbers) - set(
+        Notification.objects.filter(motion__in=numbers, event=event)
+                            .values_list('motion', flat=True))
+    now = timezone.now()
+    Notification.objects.bulk_create([
+        Notification(motion_id=number, event=event, sent=now)
+        for number in sorted(numbers)])
+    return len(numbers)
+
+
+def enqueue_reminders(now=None):
+    '''
+    Queue reminders for the open motions due within MOTIONS_REMINDER_BEFORE
+    :rtype: int number of reminders queued
+    '''
+    from .models import Motion
+    now = now or timezone.now()
+    before = timedelta(seconds=setting('REMINDER_BEFORE', 86400))
+    motions = Motion.objects.open().filter(due__lte=now + before) \
+                                   .exclude(notifications__event=REMINDER)
+    return sum(enqueue(motion, REMINDER) for motion in motions.only('pk'))
+
+
+def recipients(notification):
+    '''
+    Members to notify, ordered by primary key. Reminders only go to members
+    that did not vote on the motion yet.
+    :rtype: QuerySet of users
+    '''
+    from .models import Vote
+    members = get_user_model().objects.filter(is_active=True) \
+                                      .exclude(email='').order_by('pk')
+    group = setting('NOTIFY_GROUP', None)
+    if group is not None:
+        members = members.filter(groups__name=group)
+    if notification.event == REMINDER:
+        members = members.exclude(
+            pk__in=Vote.objects.filter(motion=notification.motion_id)
+                               .values('voter'))
+    return members
+
+
+def render(notification):
+    '''
+    Subject and body of the mails of `notification`, the same for all
+    recipients
+    :rtype: (unicode, unicode)
+    '''
+    motion = notification.motion
+    context = {
+        'motion': motion,
+        'url': setting('SITE_URL', '') +
+               reverse('motion_detail', args=(motion.pk,)),
+    }
+    template = 'cacert_motions/mail/%s_%%s.txt' % notification.event
+    subject = render_to_string(template % 'subject', context)
+    return (u' '.join(subject.split()),
+            render_to_string(template % 'body', context))
+
+
+def send_batch(notification, batch_size):
+    '''
+    Send the mails of the next batch of recipients of `notification` over
+    one connection, the notification is marked as sent once all
+    recipients were notified. Failures are logged and the batch is retried
+    after MOTIONS_NOTIFY_RETRY_DELAY.
+    :rtype: dict with the number of `messages` sent, the number `failed`
+            and the `seconds` taken, or None if the notification was
+            already sent, is being sent by another worker or waits for its
+            retry
+    '''
+    from .models import Motion, Notification
+    now = timezone.now()
+    with transaction.atomic():
+        try:
+            notification = Notification.objects.select_for_update() \
+                .filter(Q(retry_at__isnull=True) | Q(retry_at__lte=now)) \
+                .get(pk=notification.pk, sent__isnull=True)
+        except Notification.DoesNotExist:
+            return None
+        notification.motion = Motion.objects.with_outcomes() \
+                                            .select_related('proponent') \
+                                            .get(pk=notification.motion_id)
+        batch = list(recipients(notification)
+                     .filter(pk__gt=notification.last_recipient)
+                     .values_list('pk', 'email')[:batch_size])
+        if notification.event == REMINDER and \
+                notification.motion.status() != notification.motion.STATUS_OPEN:
+            # Too late to remind anybody
+            batch = []
+        
+        if batch:
+            # Claim the batch, concurrent workers skip it while it is sent
+            # outside of the transaction
+            notification.retry_at = now + timedelta(
+                seconds=setting('NOTIFY_CLAIM', 600))
+        else:
+            notification.sent = now
+        notification.save(update_fields=['retry_at', 'sent'])
+    
+    started = time.time()
+    failed = 0
+    if batch:
+        try:
+            subject, body = render(notification)
+            messages = [mail.EmailMessage(subject, body, to=[email])
+                        for pk, email in batch]
+            connection = mail.get_connection()
+            connection.send_messages(messages)
+        except Exception:
+            failed = len(batch)
+            notification.attempts += 1
+            delay = min(setting('NOTIFY_RETRY_DELAY', 60) *
+                        2 ** (notification.attempts - 1), 86400)
+            notification.retry_at = timezone.now() + timedelta(seconds=delay)
+            logger.exception('%s %s: sending %d message(s) failed, attempt '
+                             '%d, retry in %d s', notification.motion_id,
+                             notification.event, failed,
+                             notification.attempts, delay)
+        else:
+            notification.last_recipient = batch[-1][0]
+            notification.attempts = 0
+            notification.retry_at = None
+            if len(batch) < batch_size:
+                notification.sent = timezone.now()
+        notification.save(update_fields=['last_recipient', 'sent',
+                                         'attempts', 'retry_at'])
+    
+    seconds = time.time() - started
+    sent = len(batch) - failed
+    stats = {
+        'notification': notification.pk,
+        'motion': notification.motion_id,
+        'event': notification.event,
+        'messages': sent,
+        'failed': failed,
+        'seconds': round(seconds, 3),
+        'per_second': round(sent / seconds, 1) if seconds else None,
+    }
+    if not failed:
+        logger.info('%(motion)s %(event)s: %(messages)d message(s) in '
+                    '%(seconds).3f s' % stats, extra={'notification': stats})
+    return stats
+
+
+def send_pending(batch_size=None):
+    '''
+    Send all queued notifications, oldest first, skipping the ones waiting
+    for a retry
+    :rtype: iterator over the statistics of every batch (see
+            `send_batch()`)
+    '''
+    from .models import Notification
+    batch_size = batch_size or setting('NOTIFY_BATCH_SIZE', 100)
+    pending = Notification.objects.filter(sent__isnull=True) \
+                                  .exclude(retry_at__gt=timezone.now()) \
+                                  .order_by('created', 'pk')
+    for notification in list(pending.only('pk')):
+        while True:
+            stats = send_batch(notification, batch_size)
+            if stats is None:
+                break
+            yield stats
+            if stats['failed'] or stats['messages'] < batch_size:
+                break
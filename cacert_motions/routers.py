@@ -0,0 +1,124 @@
+'''
+Reads from replicas of the database, writes to the primary
+
+`ReplicaRouter` sends reads to one of the replicas and all writes, like
+`Motion.save()`, `Motion.vote()` and `Motion.proxy_vote()`, to the primary
+('default'). Reads stay on the primary
+
+- inside transactions on the primary, so locks like `select_for_update()`
+  and the reads of a transaction see its own writes,
+- for the rest of a request or command once it wrote or called `pin()`,
+- inside `use_primary()`, during migrations,
+- for unsafe requests and, with `ReplicaPinningMiddleware`, for a while
+  after a client wrote, so voters always see their own ballots even when
+  the replicas lag behind.
+
+Put `ReplicaPinningMiddleware` before the session and authentication
+middleware so it sees their writes. The following settings are used:
+
+MOTIONS_READ_REPLICAS
+    Aliases of the databases replicating the primary, everything is read
+    from the primary without them
+MOTIONS_PRIMARY_STICKINESS
+    Seconds a client reads from the primary after it wrote, at least the
+    replication lag (default 10)
+
+To try it locally with two SQLite databases add the replica from
+cacert_board/private_settings.sample and copy the primary to it whenever
+the replica should catch up.
+'''
+from contextlib import contextmanager
+import random
+import threading
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+
+PRIMARY = DEFAULT_DB_ALIAS
+COOKIE = 'motions_primary'
+
+_state = threading.local()
+
+
+def replicas():
+    return tuple(getattr(settings, 'MOTIONS_READ_REPLICAS', ()))
+
+
+def pinned():
+    '''
+    Whether reads of the current thread go to the primary
+    :rtype: bool
+    '''
+    return getattr(_state, 'pinned', False)
+
+
+def pin():
+    '''
+    Read from the primary until the next `reset()`
+    '''
+    _state.pinned = True
+
+
+def reset(pinned=False):
+    '''
+    Start a new request or command, reading from the primary if `pinned`
+    '''
+    _state.pinned = pinned
+    _state.wrote = False
+
+
+@contextmanager
+def use_primary():
+    '''
+    Read from the primary inside the block
+    '''
+    previous = pinned()
+    _state.pinned = True
+    try:
+        yield
+    finally:
+        _state.pinned = previous
+
+
+class ReplicaRouter(object):
+    def db_for_read(self, model, **hints):
+        choices = replicas()
+        if not choices or pinned() or connections[PRIMARY].in_atomic_block:
+            return PRIMARY
+        return random.choice(choices)
+    
+    def db_for_write(self, model, **hints):
+        # Later reads have to see the write
+        _state.pinned = _state.wrote = True
+        return PRIMARY
+    
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same rows as the primary
+        databases = (PRIMARY,) + replicas()
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+    
+    def allow_syncdb(self, db, model):
+        # Replicas get their tables from the primary
+        if db in replicas():
+            return False
+        return None
+
+
+class ReplicaPinningMiddleware(object):
+    '''
+    Reads of unsafe requests and of clients that wrote within
+    MOTIONS_PRIMARY_STICKINESS seconds go to the primary
+    '''
+    def process_request(self, request):
+        reset(request.method not in ('GET', 'HEAD', 'OPTIONS', 'TRACE') or
+              COOKIE in request.COOKIES)
+    
+    def process_response(self, request, response):
+        if getattr(_state, 'wrote', False):
+            response.set_cookie(
+                COOKIE, '1', httponly=True,
+                max_age=getattr(settings, 'MOTIONS_PRIMARY_STICKINESS', 10))
+        reset()
+        return response
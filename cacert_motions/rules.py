@@ -0,0 +1,205 @@
+'''
+Decision rules of motions
+
+Every motion names the rule that decides its outcome once it is closed,
+optionally after a quorum of votes. Rules decide single motions in Python
+and provide the same decision as an SQL condition, so `with_outcomes()`
+evaluates a whole queryset of motions in the query that loads them.
+
+More rules are added with `register()` before the models are loaded, for
+example from the models module of another app listed before this one.
+
+The following settings are used:
+
+MOTIONS_PRESIDENT
+    Username of the member whose vote decides ties under the casting vote
+    rule, without it ties are declined
+'''
+from collections import namedtuple, OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+
+
+Tally = namedtuple('Tally', ('ayes', 'nays', 'abstains', 'proxies',
+                             'casting_vote'))
+
+
+class DecisionRule(object):
+    label = None
+    # Whether `decide()` looks at the vote of the president
+    uses_casting_vote = False
+    
+    def decide(self, tally):
+        '''
+        Whether a closed motion with `tally` is approved
+        :type  tally: Tally
+        :rtype: bool
+        '''
+        raise NotImplementedError
+    
+    def condition(self, columns):
+        '''
+        SQL condition that holds for the motions `decide()` approves
+        :param columns: SQL expressions of the fields of `Tally`
+        :type  columns: dict
+        :rtype: str
+        '''
+        raise NotImplementedError
+
+
+class Majority(DecisionRule):
+    label = 'Simple majority'
+    
+    def decide(self, tally):
+        return tally.ayes > tally.nays
+    
+    def condition(self, columns):
+        return '%(ayes)s > %(nays)s' % columns
+
+
+class CastingVote(Majority):
+    label = 'Simple majority, the president decides ties'
+    uses_casting_vote = True
+    
+    def decide(self, tally):
+        if tally.ayes == tally.nays:
+            return tally.casting_vote is True
+        return super(CastingVote, self).decide(tally)
+    
+    def condition(self, columns):
+        return '(%s OR (%%(ayes)s = %%(nays)s AND %%(casting_vote)s))' \
+               % super(CastingVote, self).condition(columns) % columns
+
+
+class TwoThirds(DecisionRule):
+    label = 'Two-thirds majority'
+    
+    def decide(self, tally):
+        return tally.ayes > 0 and \
+               3 * tally.ayes >= 2 * (tally.ayes + tally.nays)
+    
+    def condition(self, columns):
+        return '(%(ayes)s > 0 AND 3 * %(ayes)s >= 2 * (%(ayes)s + %(nays)s))' \
+               % columns
+
+
+RULES = OrderedDict((
+    ('majority', Majority()),
+    ('casting_vote', CastingVote()),
+    ('two_thirds', TwoThirds()),
+))
+# Used as the choices of `Motion.rule`, `register()` extends it in place
+CHOICES = [(name, rule.label) for name, rule in RULES.items()]
+DEFAULT = 'majority'
+
+
+def register(name, rule):
+    '''
+    Make `rule` available to motions as `name`
+    :type  rule: DecisionRule
+    '''
+    RULES[name] = rule
+    CHOICES.append((name, rule.label))
+
+
+def casting_vote(number):
+    '''
+    Vote of the president on motion `number`
+    :rtype: bool or None if the president abstained, did not vote or is
+            not configured
+    '''
+    from .models import Vote
+    president = getattr(settings, 'MOTIONS_PRESIDENT', None)
+    if president is None:
+        return None
+    User = get_user_model()
+    return Vote.objects.filter(
+        motion=number,
+        **{'voter__%s' % User.USERNAME_FIELD: president}
+    ).values_list('vote', flat=True).first()
+
+
+def decide(motion, tally=None):
+    '''
+    Outcome of closed `motion` under its rule and quorum, the vote of the
+    president is only read for rules using it
+    :param tally: ayes, nays, abstains and proxies to use instead of the
+                  tallies stored on the motion, or a `Tally` that also
+                  holds the vote of the president
+    :rtype: bool
+    '''
+    rule = RULES.get(motion.rule)
+    if tally is None:
+        tally = (motion.ayes_count, motion.nays_count, motion.abstains_count,
+                 motion.proxies_count)
+    if rule is None or sum(tally[:3]) < motion.quorum:
+        return False
+    if not isinstance(tally, Tally):
+        vote = casting_vote(motion.number) if rule.uses_casting_vote else None
+        tally = Tally(*tally, casting_vote=vote)
+    return rule.decide(tally)
+
+
+def with_outcomes(queryset, now=None):
+    '''
+    Annotate the motions of `queryset` with their `outcome`: None while
+    open, else 1 if approved and 0 if declined. Finalized motions have the
+    outcome of their result.
+    :param queryset: motions, or objects joined with their motion by
+                     `select_related()`, which get the `outcome` of their
+                     motion
+    :param now: time to decide which motions are still open
+    :rtype: MotionQuerySet
+    '''
+    from .models import Motion, MotionResult, Vote
+    table = Motion._meta.db_table
+    columns = dict((name, '%s.%s' % (table, field)) for name, field in (
+        ('ayes', 'ayes_count'), ('nays', 'nays_count'),
+        ('abstains', 'abstains_count'), ('proxies', 'proxies_count'),
+    ))
+    
+    president = getattr(settings, 'MOTIONS_PRESIDENT', None)
+    president_params = []
+    if president is None:
+        columns['casting_vote'] = 'NULL'
+    else:
+        User = get_user_model()
+        columns['casting_vote'] = (
+            '(SELECT v.vote FROM %s v INNER JOIN %s u ON u.%s = v.voter_id '
+            'WHERE v.motion_id = %s.number AND u.%s = %%s)' % (
+                Vote._meta.db_table, User._meta.db_table,
+                User._meta.pk.column, table,
+                User._meta.get_field(User.USERNAME_FIELD).column))
+        president_params = [president]
+    
+    sql = [
+        'CASE WHEN %s.due >= %%s THEN NULL' % table,
+        'WHEN %(table)s.finalized THEN (CASE WHEN (SELECT approved FROM '
+        '%(results)s WHERE motion_id = %(table)s.number) THEN 1 ELSE 0 END)'
+        % {'table': table, 'results': MotionResult._meta.db_table},
+        'WHEN %(ayes)s + %(nays)s + %(abstains)s < %%s.quorum THEN 0'
+        % columns % table,
+    ]
+    params = [now or timezone.now()]
+    for name, rule in RULES.items():
+        condition = rule.condition(columns)
+        sql.append('WHEN %s.rule = %%s AND %s THEN 1' % (table, condition))
+        params.append(name)
+        # The condition contains the vote of the president as often as it
+        # uses it
+        params += president_params * condition.count(columns['casting_vote'])
+    sql.append('ELSE 0 END')
+    return queryset.extra(select={'outcome': ' '.join(sql)},
+                          select_params=params)
+
+
+def evaluate(queryset, now=None):
+    '''
+    Outcomes of the motions of `queryset` in one query
+    :rtype: dict of motion number to True, False or None while open
+    '''
+    return dict((number, None if outcome is None else bool(outcome))
+                for number, outcome in with_outcomes(queryset, now)
+                                       .values_list('number', 'outcome'))
@@ -0,0 +1,18 @@
+'''
+Sample data shared by the tests and the benchmark commands
+'''
+
+# Self-signed certificate of Alice Cooper <alice@example.com>
+CLIENT_CERT = '''
+-----BEGIN CERTIFICATE-----
+MIIBmzCCAVWgAwIBAgIJAJ6nJQDxDeyKMA0GCSqGSIb3DQEBBQUAMDkxFTATBgNV
+BAMMDEFsaWNlIENvb3BlcjEgMB4GCSqGSIb3DQEJARYRYWxpY2VAZXhhbXBsZS5j
+b20wHhcNMTMxMjI3MTkyNzEyWhcNMjUwMzE1MTkyNzEyWjA5MRUwEwYDVQQDDAxB
+bGljZSBDb29wZXIxIDAeBgkqhkiG9w0BCQEWEWFsaWNlQGV4YW1wbGUuY29tMEww
+DQYJKoZIhvcNAQEBBQADOwAwOAIxAOskcOwI4jU07L/wsR1voVoPeWUdSmz6cfH1
+TcLEw0DjKQ9qabImdAZazd7DcoLs8QIDAQABo1AwTjAdBgNVHQ4EFgQU71qcj7il
+AbNhCTYsK8HXnHbX9mgwHwYDVR0jBBgwFoAU71qcj7ilAbNhCTYsK8HXnHbX9mgw
+DAYDVR0TBAUwAwEB/zANBgkqhkiG9w0BAQUFAAMxAH5jmSrviBKHmVkPhWtbb1mw
+sfj0L1jexV4nekJLUHx1z7wzwOxGdRhnBAg/7E4EgA==
+-----END CERTIFICATE-----
+'''
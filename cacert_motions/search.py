@@ -0,0 +1,165 @@
+'''
+Full-text search over the titles and texts of motions
+
+The index lives in its own table next to the motions and is kept in sync by
+`Motion.save()` and a post_delete handler. The table is created by the
+migrations:
+
+SQLite
+    An FTS5 virtual table ranked with bm25(), SQLite has to be built with
+    FTS5 (the default since 3.9).
+
+PostgreSQL
+    A table of tsvectors with a GIN index ranked with ts_rank(). The text
+    search configuration is taken from the setting MOTIONS_SEARCH_CONFIG,
+    'english' by default. The index is built with the configuration at the
+    time of the migration, migrate back to 0013 and forward again after
+    changing it.
+
+Other databases fall back to `icontains` lookups.
+
+Searches return the motions with an extra `rank` column, lower values
+match better so results can always be ordered by 'rank'.
+'''
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+
+TABLE = 'cacert_motions_motionsearch'
+
+MOTION_NUMBER = re.compile(r'^m\d{1,8}(\.\d*)?$')
+
+
+class SearchBackend(object):
+    def index(self, motion):
+        '''
+        Add or replace `motion` in the index
+        '''
+        pass
+    
+    def index_many(self, motions):
+        '''
+        Add new `motions` to the index
+        '''
+        for motion in motions:
+            self.index(motion)
+    
+    def remove(self, number):
+        pass
+    
+    def search(self, queryset, query):
+        '''
+        Motions of `queryset` matching `query`
+        :rtype: MotionQuerySet
+        '''
+        matches = Q()
+        for term in query.split():
+            matches &= Q(title__icontains=term) | Q(text__icontains=term)
+        return queryset.filter(matches).extra(select={'rank': '0'})
+
+
+class SQLiteBackend(SearchBackend):
+    @staticmethod
+    def match_expression(query):
+        '''
+        FTS5 query matching all terms of `query`, every term is quoted so
+        user input cannot use the FTS5 query syntax
+        '''
+        return u' '.join(u'"%s"' % term.replace(u'"', u'""')
+                         for term in query.split())
+    
+    def index(self, motion):
+        cursor = connection.cursor()
+        cursor.execute('DELETE FROM %s WHERE number = %%s' % TABLE,
+                       [motion.number])
+        cursor.execute('INSERT INTO %s (number, title, text) '
+                       'VALUES (%%s, %%s, %%s)' % TABLE,
+                       [motion.number, motion.title, motion.text])
+    
+    def index_many(self, motions):
+        connection.cursor().executemany(
+            'INSERT INTO %s (number, title, text) VALUES (%%s, %%s, %%s)'
+            % TABLE,
+            [(motion.number, motion.title, motion.text) for motion in motions])
+    
+    def remove(self, number):
+        connection.cursor().execute(
+            'DELETE FROM %s WHERE number = %%s' % TABLE, [number])
+    
+    def search(self, queryset, query):
+        return queryset.extra(
+            select={'rank': 'bm25(%s)' % TABLE},
+            tables=[TABLE],
+            where=['%s.number = cacert_motions_motion.number' % TABLE,
+                   '%s MATCH %%s' % TABLE],
+            params=[self.match_expression(query)],
+        )
+
+
+class PostgreSQLBackend(SearchBackend):
+    def __init__(self):
+        self.config = getattr(settings, 'MOTIONS_SEARCH_CONFIG', 'english')
+    
+    def index(self, motion):
+        cursor = connection.cursor()
+        cursor.execute('DELETE FROM %s WHERE number = %%s' % TABLE,
+                       [motion.number])
+        cursor.execute(
+            'INSERT INTO %s (number, document) VALUES (%%s, '
+            'setweight(to_tsvector(%%s::regconfig, %%s), \'A\') || '
+            'setweight(to_tsvector(%%s::regconfig, %%s), \'B\'))' % TABLE,
+            [motion.number, self.config, motion.title,
+             self.config, motion.text])
+    
+    def index_many(self, motions):
+        connection.cursor().executemany(
+            'INSERT INTO %s (number, document) VALUES (%%s, '
+            'setweight(to_tsvector(%%s::regconfig, %%s), \'A\') || '
+            'setweight(to_tsvector(%%s::regconfig, %%s), \'B\'))' % TABLE,
+            [(motion.number, self.config, motion.title, self.config,
+              motion.text) for motion in motions])
+    
+    def remove(self, number):
+        connection.cursor().execute(
+            'DELETE FROM %s WHERE number = %%s' % TABLE, [number])
+    
+    def search(self, queryset, query):
+        return queryset.extra(
+            select={'rank': '-ts_rank(%s.document, '
+                            'plainto_tsquery(%%s::regconfig, %%s))' % TABLE},
+            select_params=(self.config, query),
+            tables=[TABLE],
+            where=['%s.number = cacert_motions_motion.number' % TABLE,
+                   '%s.document @@ plainto_tsquery(%%s::regconfig, %%s)'
+                   % TABLE],
+            params=[self.config, query],
+        )
+
+
+BACKENDS = {
+    'sqlite': SQLiteBackend,
+    'postgresql': PostgreSQLBackend,
+}
+
+
+def get_backend():
+    ':rtype: SearchBackend'
+    return BACKENDS.get(connection.vendor, SearchBackend)()
+
+
+def search(queryset, query):
+    '''
+    Motions of `queryset` matching `query`, a (partial) motion number
+    matches the motions it starts
+    :rtype: MotionQuerySet
+    '''
+    query = query.strip()
+    if not query:
+        return queryset.none().extra(select={'rank': '0'})
+    if MOTION_NUMBER.match(query):
+        return queryset.filter(number__startswith=query) \
+                       .extra(select={'rank': '0'})
+    return get_backend().search(queryset, query)
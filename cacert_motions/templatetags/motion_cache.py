@@ -0,0 +1,39 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from .. import caching
+
+register = template.Library()
+
+
+class MotionCacheNode(template.Node):
+    def __init__(self, nodelist, motion, fragment):
+        self.nodelist = nodelist
+        self.motion = motion
+        self.fragment = fragment
+    
+    def render(self, context):
+        motion = self.motion.resolve(context)
+        fragment = self.fragment.resolve(context)
+        return mark_safe(caching.fragment(
+            motion, fragment, lambda: self.nodelist.render(context)))
+
+
+@register.tag
+def motioncache(parser, token):
+    '''
+    Cache the enclosed fragment of a motion until the motion or its votes
+    change, see `cacert_motions.caching`
+    
+    Usage::
+        
+        {% motioncache motion "row" %} ... {% endmotioncache %}
+    '''
+    bits = token.split_contents()
+    if len(bits) != 3:
+        raise template.TemplateSyntaxError(
+            "'%s' takes a motion and the name of the fragment" % bits[0])
+    nodelist = parser.parse(('endmotioncache',))
+    parser.delete_first_token()
+    return MotionCacheNode(nodelist, parser.compile_filter(bits[1]),
+                           parser.compile_filter(bits[2]))
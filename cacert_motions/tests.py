@@ -1,29 +1,113 @@
 from __future__ import with_statement
 
-from django.test import TestCase
+from django.test import (SimpleTestCase, TestCase, TransactionTestCase,
+                         RequestFactory)
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.core.urlresolvers import resolve, reverse
+from django.db import connection, transaction
+from django.http import HttpResponse
 from django.contrib.auth.models import User
 from django.utils import timezone
-from datetime import timedelta, datetime
+from datetime import date, timedelta, datetime
+from unittest import skipIf
+import csv
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
 
 import django.core.exceptions
+from django.contrib import admin
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.utils.six import StringIO
 
-from .models import Motion
+from .models import (Motion, MotionResult, Vote, ProxyVote, Certificate,
+                     MemberStatistics, MonthlyStatistics, VoteChainEntry,
+                     MotionSequence, VoteChainCheckpoint, Notification,
+                     member_statistics)
+from . import (ballots, caching, certificates, chain, export, importer,
+               notifications, routers, rules, samples, search)
+from .views import MotionListView, MemberHistoryView
+from .instrumentation import QueryBudgetTestMixin, QueryBudgetExceeded
 
-class MotionTest(TestCase):
-    
-    CLIENT_CERT = '''
-    -----BEGIN CERTIFICATE-----
-    MIIBmzCCAVWgAwIBAgIJAJ6nJQDxDeyKMA0GCSqGSIb3DQEBBQUAMDkxFTATBgNV
-    BAMMDEFsaWNlIENvb3BlcjEgMB4GCSqGSIb3DQEJARYRYWxpY2VAZXhhbXBsZS5j
-    b20wHhcNMTMxMjI3MTkyNzEyWhcNMjUwMzE1MTkyNzEyWjA5MRUwEwYDVQQDDAxB
-    bGljZSBDb29wZXIxIDAeBgkqhkiG9w0BCQEWEWFsaWNlQGV4YW1wbGUuY29tMEww
-    DQYJKoZIhvcNAQEBBQADOwAwOAIxAOskcOwI4jU07L/wsR1voVoPeWUdSmz6cfH1
-    TcLEw0DjKQ9qabImdAZazd7DcoLs8QIDAQABo1AwTjAdBgNVHQ4EFgQU71qcj7il
-    AbNhCTYsK8HXnHbX9mgwHwYDVR0jBBgwFoAU71qcj7ilAbNhCTYsK8HXnHbX9mgw
-    DAYDVR0TBAUwAwEB/zANBgkqhkiG9w0BAQUFAAMxAH5jmSrviBKHmVkPhWtbb1mw
-    sfj0L1jexV4nekJLUHx1z7wzwOxGdRhnBAg/7E4EgA==
-    -----END CERTIFICATE-----
-    '''
+class MotionTest(QueryBudgetTestMixin, TestCase):
+    
+    CLIENT_CERT = samples.CLIENT_CERT
+    
+    def make_certificate(self, subject, email=None, issuer=None, serial=1,
+                         not_after=datetime(2100, 1, 1)):
+        '''
+        Helper for creating RSA certificates, returns the certificate and
+        its private key. Without an `issuer` the certificate is a CA.
+        '''
+        from cryptography import x509
+        from cryptography.hazmat.backends import default_backend
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import rsa
+        
+        key = rsa.generate_private_key(65537, 1024, default_backend())
+        name = [x509.NameAttribute(x509.oid.NameOID.COMMON_NAME,
+                                   unicode(subject))]
+        if email:
+            name.append(x509.NameAttribute(x509.oid.NameOID.EMAIL_ADDRESS,
+                                           unicode(email)))
+        name = x509.Name(name)
+        issuer_certificate, issuer_key = issuer or (None, key)
+        certificate = x509.CertificateBuilder() \
+            .subject_name(name) \
+            .issuer_name(issuer_certificate.subject if issuer else name) \
+            .public_key(key.public_key()) \
+            .serial_number(serial) \
+            .not_valid_before(datetime(2000, 1, 1)) \
+            .not_valid_after(not_after) \
+            .sign(issuer_key, hashes.SHA256(), default_backend())
+        return certificate, key
+    
+    def make_crl(self, issuer, *serials):
+        '''
+        Helper for creating a PEM encoded CRL revoking `serials`
+        '''
+        from cryptography import x509
+        from cryptography.hazmat.backends import default_backend
+        from cryptography.hazmat.primitives import hashes, serialization
+        
+        certificate, key = issuer
+        crl = x509.CertificateRevocationListBuilder() \
+            .issuer_name(certificate.subject) \
+            .last_update(datetime(2000, 1, 1)) \
+            .next_update(datetime(2100, 1, 1))
+        for serial in serials:
+            crl = crl.add_revoked_certificate(
+                x509.RevokedCertificateBuilder()
+                    .serial_number(serial)
+                    .revocation_date(datetime(2000, 1, 1))
+                    .build(default_backend())
+            )
+        crl = crl.sign(key, hashes.SHA256(), default_backend())
+        return crl.public_bytes(serialization.Encoding.PEM)
+    
+    @staticmethod
+    def pem(certificate):
+        from cryptography.hazmat.primitives import serialization
+        return certificate.public_bytes(serialization.Encoding.PEM) \
+                          .decode('ascii')
+    
+    def write_file(self, name, data):
+        '''
+        Helper for writing files into a temporary directory of the test
+        '''
+        if not hasattr(self, 'tmpdir'):
+            self.tmpdir = tempfile.mkdtemp()
+            self.addCleanup(shutil.rmtree, self.tmpdir)
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
     
     @classmethod
     def setUpClass(cls):
@@ -226,7 +310,189 @@ class MotionTest(TestCase):
                          proxy=self.bob,
                          justification='Vote during board meeting',
                          certificate=self.CLIENT_CERT)
+
+    
+    def test_vote_queries(self):
+        '''
+        Test if casting votes relies on the database constraints instead of
+        running validation queries
+        '''
+        m = self.create_motion()
+        certificate = Certificate.from_pem(self.CLIENT_CERT)
+        
+        with CaptureQueriesContext(connection) as queries:
+            m.vote(True, self.alice, certificate)
+            m.proxy_vote(vote=False,
+                         voter=self.bob,
+                         proxy=self.alice,
+                         justification='Vote during board meeting',
+                         certificate=certificate)
+        # Appending to the hash chain has to read its head
+        self.assertEqual(
+            [],
+            [q['sql'] for q in queries
+             if 'SELECT' in q['sql'] and 'INSERT' not in q['sql'] and
+                'votechainhead' not in q['sql']],
+        )
+        self.assertEqual(1, m.ayes().count())
+        self.assertEqual(1, m.nays().count())
+        
+        # Duplicates still produce the same error as full_clean()
+        try:
+            m.vote(False, self.bob, self.CLIENT_CERT)
+        except django.core.exceptions.ValidationError as e:
+            self.assertEqual(
+                {django.core.exceptions.NON_FIELD_ERRORS: [
+                    u'Vote with this Motion and Voter already exists.',
+                ]},
+                e.message_dict,
+            )
+        else:
+            self.fail('Duplicate vote not detected')
+        self.assertEqual(1, m.nays().count())
+
+    
+    def test_certificates(self):
+        '''
+        Test if certificates are stored only once and referenced by their
+        fingerprint
+        '''
+        m = self.create_motion()
+        m.vote(True, self.alice, self.CLIENT_CERT)
+        m.vote(True, self.bob, self.CLIENT_CERT.strip())
+        m.proxy_vote(vote=False,
+                     voter=self.carole,
+                     proxy=self.alice,
+                     justification='Vote during board meeting',
+                     certificate=self.CLIENT_CERT)
+        
+        self.assertEqual(1, Certificate.objects.count())
+        fingerprint = Certificate.objects.get().fingerprint
+        self.assertEqual(
+            '55461abec90d66aca087bd803c59a827097a425cd774c4a1b65d670d6bb7fb12',
+            fingerprint,
+        )
+        self.assertEqual(3, Vote.objects.filter(certificate=fingerprint).count())
+        
+        for invalid in ('', 'no certificate', self.CLIENT_CERT.replace('M', '%')):
+            with self.assertRaises(ValueError):
+                certificates.fingerprint(invalid)
+            with self.assertRaises(django.core.exceptions.ValidationError,
+                                   msg='Invalid certificate accepted'):
+                m.vote(True, self.dave, invalid)
+        self.assertEqual(1, Certificate.objects.count())
+
+    
+    @skipIf(certificates.x509 is None, 'cryptography is not installed')
+    def test_certificate_verification(self):
+        '''
+        Test if certificates are verified, mapped to users and cached
+        '''
+        bundle = self.write_file('ca.pem', self.CLIENT_CERT.encode('ascii'))
+        verifier = certificates.Verifier(bundle)
+        valid = datetime(2020, 1, 1)
+        
+        verified = verifier.verify(self.CLIENT_CERT, now=valid)
+        self.assertEqual(self.alice.pk, verified.user_id)
+        self.assertEqual(u'alice@example.com', verified.email)
+        self.assertEqual(certificates.fingerprint(self.CLIENT_CERT),
+                         verified.fingerprint)
+        self.assertEqual((0, 1), (verifier.cache.hits, verifier.cache.misses))
+        
+        self.assertEqual(verified, verifier.verify(self.CLIENT_CERT, now=valid))
+        self.assertEqual((1, 1), (verifier.cache.hits, verifier.cache.misses))
+        
+        # Cached verifications end with the certificate's validity
+        with self.assertRaises(certificates.VerificationError):
+            verifier.verify(self.CLIENT_CERT, now=datetime(2025, 3, 16))
+        with self.assertRaises(certificates.VerificationError):
+            verifier.verify(self.CLIENT_CERT, now=datetime(2013, 12, 1))
+        
+        # Certificates of unknown CAs
+        ca = self.make_certificate(u'Test CA')
+        other, key = self.make_certificate(u'Alice', 'alice@example.com', ca)
+        with self.assertRaises(certificates.VerificationError):
+            verifier.verify(self.pem(other), now=valid)
+        
+        # The cache is bounded
+        verifier = certificates.Verifier(
+            self.write_file('bundle.pem', self.pem(ca[0]).encode('ascii')),
+            cache_size=2,
+        )
+        for user in (self.alice, self.bob, self.carole):
+            client, key = self.make_certificate(user.first_name, user.email,
+                                                ca, serial=user.pk)
+            self.assertEqual(user.pk, verifier.verify(self.pem(client)).user_id)
+        self.assertEqual(2, len(verifier.cache))
+        
+        # Certificates of unknown users
+        client, key = self.make_certificate(u'Mallory', 'mallory@example.com', ca)
+        with self.assertRaises(certificates.VerificationError):
+            verifier.verify(self.pem(client))
     
+    @skipIf(certificates.x509 is None, 'cryptography is not installed')
+    def test_certificate_revocation(self):
+        '''
+        Test if revoked certificates are rejected once the CRL is reloaded
+        '''
+        ca = self.make_certificate(u'Test CA')
+        bob, key = self.make_certificate(u'Bob', 'bob@example.com', ca, serial=2)
+        carole, key = self.make_certificate(u'Carole', 'carole@example.com', ca,
+                                            serial=3)
+        bundle = self.write_file('ca.pem', self.pem(ca[0]).encode('ascii'))
+        crl = self.write_file('ca.crl', self.make_crl(ca))
+        
+        verifier = certificates.Verifier(bundle, crl)
+        verifier.verify(self.pem(bob))
+        verifier.verify(self.pem(carole))
+        
+        self.write_file('ca.crl', self.make_crl(ca, 3))
+        os.utime(crl, (0, 0))
+        verifier.verify(self.pem(bob))
+        with self.assertRaises(certificates.VerificationError):
+            verifier.verify(self.pem(carole))
+        
+        # CRLs have to be signed by a known CA
+        self.write_file('ca.crl', self.make_crl(self.make_certificate(u'Test CA')))
+        os.utime(crl, (1, 1))
+        with self.assertRaises(certificates.VerificationError):
+            verifier.verify(self.pem(bob))
+    
+    @skipIf(certificates.x509 is None, 'cryptography is not installed')
+    def test_vote_certificate_verification(self):
+        '''
+        Test if votes need a verified certificate of the user entering them
+        once a CA bundle is configured
+        '''
+        ca = self.make_certificate(u'Test CA')
+        alice, key = self.make_certificate(u'Alice', 'alice@example.com', ca)
+        bob, key = self.make_certificate(u'Bob', 'bob@example.com', ca)
+        bundle = self.write_file('ca.pem', self.pem(ca[0]).encode('ascii'))
+        m = self.create_motion()
+        
+        with override_settings(MOTIONS_CA_BUNDLE=bundle):
+            m.vote(True, self.alice, self.pem(alice))
+            m.proxy_vote(vote=True,
+                         voter=self.carole,
+                         proxy=self.alice,
+                         justification='Vote during board meeting',
+                         certificate=self.pem(alice))
+            
+            for certificate in (self.pem(alice), self.CLIENT_CERT):
+                with self.assertRaises(django.core.exceptions.ValidationError):
+                    m.vote(True, self.bob, certificate)
+            with self.assertRaises(django.core.exceptions.ValidationError):
+                m.proxy_vote(vote=True,
+                             voter=self.dave,
+                             proxy=self.alice,
+                             justification='Vote during board meeting',
+                             certificate=self.pem(bob))
+            
+            m.vote(False, self.bob, self.pem(bob))
+        
+        self.assertEqual(2, m.ayes().count())
+        self.assertEqual(1, m.nays().count())
+
     
     def test_self_proxy(self):
         '''
@@ -240,7 +506,7 @@ class MotionTest(TestCase):
                          proxy=self.alice,
                          justification='Vote during board meeting',
                          certificate=self.CLIENT_CERT)
-    
+
     
     def test_approved(self):
         '''
@@ -257,5 +523,1568 @@ class MotionTest(TestCase):
         old.vote(False, self.bob, self.CLIENT_CERT)
         old.vote(False, self.carole, self.CLIENT_CERT)
         self.assertIs(old.approved(), False)
+    
+    def assertTallies(self, motion, ayes, nays, abstains, proxies):
+        '''
+        Check the stored tallies of `motion` and the ones of the in-memory
+        instance
+        '''
+        for m in (motion, Motion.objects.get(pk=motion.pk)):
+            self.assertEqual(
+                (ayes, nays, abstains, proxies),
+                (m.ayes_count, m.nays_count, m.abstains_count,
+                 m.proxies_count),
+            )
+    
+    def test_tallies(self):
+        '''
+        Test if the denormalized tallies follow votes being cast, changed
+        and deleted
+        '''
+        m = self.create_motion()
+        self.assertTallies(m, 0, 0, 0, 0)
+        
+        m.vote(True, self.alice, self.CLIENT_CERT)
+        bob = m.vote(False, self.bob, self.CLIENT_CERT)
+        m.vote(None, self.carole, self.CLIENT_CERT)
+        dave = m.proxy_vote(vote=True,
+                            voter=self.dave,
+                            proxy=self.alice,
+                            justification='Vote during board meeting',
+                            certificate=self.CLIENT_CERT)
+        self.assertTallies(m, 2, 1, 1, 1)
+        
+        # Failed votes don't count
+        with self.assertRaises(django.core.exceptions.ValidationError):
+            m.vote(False, self.alice, self.CLIENT_CERT)
+        self.assertTallies(m, 2, 1, 1, 1)
+        
+        bob.vote = True
+        bob.save()
+        self.assertTallies(m, 3, 0, 1, 1)
+        
+        # Editing a proxy vote through its `Vote` part like the admin does
+        vote = Vote.objects.get(pk=dave.pk)
+        vote.vote = None
+        vote.save()
+        m = Motion.objects.get(pk=m.pk)
+        self.assertTallies(m, 2, 0, 2, 1)
+        
+        # Moving a vote to another motion
+        other = self.create_motion(title='Other motion')
+        vote.motion = other
+        vote.save()
+        self.assertTallies(Motion.objects.get(pk=m.pk), 2, 0, 1, 0)
+        self.assertTallies(other, 0, 0, 1, 1)
+        
+        Vote.objects.get(pk=bob.pk).delete()
+        vote.delete()
+        self.assertTallies(Motion.objects.get(pk=m.pk), 1, 0, 1, 0)
+        self.assertTallies(Motion.objects.get(pk=other.pk), 0, 0, 0, 0)
+        
+        # Saving a stale motion must not overwrite the tallies
+        m.title = 'Changed title'
+        m.save()
+        m.vote(False, self.erin, self.CLIENT_CERT)
+        m = Motion.objects.get(pk=m.pk)
+        m.ayes_count = 0
+        m.save()
+        self.assertTallies(Motion.objects.get(pk=m.pk), 1, 1, 1, 0)
+    
+    def test_rebuild_tallies(self):
+        '''
+        Test if the rebuild_tallies command detects and repairs wrong tallies
+        '''
+        m = self.create_motion()
+        m.vote(True, self.alice, self.CLIENT_CERT)
+        m.proxy_vote(vote=False,
+                     voter=self.bob,
+                     proxy=self.alice,
+                     justification='Vote during board meeting',
+                     certificate=self.CLIENT_CERT)
+        
+        call_command('rebuild_tallies', check=True, stdout=StringIO())
+        
+        Motion.objects.filter(pk=m.pk).update(ayes_count=5, proxies_count=0)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_tallies', check=True, stdout=StringIO())
+        
+        call_command('rebuild_tallies', stdout=StringIO())
+        self.assertTallies(Motion.objects.get(pk=m.pk), 1, 1, 0, 1)
+        call_command('rebuild_tallies', check=True, stdout=StringIO())
+    
+    def test_admin_changelist_queries(self):
+        '''
+        Test if the motion changelist needs the same number of queries
+        regardless of the number of motions shown
+        '''
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        url = reverse('admin:cacert_motions_motion_changelist')
+        
+        def changelist_queries(**params):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, params)
+            self.assertEqual(200, response.status_code)
+            return len(queries)
+        
+        old = self.create_motion(due=timezone.now() - timedelta(days=1))
+        old.vote(True, self.alice, self.CLIENT_CERT)
+        expected = changelist_queries()
+        
+        for i in range(20):
+            m = self.create_motion(title='Motion %d' % i,
+                                   due=timezone.now() - timedelta(days=i % 2))
+            m.vote(i % 3 == 0, self.alice, self.CLIENT_CERT)
+            m.proxy_vote(vote=None,
+                         voter=self.bob,
+                         proxy=self.alice,
+                         justification='Vote during board meeting',
+                         certificate=self.CLIENT_CERT)
+        self.assertEqual(expected, changelist_queries())
+        
+        # Sorting by the annotated columns
+        for column in range(1, 7):
+            for order in ('', '-'):
+                self.assertEqual(expected,
+                                 changelist_queries(o=order + str(column)))
+        
+        response = self.client.get(url, {'o': '-1'})
+        outcomes = [m.outcome for m in response.context['cl'].result_list]
+        self.assertEqual(sorted(outcomes, reverse=True), outcomes)
+    
+    def test_motion_list(self):
+        '''
+        Test if the motion list pages through all motions by status with a
+        constant number of queries
+        '''
+        past = timezone.now() - timedelta(days=1)
+        for i in range(3):
+            self.create_motion(title='Open motion %d' % i)
+            self.create_motion(title='Closed motion %d' % i, due=past)
+            self.create_motion(title='Withdrawn motion %d' % i, withdrawn=True)
+        
+        def walk(status=None):
+            '''
+            Page through the list with two motions per page in both
+            directions, return the motion numbers of each direction
+            '''
+            view = MotionListView.as_view(page_size=2)
+            params = {'status': status} if status else {}
+            pages = []
+            while True:
+                response = view(RequestFactory().get('/', params))
+                pages.append([m.number for m in response.context_data['motion_list']])
+                if not response.context_data['older']:
+                    break
+                params['before'] = response.context_data['older']
+            self.assertTrue(all(len(page) == 2 for page in pages[:-1]))
+            
+            backwards = [pages[-1]]
+            del params['before']
+            params['after'] = pages[-1][0]
+            while True:
+                response = view(RequestFactory().get('/', params))
+                backwards.append([m.number for m in response.context_data['motion_list']])
+                if not response.context_data['newer']:
+                    break
+                params['after'] = response.context_data['newer']
+            return sum(pages, []), sum(reversed(backwards), [])
+        
+        ordered = Motion.objects.order_by('-created', '-number')
+        for status, motions in (
+                (None, ordered),
+                ('open', ordered.filter(withdrawn=False, due__gt=past)),
+                ('closed', ordered.filter(withdrawn=False, due__lte=past)),
+                ('withdrawn', ordered.filter(withdrawn=True)),
+                ):
+            forwards, backwards = walk(status)
+            expected = [m.number for m in motions]
+            self.assertEqual(expected, forwards)
+            self.assertEqual(expected, backwards)
+        
+        def list_queries(**params):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('motion_list'), params)
+            self.assertEqual(200, response.status_code)
+            return len(queries)
+        
+        last = ordered[0].number
+        expected = (list_queries(), list_queries(before=last))
+        for i in range(10):
+            m = self.create_motion(title='Another motion %d' % i,
+                                   proponent=(self.bob, self.carole)[i % 2])
+            m.vote(True, self.alice, self.CLIENT_CERT)
+        self.assertEqual(expected, (list_queries(), list_queries(before=last)))
+    
+    def test_motion_detail(self):
+        '''
+        Test if the motion detail page shows all ballots with a fixed
+        number of queries
+        '''
+        m = self.create_motion()
+        url = reverse('motion_detail', args=(m.pk,))
+        m.vote(True, self.alice, self.CLIENT_CERT)
+        with self.assertNumQueries(2):
+            self.assertEqual(200, self.client.get(url).status_code)
+        
+        m.vote(False, self.bob, self.CLIENT_CERT)
+        m.vote(None, self.carole, self.CLIENT_CERT)
+        for voter, proxy in ((self.dave, self.alice),
+                             (self.erin, self.bob),
+                             (self.frank, self.alice)):
+            m.proxy_vote(vote=True,
+                         voter=voter,
+                         proxy=proxy,
+                         justification='%s is on vacation' % voter.first_name,
+                         certificate=self.CLIENT_CERT)
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        
+        ballots = response.context['ballots']
+        self.assertEqual(6, len(ballots))
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                [(u'Alice', None), (u'Bob', None), (u'Carol', None),
+                 (u'Dave', u'Alice'), (u'Erin', u'Bob'), (u'Frank', u'Alice')],
+                [(vote.voter.first_name, vote.proxy and vote.proxy.first_name)
+                 for vote in ballots],
+            )
+            for vote in ballots:
+                unicode(vote)
+        self.assertContains(response, 'Erin is on vacation')
+    
+    def test_finalize(self):
+        '''
+        Test if closed motions get an immutable result snapshot
+        '''
+        m = self.create_motion()
+        m.vote(True, self.alice, self.CLIENT_CERT)
+        with self.assertRaises(django.core.exceptions.ValidationError):
+            m.finalize()
+        
+        Motion.objects.filter(pk=m.pk).update(
+            due=timezone.now() - timedelta(days=1))
+        m = Motion.objects.get(pk=m.pk)
+        m.proxy_vote(vote=False,
+                     voter=self.bob,
+                     proxy=self.alice,
+                     justification='Vote during board meeting',
+                     certificate=self.CLIENT_CERT)
+        m.vote(False, self.carole, self.CLIENT_CERT)
+        # Wrong tallies are corrected by the snapshot
+        Motion.objects.filter(pk=m.pk).update(ayes_count=7)
+        
+        result = m.finalize()
+        self.assertEqual((1, 2, 0, 1, False),
+                         (result.ayes, result.nays, result.abstains,
+                          result.proxies, result.approved))
+        self.assertTallies(m, 1, 2, 0, 1)
+        self.assertTrue(result.check_digest())
+        self.assertEqual(result, m.finalize())
+        
+        m = Motion.objects.select_related('result').get(pk=m.pk)
+        with self.assertNumQueries(0):
+            self.assertIs(m.approved(), False)
+        
+        # Neither votes nor the motion can be changed anymore
+        with self.assertRaises(django.core.exceptions.ValidationError):
+            m.vote(True, self.dave, self.CLIENT_CERT)
+        vote = Vote.objects.get(motion=m, voter=self.carole)
+        vote.vote = True
+        with self.assertRaises(django.core.exceptions.ValidationError):
+            vote.save()
+        with self.assertRaises(django.core.exceptions.ValidationError):
+            vote.delete()
+        m.title = 'Changed'
+        with self.assertRaises(django.core.exceptions.ValidationError):
+            m.save()
+        self.assertEqual(3, Vote.objects.filter(motion=m).count())
+        self.assertTallies(m, 1, 2, 0, 1)
+        
+        # The admin shows the motion without saving it
+        User.objects.create_superuser('result-admin',
+                                      'result-admin@example.com', 'secret')
+        self.client.login(username='result-admin', password='secret')
+        url = reverse('admin:cacert_motions_motion_change', args=(m.pk,))
+        self.assertEqual(200, self.client.get(url).status_code)
+        response = self.client.post(url, {
+            'title': 'Changed', 'vote_set-TOTAL_FORMS': '0',
+            'vote_set-INITIAL_FORMS': '0', 'vote_set-MAX_NUM_FORMS': '0',
+        }, follow=True)
+        self.assertEqual(200, response.status_code)
+        self.assertContains(response, 'is finalized and cannot be changed')
+        self.assertNotEqual('Changed', Motion.objects.get(pk=m.pk).title)
+        
+        # Votes changed behind the models' back are detected
+        call_command('finalize_motions', check=True, stdout=StringIO())
+        Vote.objects.filter(pk=vote.pk).update(vote=True)
+        self.assertFalse(MotionResult.objects.get(pk=m.pk).check_digest())
+        with self.assertRaises(CommandError):
+            call_command('finalize_motions', check=True, stdout=StringIO())
+    
+    def test_finalize_motions(self):
+        '''
+        Test if the finalize_motions command only finalizes closed motions
+        '''
+        open_motion = self.create_motion()
+        closed = self.create_motion(due=timezone.now() - timedelta(days=1))
+        closed.vote(True, self.alice, self.CLIENT_CERT)
+        
+        call_command('finalize_motions', stdout=StringIO())
+        self.assertFalse(Motion.objects.get(pk=open_motion.pk).finalized)
+        closed = Motion.objects.get(pk=closed.pk)
+        self.assertTrue(closed.finalized)
+        self.assertIs(closed.approved(), True)
+        self.assertEqual(1, closed.result.ayes)
+        
+        # Finalized motions are skipped
+        out = StringIO()
+        call_command('finalize_motions', stdout=out)
+        self.assertIn('0 motion(s) finalized', out.getvalue())
+    
+    def test_api(self):
+        '''
+        Test if the JSON API answers unchanged resources with 304 Not
+        Modified and notices votes as well as motions closing
+        '''
+        m = self.create_motion()
+        m.vote(True, self.alice, self.CLIENT_CERT)
+        closed = self.create_motion(due=timezone.now() - timedelta(days=1))
+        
+        for url, queries in ((reverse('api_motion_list'), 2),
+                             (reverse('api_motion_detail', args=(m.pk,)), 1)):
+            response = self.client.get(url)
+            self.assertEqual(200, response.status_code)
+            self.assertEqual('application/json', response['Content-Type'])
+            etag = response['ETag']
+            
+            with self.assertNumQueries(queries):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(304, response.status_code)
+            response = self.client.get(
+                url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            self.assertEqual(304, response.status_code)
+        
+        data = json.loads(self.client.get(reverse('api_motion_list')).content)
+        motions = [dict(zip(data['fields'], motion))
+                   for motion in data['motions']]
+        self.assertEqual([closed.pk, m.pk], [mo['number'] for mo in motions])
+        self.assertEqual([1, 0, 0, 0], motions[1]['tally'])
+        self.assertEqual('closed', motions[0]['status'])
+        
+        # Changing a justification does not touch the tallies but the ETag
+        url = reverse('api_motion_detail', args=(m.pk,))
+        etag = self.client.get(url)['ETag']
+        list_etag = self.client.get(reverse('api_motion_list'))['ETag']
+        vote = m.proxy_vote(vote=None,
+                            voter=self.bob,
+                            proxy=self.alice,
+                            justification='Vote during board meeting',
+                            certificate=self.CLIENT_CERT)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+        etag = response['ETag']
+        vote.justification = 'Vote on the phone'
+        vote.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+        data = json.loads(response.content)
+        self.assertEqual([1, 0, 1, 1], data['tally'])
+        self.assertEqual(
+            [(u'alice', True, None), (u'bob', None, u'alice')],
+            [(v['voter'], v['vote'], v['proxy']) for v in data['votes']],
+        )
+        response = self.client.get(reverse('api_motion_list'),
+                                   HTTP_IF_NONE_MATCH=list_etag)
+        self.assertEqual(200, response.status_code)
+        
+        # Closing a motion changes its status without writing to it
+        etag = response['ETag']
+        Motion.objects.filter(pk=m.pk).update(
+            due=timezone.now() - timedelta(minutes=1))
+        response = self.client.get(reverse('api_motion_list'),
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+        
+        # Withdrawing is noticed without aggregating over all motions
+        etag = response['ETag']
+        m.withdrawn = True
+        m.save()
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse('api_motion_list'),
+                                       HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+        for query in captured.captured_queries[:2]:
+            self.assertNotRegexpMatches(query['sql'], r'(COUNT|SUM|MAX)\(')
+        
+        self.assertEqual(404, self.client.get(
+            reverse('api_motion_detail', args=('m20000101.1',))).status_code)
+    
+    def test_export(self):
+        '''
+        Test if the export streams all motions with their votes in chunks
+        with two queries each
+        '''
+        past = timezone.now() - timedelta(days=1)
+        motions = [self.create_motion(title=u'Motion \xe4 %d' % i,
+                                      due=past if i % 2 else
+                                          timezone.now() + timedelta(days=1))
+                   for i in range(5)]
+        motions[0].vote(True, self.alice, self.CLIENT_CERT)
+        motions[0].proxy_vote(vote=False,
+                              voter=self.bob,
+                              proxy=self.alice,
+                              justification='Vote during board meeting',
+                              certificate=self.CLIENT_CERT)
+        motions[1].vote(None, self.carole, self.CLIENT_CERT)
+        motions[1].finalize()
+        
+        everything = export.filter_motions()
+        with self.assertNumQueries(2 * 3 + 1):
+            lines = list(export.jsonl_lines(everything, chunk_size=2))
+        records = [json.loads(line) for line in lines]
+        self.assertEqual([m.number for m in motions],
+                         [r['number'] for r in records])
+        self.assertEqual(
+            [(u'alice', True, None), (u'bob', False, u'alice')],
+            [(v['voter'], v['vote'], v['proxy']) for v in records[0]['votes']],
+        )
+        self.assertEqual(motions[1].result.digest, records[1]['digest'])
+        
+        rows = list(csv.DictReader(
+            StringIO(''.join(export.csv_lines(everything)))))
+        self.assertEqual(6, len(rows))
+        self.assertEqual(['Aye', 'Naye'], [r['vote'] for r in rows[:2]])
+        self.assertEqual('', rows[-1]['voter'])
+        self.assertEqual(u'Motion \xe4 4', rows[-1]['title'].decode('utf-8'))
+        
+        closed = [m.number for m in motions if m.due == past]
+        response = self.client.get(reverse('motion_export'),
+                                   {'format': 'jsonl', 'status': 'closed'})
+        self.assertEqual('application/x-ndjson', response['Content-Type'])
+        self.assertEqual(closed, [json.loads(line)['number'] for line in
+                                  ''.join(response.streaming_content)
+                                    .splitlines()])
+        
+        today = timezone.now().date()
+        for since, until, expected in ((today, today, 5),
+                                       (today + timedelta(days=1), None, 0),
+                                       (None, today - timedelta(days=1), 0)):
+            self.assertEqual(expected, export.filter_motions(
+                since=since, until=until).count())
+        for params in ({'format': 'xml'}, {'status': 'pending'},
+                       {'since': '2014-02-30'}, {'until': 'yesterday'}):
+            response = self.client.get(reverse('motion_export'), params)
+            self.assertEqual(400, response.status_code)
+        
+        out = StringIO()
+        call_command('export_motions', format='jsonl', status='open',
+                     chunk_size=1, stdout=out)
+        self.assertEqual(
+            [m.number for m in motions if m.due != past],
+            [json.loads(line)['number'] for line in out.getvalue().splitlines()],
+        )
+        with self.assertRaises(CommandError):
+            call_command('export_motions', since='2014-13-01', stdout=out)
+    
+    def test_search(self):
+        '''
+        Test if the full-text index follows motion changes and is used by
+        the public search and the admin
+        '''
+        budget = self.create_motion(title='Budget 2014',
+                                    text='Approve the budget for servers')
+        audit = self.create_motion(title='Server audit',
+                                   text='Audit the servers, not the budget. '
+                                        'Servers need an audit every year.')
+        other = self.create_motion(title='Arbitration',
+                                   text='Appoint "arbitrators" (ABC) OR not')
+        
+        def found(query, queryset=Motion.objects.all()):
+            return [m.number for m in search.search(queryset, query)
+                                             .order_by('rank', '-created')]
+        
+        self.assertEqual([budget.number], found('approve'))
+        self.assertEqual(set([budget.number, audit.number]),
+                         set(found('budget servers')))
+        # Repeated terms rank higher
+        self.assertEqual([audit.number, budget.number], found('servers'))
+        self.assertEqual([], found('budget arbitration'))
+        # Input is never interpreted as query syntax
+        self.assertEqual([other.number], found('"arbitrators" (ABC) OR'))
+        self.assertEqual([], found('   '))
+        self.assertEqual([audit.number], found(audit.number))
+        self.assertEqual([budget.number],
+                         found('budget', Motion.objects.exclude(pk=audit.pk)))
+        
+        other.title = 'Budget arbitration'
+        other.save()
+        self.assertEqual([other.number], found('budget arbitration'))
+        other.delete()
+        self.assertEqual([], found('arbitration'))
+        
+        response = self.client.get(reverse('motion_search'), {'q': 'audit'})
+        self.assertEqual([audit.number],
+                         [m.number for m in response.context['motion_list']])
+        self.assertContains(response, 'Server audit')
+        self.assertEqual([], self.client.get(reverse('motion_search'))
+                                 .context['motion_list'])
+        
+        User.objects.create_superuser('search-admin',
+                                      'search-admin@example.com', 'secret')
+        self.client.login(username='search-admin', password='secret')
+        response = self.assertQueryBudget(
+            reverse('admin:cacert_motions_motion_changelist'), {'q': 'approve'})
+        self.assertEqual([budget.number],
+                         [m.number for m in response.context['cl'].result_list])
+    
+    @override_settings(MOTIONS_LIVE_POLL_INTERVAL=0.01,
+                       MOTIONS_LIVE_CHECK_INTERVAL=60,
+                       MOTIONS_LIVE_KEEPALIVE=0.02,
+                       MOTIONS_LIVE_DURATION=60,
+                       MOTIONS_LIVE_TIMEOUT=0.05)
+    def test_live_tallies(self):
+        '''
+        Test if subscribers get tally changes pushed without querying the
+        database while nothing changes
+        '''
+        m = self.create_motion()
+        response = self.client.get(reverse('motion_live', args=(m.pk,)))
+        self.assertEqual('text/event-stream', response['Content-Type'])
+        events = iter(response.streaming_content)
+        self.assertTrue(next(events).startswith('retry:'))
+        
+        def event():
+            lines = next(events).splitlines()
+            self.assertEqual('event: tally', lines[1])
+            return int(lines[0][len('id: '):]), json.loads(lines[2][len('data: '):])
+        
+        version, state = event()
+        self.assertEqual((m.version, [0, 0, 0, 0]), (version, state['tally']))
+        with self.assertNumQueries(0):
+            for i in range(3):
+                self.assertEqual(': keepalive\n\n', next(events))
+        
+        m.vote(True, self.alice, self.CLIENT_CERT)
+        version, state = event()
+        self.assertEqual((m.version, [1, 0, 0, 0]), (version, state['tally']))
+        m.proxy_vote(vote=None,
+                     voter=self.bob,
+                     proxy=self.alice,
+                     justification='Vote during board meeting',
+                     certificate=self.CLIENT_CERT)
+        self.assertEqual([1, 0, 1, 1], event()[1]['tally'])
+        
+        # Reconnecting browsers only get changes they do not know yet
+        response = self.client.get(reverse('motion_live', args=(m.pk,)),
+                                   HTTP_LAST_EVENT_ID=str(m.version))
+        events = iter(response.streaming_content)
+        next(events)
+        self.assertEqual(': keepalive\n\n', next(events))
+        
+        url = reverse('motion_tally', args=(m.pk,))
+        response = self.client.get(url, {'version': m.version})
+        self.assertEqual(304, response.status_code)
+        response = self.client.get(url, {'version': m.version - 1})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(m.version, json.loads(response.content)['version'])
+        
+        # Closing the motion is the last change
+        Motion.objects.filter(pk=m.pk).update(
+            due=timezone.now() - timedelta(minutes=1))
+        response = self.client.get(url, {'version': m.version})
+        self.assertEqual('closed', json.loads(response.content)['status'])
+        response = self.client.get(reverse('motion_live', args=(m.pk,)))
+        self.assertEqual(2, len(list(response.streaming_content)))
+        
+        self.assertEqual(404, self.client.get(
+            reverse('motion_tally', args=('m20000101.1',))).status_code)
+    
+    def test_query_budgets(self):
+        '''
+        Test if requests are checked against the query budgets of their views
+        '''
+        m = self.create_motion()
+        m.vote(True, self.alice, self.CLIENT_CERT)
+        m.proxy_vote(vote=False,
+                     voter=self.bob,
+                     proxy=self.alice,
+                     justification='Vote during board meeting',
+                     certificate=self.CLIENT_CERT)
+        for i in range(3):
+            self.create_motion()
+        
+        self.assertQueryBudget(reverse('motion_list'))
+        self.assertQueryBudget(reverse('motion_list'), {'before': m.pk})
+        self.assertQueryBudget(reverse('motion_detail', args=(m.pk,)))
+        self.assertQueryBudget(reverse('motion_search'), {'q': 'test'})
+        self.assertQueryBudget(reverse('api_motion_list'))
+        self.assertQueryBudget(reverse('api_motion_detail', args=(m.pk,)))
+        self.assertQueryBudget(reverse('motion_tally', args=(m.pk,)))
+        User.objects.create_superuser('budget-admin',
+                                      'budget-admin@example.com', 'secret')
+        self.client.login(username='budget-admin', password='secret')
+        self.assertQueryBudget(
+            reverse('admin:cacert_motions_motion_changelist'))
+        
+        records = []
+        class Handler(logging.Handler):
+            def emit(self, record):
+                records.append(record)
+        handler = Handler()
+        logger = logging.getLogger('cacert_motions.requests')
+        level, handlers = logger.level, logger.handlers
+        logger.handlers = [handler]
+        logger.setLevel(logging.INFO)
+        try:
+            url = reverse('admin:cacert_motions_motion_changelist')
+            with override_settings(MOTIONS_INSTRUMENTATION_HEADERS=True,
+                                   MOTIONS_QUERY_BUDGETS={}):
+                response = self.client.get(url)
+            self.assertEqual(200, response.status_code)
+            # Without DEBUG the queries are counted, not logged
+            self.assertEqual([], connection.queries)
+            count = int(response['X-Query-Count'])
+            self.assertTrue(response['Server-Timing'].startswith('sql;dur='))
+            self.assertNotIn('X-Query-Budget', response)
+            self.assertEqual(
+                (logging.INFO, url, count, None),
+                (records[-1].levelno, records[-1].instrumentation['path'],
+                 records[-1].instrumentation['queries'],
+                 records[-1].instrumentation['budget']),
+            )
+            
+            # Streamed bodies run after the middleware, they are counted
+            # once they are consumed
+            logged = len(records)
+            response = self.client.get(reverse('motion_export'))
+            self.assertEqual(logged, len(records))
+            ''.join(response.streaming_content)
+            # One chunk of motions with its votes, then the empty chunk
+            self.assertEqual(
+                (reverse('motion_export'), 3),
+                (records[-1].instrumentation['path'],
+                 records[-1].instrumentation['queries']))
+            
+            budgets = {'admin:cacert_motions_motion_changelist': count - 1}
+            with override_settings(MOTIONS_QUERY_BUDGETS=budgets):
+                response = self.client.get(url)
+                self.assertEqual(logging.WARNING, records[-1].levelno)
+                self.assertNotIn('X-Query-Count', response)
+                with override_settings(MOTIONS_QUERY_BUDGET_ACTION='fail'):
+                    with self.assertRaises(QueryBudgetExceeded):
+                        self.client.get(url)
+        finally:
+            logger.handlers = handlers
+            logger.setLevel(level)
+    
+    def test_member_history(self):
+        '''
+        Test if the voting history of a member pages through the votes as
+        voter and as proxy and computes the participation
+        '''
+        past = timezone.now() - timedelta(days=1)
+        # Only motions closed since a member joined count for participation
+        self.assertIsNone(member_statistics(self.alice)['participation'])
+        User.objects.update(date_joined=past - timedelta(days=1))
+        self.alice, self.bob, self.gloria = [
+            User.objects.get(pk=user.pk)
+            for user in (self.alice, self.bob, self.gloria)]
+        closed = [self.create_motion(due=past) for i in range(4)]
+        closed.append(self.create_motion(due=past, withdrawn=True))
+        motions = closed + [self.create_motion() for i in range(3)]
+        expected = []
+        for i, m in enumerate(motions):
+            if i % 3 == 1:
+                m.proxy_vote(vote=False,
+                             voter=self.bob,
+                             proxy=self.alice,
+                             justification='Vote during board meeting',
+                             certificate=self.CLIENT_CERT)
+                expected.append(m.vote_set.get(voter=self.bob).pk)
+            if i != 3:
+                expected.append(
+                    m.vote(i % 2 == 0 or None, self.alice,
+                           self.CLIENT_CERT).pk)
+        m = self.create_motion()
+        m.vote(True, self.carole, self.CLIENT_CERT)
+        expected.reverse()
+        
+        view = MemberHistoryView.as_view(page_size=3)
+        
+        def walk():
+            params, pages = {}, []
+            while True:
+                response = view(RequestFactory().get('/', params),
+                                username='alice')
+                pages.append([v.pk for v in response.context_data['vote_list']])
+                if not response.context_data['older']:
+                    break
+                params = {'before': response.context_data['older']}
+            backwards = [pages[-1]]
+            params = {'after': pages[-1][0]}
+            while True:
+                response = view(RequestFactory().get('/', params),
+                                username='alice')
+                backwards.append([v.pk for v in response.context_data['vote_list']])
+                if not response.context_data['newer']:
+                    break
+                params = {'after': response.context_data['newer']}
+            return sum(pages, []), sum(reversed(backwards), [])
+        
+        forwards, backwards = walk()
+        self.assertEqual(expected, forwards)
+        self.assertEqual(expected, backwards)
+        
+        statistics = view(RequestFactory().get('/'),
+                          username='alice').context_data['statistics']
+        # Alice voted on three of the four motions that closed, not on the
+        # withdrawn one
+        self.assertEqual(dict(votes=7, ayes=4, nays=0, abstains=3, by_proxy=0,
+                              as_proxy=3, participation=0.75), statistics)
+        self.assertEqual(0.25, member_statistics(self.bob)['participation'])
+        self.assertEqual(3, member_statistics(self.bob)['by_proxy'])
+        self.assertEqual(dict(votes=0, ayes=0, nays=0, abstains=0, by_proxy=0,
+                              as_proxy=0, participation=0.0),
+                         member_statistics(self.gloria))
+        
+        response = self.assertQueryBudget(
+            reverse('member_history', args=('alice',)), {'before': forwards[2]})
+        self.assertContains(response, 'Votes of Alice')
+        data = json.loads(self.assertQueryBudget(
+            reverse('api_member_history', args=('alice',))).content)
+        self.assertEqual(expected, [
+            Vote.objects.get(motion=v['motion'], voter__username=v['voter']).pk
+            for v in data['votes']])
+        self.assertEqual((u'bob', u'alice'),
+                         (data['votes'][1]['voter'], data['votes'][1]['proxy']))
+        self.assertEqual(404, self.client.get(
+            reverse('member_history', args=('nobody',))).status_code)
+    
+    def test_statistics(self):
+        '''
+        Test if the statistics follow votes and finalized motions and are
+        rebuilt by the rebuild_statistics command
+        '''
+        past = timezone.now() - timedelta(days=1)
+        User.objects.update(date_joined=past - timedelta(days=1))
+        approved = self.create_motion(due=past)
+        approved.vote(True, self.alice, self.CLIENT_CERT)
+        approved.proxy_vote(vote=True,
+                            voter=self.bob,
+                            proxy=self.alice,
+                            justification='Vote during board meeting',
+                            certificate=self.CLIENT_CERT)
+        declined = self.create_motion(due=past)
+        vote = declined.vote(True, self.alice, self.CLIENT_CERT)
+        vote.vote = False
+        vote.save()
+        withdrawn = self.create_motion(due=past, withdrawn=True)
+        withdrawn.vote(None, self.carole, self.CLIENT_CERT)
+        m = self.create_motion()
+        m.vote(None, self.carole, self.CLIENT_CERT).delete()
+        m.vote(None, self.bob, self.CLIENT_CERT)
+        
+        def counters(member):
+            return MemberStatistics.objects.filter(member=member).values_list(
+                *MemberStatistics.COUNTER_FIELDS).get()
+        self.assertEqual((2, 1, 1, 0, 0, 1, 0), counters(self.alice))
+        self.assertEqual((2, 1, 0, 1, 1, 0, 0), counters(self.bob))
+        self.assertEqual((1, 0, 0, 1, 0, 0, 0), counters(self.carole))
+        self.assertFalse(MonthlyStatistics.objects.exists())
+        
+        for motion in (approved, declined, withdrawn):
+            motion.finalize()
+        self.assertEqual(2, counters(self.alice)[-1])
+        self.assertEqual(1, counters(self.bob)[-1])
+        self.assertEqual(0, counters(self.carole)[-1])
+        month = MonthlyStatistics.objects.get()
+        self.assertEqual(MonthlyStatistics.month_of(past), month.month)
+        self.assertEqual((2, 1, 3, 1), (month.decided, month.approved,
+                                        month.votes, month.proxy_votes))
+        call_command('rebuild_statistics', check=True, stdout=StringIO())
+        
+        response = self.assertQueryBudget(reverse('motion_statistics'))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(0.5, response.context['approval_rate'])
+        self.assertEqual(1.0 / 3, response.context['proxy_share'])
+        members = dict((statistics.member.username, statistics)
+                       for statistics in response.context['members'])
+        self.assertEqual(1.0, members['alice'].participation)
+        self.assertEqual(0.5, members['bob'].participation)
+        self.assertEqual(0.5, members['bob'].proxy_share)
+        self.assertEqual(0.0, members['carole'].participation)
+        
+        MemberStatistics.objects.filter(member=self.alice).update(votes=7)
+        MonthlyStatistics.objects.all().delete()
+        with self.assertRaises(CommandError):
+            call_command('rebuild_statistics', check=True, stdout=StringIO())
+        call_command('rebuild_statistics', stdout=StringIO())
+        self.assertEqual(2, counters(self.alice)[0])
+        self.assertEqual(2, MonthlyStatistics.objects.get().decided)
+        call_command('rebuild_statistics', check=True, stdout=StringIO())
+    
+    @override_settings(MOTIONS_PRESIDENT='alice')
+    def test_decision_rules(self):
+        '''
+        Test if the rules and quorums of motions decide them the same in
+        Python and in the batch evaluation
+        '''
+        past = timezone.now() - timedelta(days=1)
+        expected = {}
+        for rule, quorum, votes, approved in (
+                ('majority', 0, (True, False), False),
+                ('casting_vote', 0, (True, False), True),
+                ('casting_vote', 0, (False, True), False),
+                ('casting_vote', 0, (True, True, False), True),
+                ('two_thirds', 0, (True, True, False), True),
+                ('two_thirds', 0, (True, True, False, False), False),
+                ('two_thirds', 0, (None,), False),
+                ('majority', 4, (True, True, None), False),
+                ('majority', 3, (True, True, None), True),
+                ):
+            m = self.create_motion(due=past, rule=rule, quorum=quorum)
+            for voter, vote in zip((self.alice, self.bob, self.carole,
+                                    self.dave), votes):
+                m.vote(vote, voter, self.CLIENT_CERT)
+            expected[m.number] = approved
+        expected[self.create_motion(rule='two_thirds').number] = None
+        
+        self.assertEqual(expected,
+                         dict((m.number, m.approved())
+                              for m in Motion.objects.all()))
+        with self.assertNumQueries(1):
+            self.assertEqual(expected,
+                             dict((m.number, m.approved())
+                                  for m in Motion.objects.with_outcomes()))
+        
+        # Without a president ties are declined
+        with override_settings(MOTIONS_PRESIDENT=None):
+            outcomes = rules.evaluate(Motion.objects.filter(rule='casting_vote'))
+        self.assertEqual([False, False, True], sorted(outcomes.values()))
+        
+        for m in Motion.objects.closed():
+            self.assertEqual(expected[m.number], m.finalize().approved)
+        Motion.objects.update(rule='majority', quorum=0)
+        self.assertEqual(expected, rules.evaluate(Motion.objects.all()))
+    
+    def test_vote_chain(self):
+        '''
+        Test if changes to the votes are chained and changes that bypass the
+        models are found from the last trusted checkpoint
+        '''
+        m = self.create_motion()
+        aye = m.vote(True, self.alice, self.CLIENT_CERT)
+        proxy = m.proxy_vote(vote=False,
+                             voter=self.bob,
+                             proxy=self.alice,
+                             justification='Vote during board meeting',
+                             certificate=self.CLIENT_CERT)
+        proxy.vote = None
+        proxy.save()
+        m.vote(True, self.carole, self.CLIENT_CERT).delete()
+        self.assertEqual(
+            [chain.CAST, chain.CAST, chain.CHANGE, chain.CAST, chain.DELETE],
+            list(VoteChainEntry.objects.order_by('pk')
+                                       .values_list('operation', flat=True)))
+        count, head, problems = chain.verify(full=True)
+        self.assertEqual((5, []), (count, problems))
+        call_command('verify_votes', stdout=StringIO())
+        checkpoint = VoteChainCheckpoint.objects.get()
+        self.assertEqual(head, (checkpoint.entry, checkpoint.hash))
+        
+        # Only the entries after the checkpoint are rehashed
+        m.vote(None, self.dave, self.CLIENT_CERT)
+        self.assertEqual((1, []), chain.verify()[::2])
+        
+        Vote.objects.filter(pk=aye.pk).update(vote=False)
+        self.assertEqual([], chain.verify()[2])
+        self.assertEqual(['Vote %d does not match the chain' % aye.pk],
+                         chain.verify(full=True)[2])
+        Vote.objects.filter(pk=aye.pk).update(vote=True)
+        
+        # Votes changed after the checkpoint are compared incrementally
+        Vote.objects.filter(voter=self.dave).update(vote=False)
+        Vote.objects.bulk_create([Vote(motion=m, voter=self.erin, vote=True,
+                                       certificate=aye.certificate)])
+        VoteChainEntry.objects.filter(pk=head[0]).update(hash='0' * 64)
+        problems = chain.verify()[2]
+        self.assertEqual(3, len(problems), problems)
+        with self.assertRaises(CommandError):
+            call_command('verify_votes', stdout=StringIO())
+        self.assertEqual(1, VoteChainCheckpoint.objects.count())
+        
+        VoteChainCheckpoint.objects.update(signature='0' * 64)
+        self.assertIn('Checkpoint %d has an invalid signature' % checkpoint.pk,
+                      chain.verify()[2])
+        
+        # Votes cast while the chain is rehashed are no problems
+        Vote.objects.filter(voter=self.dave).update(vote=None)
+        Vote.objects.filter(voter=self.erin).delete()
+        VoteChainEntry.objects.filter(pk=head[0]).update(hash=head[1])
+        late = self.create_motion()
+        entry_hash = chain.entry_hash
+        cast = []
+        def cast_once(*args):
+            if not cast:
+                cast.append(True)
+                late.vote(True, self.alice, self.CLIENT_CERT)
+            return entry_hash(*args)
+        chain.entry_hash = cast_once
+        try:
+            count, verified, problems = chain.verify(full=True)
+        finally:
+            chain.entry_hash = entry_hash
+        self.assertEqual([], problems)
+        self.assertEqual(count + 1, VoteChainEntry.objects.count())
+        self.assertEqual((count + 1, []), chain.verify(full=True)[::2])
+    
+    def test_notifications(self):
+        '''
+        Test if notifications are queued once per motion and event and sent
+        in batches over one connection each
+        '''
+        members = User.objects.filter(is_active=True).exclude(email='').count()
+        m = self.create_motion(due=timezone.now() + timedelta(hours=2))
+        m.save()
+        self.assertEqual(0, len(mail.outbox))
+        self.assertEqual([notifications.NEW_MOTION],
+                         [n.event for n in m.notifications.all()])
+        
+        m.vote(True, self.alice, self.CLIENT_CERT)
+        self.assertEqual(1, notifications.enqueue_reminders())
+        self.assertEqual(0, notifications.enqueue_reminders())
+        
+        connections = []
+        get_connection = mail.get_connection
+        def counting_connection(*args, **kwargs):
+            connections.append(get_connection(*args, **kwargs))
+            return connections[-1]
+        with override_settings(MOTIONS_SITE_URL='https://motions.example.org'):
+            mail.get_connection = counting_connection
+            try:
+                stats = list(notifications.send_pending(batch_size=3))
+            finally:
+                mail.get_connection = get_connection
+        self.assertEqual(2 * members - 1, len(mail.outbox))
+        # One connection per batch, a batch without recipients left only
+        # marks the notification as sent
+        self.assertEqual([3, 3, 1, 3, 3, 0],
+                         [s['messages'] for s in stats])
+        self.assertEqual(5, len(connections))
+        
+        new, reminders = mail.outbox[:members], mail.outbox[members:]
+        self.assertEqual(u'New motion %s: Test motion' % m.number,
+                         new[0].subject)
+        self.assertIn('https://motions.example.org%s'
+                      % reverse('motion_detail', args=(m.pk,)), new[0].body)
+        self.assertEqual(sorted(User.objects.exclude(email='')
+                                            .values_list('email', flat=True)),
+                         sorted(message.to[0] for message in new))
+        self.assertNotIn(['alice@example.com'],
+                         [message.to for message in reminders])
+        
+        # Nothing is sent twice, results are sent once finalized
+        self.assertEqual([], list(notifications.send_pending()))
+        Motion.objects.filter(pk=m.pk).update(
+            due=timezone.now() - timedelta(minutes=1))
+        m = Motion.objects.get(pk=m.pk)
+        m.finalize()
+        m.finalize()
+        out = StringIO()
+        call_command('send_notifications', stdout=out)
+        self.assertEqual('%d message(s) sent in 1 batch(es)\n' % members,
+                         out.getvalue())
+        self.assertEqual(u'Motion %s approved: Test motion' % m.number,
+                         mail.outbox[-1].subject)
+    
+    def test_fragment_cache(self):
+        '''
+        Test if cached fragments and pages are used until the motion or its
+        votes change and if hits and misses are counted
+        '''
+        cache.clear()
+        m = self.create_motion()
+        m.save()
+        list_url = reverse('motion_list')
+        detail_url = reverse('motion_detail', args=(m.pk,))
+        
+        self.client.get(list_url)
+        response = self.client.get(list_url)
+        self.assertContains(response, m.number)
+        self.assertEqual({'hits': 1, 'misses': 1, 'ratio': 0.5},
+                         caching.statistics()['row'])
+        
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(detail_url)
+        self.assertEqual(2, len(queries))
+        # Only the motion is read to build the key of the cached page
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(detail_url)
+        self.assertEqual(1, len(queries))
+        self.assertContains(response, '0 ayes')
+        
+        # Votes bump the version, saving the motion its modification time
+        m.vote(True, self.bob, self.CLIENT_CERT)
+        self.assertContains(self.client.get(detail_url), '1 ayes')
+        response = self.client.get(list_url)
+        self.assertContains(response, '<td>1</td>')
+        m = Motion.objects.get(pk=m.pk)
+        m.title = 'Renamed motion'
+        m.save()
+        self.assertContains(self.client.get(detail_url), 'Renamed motion')
+        self.assertContains(self.client.get(list_url), 'Renamed motion')
+        # A passed due date changes the status
+        Motion.objects.filter(pk=m.pk).update(
+            due=timezone.now() - timedelta(seconds=1))
+        self.assertContains(self.client.get(list_url), 'Approved')
+        
+        m = Motion.objects.with_outcomes().get(pk=m.pk)
+        model_admin = admin.site._registry[Motion]
+        summary = model_admin.summary(m)
+        self.assertTrue(summary.startswith('Approved: 1 ayes, 0 nays'))
+        self.assertEqual(summary, model_admin.summary(m))
+        self.assertEqual('', model_admin.summary(Motion()))
+        
+        stats = caching.statistics(reset=True)
+        self.assertEqual((1, 3), (stats['page']['hits'],
+                                  stats['page']['misses']))
+        self.assertEqual((1, 1), (stats['summary']['hits'],
+                                  stats['summary']['misses']))
+        self.assertEqual((1, 4), (stats['row']['hits'],
+                                  stats['row']['misses']))
+        self.assertEqual({'hits': 0, 'misses': 0, 'ratio': None},
+                         caching.statistics()['row'])
+    
+    def test_ballot(self):
+        '''
+        Test if ballots cast all their votes in one transaction or none
+        '''
+        motions = []
+        for i in range(3):
+            m = self.create_motion()
+            m.save()
+            motions.append(m)
+        closed = self.create_motion(due=timezone.now() - timedelta(days=1))
+        closed.save()
+        BallotEntry = ballots.BallotEntry
+        
+        votes = ballots.cast(self.bob, [
+            BallotEntry(motions[0].number, True, None, ''),
+            BallotEntry(motions[1].number, False, None, ''),
+            BallotEntry(motions[1].number, None, self.carole, 'On holiday'),
+        ], self.CLIENT_CERT)
+        self.assertEqual([(motions[0].number, True, self.bob.pk, None),
+                          (motions[1].number, False, self.bob.pk, None),
+                          (motions[1].number, None, self.carole.pk,
+                           self.bob.pk)],
+                         list(Vote.objects.order_by('pk').values_list(
+                             'motion', 'vote', 'voter', 'proxy')))
+        self.assertEqual([v.pk for v in votes],
+                         list(Vote.objects.order_by('pk')
+                                          .values_list('pk', flat=True)))
+        self.assertIsInstance(votes[2], ProxyVote)
+        self.assertEqual((0, 1, 1, 1), (votes[2].motion.ayes_count,
+                                        votes[2].motion.nays_count,
+                                        votes[2].motion.abstains_count,
+                                        votes[2].motion.proxies_count))
+        m = Motion.objects.get(pk=motions[1].pk)
+        self.assertEqual((0, 1, 1, 1, 1), (m.ayes_count, m.nays_count,
+                                           m.abstains_count, m.proxies_count,
+                                           m.version))
+        self.assertEqual((1, 0, 0, 0), Motion.objects.values_list(
+            'ayes_count', 'nays_count', 'abstains_count', 'proxies_count',
+        ).get(pk=motions[0].pk))
+        self.assertEqual(0, Motion.objects.get(pk=motions[2].pk).version)
+        self.assertEqual((2, 1, 1), MemberStatistics.objects.values_list(
+            'votes', 'ayes', 'as_proxy').get(pk=self.bob.pk))
+        self.assertEqual((1, 1), MemberStatistics.objects.values_list(
+            'votes', 'by_proxy').get(pk=self.carole.pk))
+        self.assertEqual((3, []), chain.verify(full=True)[::2])
+        
+        # A single bad vote keeps the whole ballot from being cast
+        with self.assertRaises(django.core.exceptions.ValidationError) as cm:
+            ballots.cast(self.bob, [
+                BallotEntry(motions[2].number, True, None, ''),
+                BallotEntry(motions[0].number, False, None, ''),
+                BallotEntry(closed.number, True, None, ''),
+                BallotEntry('m20000101.1', True, None, ''),
+                BallotEntry(motions[2].number, True, self.bob, 'Myself'),
+                BallotEntry(motions[2].number, True, self.dave, ''),
+            ], self.CLIENT_CERT)
+        errors = cm.exception.message_dict
+        self.assertEqual(sorted([motions[0].number, motions[2].number,
+                                 closed.number, 'm20000101.1']),
+                         sorted(errors))
+        self.assertEqual(['bob already voted on motion %s.'
+                          % motions[0].number], errors[motions[0].number])
+        self.assertEqual(3, len(errors[motions[2].number]))
+        self.assertEqual(3, Vote.objects.count())
+        self.assertEqual(0, Motion.objects.get(pk=motions[2].pk).version)
+        
+        with self.assertRaises(django.core.exceptions.ValidationError):
+            ballots.cast(self.bob, [], self.CLIENT_CERT)
+    
+    def test_ballot_view(self):
+        '''
+        Test if ballots are cast by the member of the client certificate
+        '''
+        m = self.create_motion()
+        n = self.create_motion()
+        url = reverse('api_ballot')
+        ballot = lambda number: json.dumps({'votes': [
+            {'motion': number, 'vote': None},
+            {'motion': number, 'vote': False, 'voter': 'dave',
+             'justification': 'Asked by phone'},
+        ]})
+        
+        self.client.login(username='bob', password='password')
+        self.assertEqual(403, self.client.post(
+            url, ballot(m.number), content_type='application/json')
+            .status_code)
+        self.assertEqual(400, self.client.post(
+            url, {'votes': ''}, SSL_CLIENT_CERT=self.CLIENT_CERT).status_code)
+        self.assertEqual(400, self.client.post(
+            url, '{"votes": [{}]}', content_type='application/json',
+            SSL_CLIENT_CERT=self.CLIENT_CERT).status_code)
+        self.assertEqual(400, self.client.post(
+            url, ballot(m.number), content_type='application/json',
+            SSL_CLIENT_CERT=self.CLIENT_CERT.replace('-----BEGIN',
+                                                     u'\xe4-----BEGIN'))
+            .status_code)
+        self.assertEqual(400, self.client.post(
+            url, ballot(m.number), content_type='application/json',
+            SSL_CLIENT_CERT=self.CLIENT_CERT.replace('-----BEGIN',
+                                                     '%C3%A4-----BEGIN'))
+            .status_code)
+        self.assertFalse(Vote.objects.exists())
+        
+        # The first ballot also stores the certificate and the statistics
+        # of the members
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(200, self.client.post(
+                url, ballot(m.number), content_type='application/json',
+                SSL_CLIENT_CERT=self.CLIENT_CERT).status_code)
+        self.assertLessEqual(len(queries), resolve(url).func.query_budget)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, ballot(n.number),
+                                        content_type='application/json',
+                                        SSL_CLIENT_CERT=self.CLIENT_CERT)
+        self.assertEqual(200, response.status_code)
+        self.assertLessEqual(len(queries), resolve(url).func.query_budget)
+        data = json.loads(response.content)['votes']
+        self.assertEqual([(n.number, 'bob', None, None),
+                          (n.number, 'dave', False, 'bob')],
+                         [(v['motion'], v['voter'], v['vote'], v['proxy'])
+                          for v in data])
+        self.assertEqual([0, 1, 1, 1], data[1]['tally'])
+        
+        # Everything or nothing
+        response = self.client.post(url, json.dumps({'votes': [
+            {'motion': n.number, 'vote': True, 'voter': 'erin',
+             'justification': 'Asked by mail'},
+            {'motion': m.number, 'vote': False},
+        ]}), content_type='application/json',
+            SSL_CLIENT_CERT=self.CLIENT_CERT)
+        self.assertEqual(400, response.status_code)
+        self.assertEqual({m.number: ['bob already voted on motion %s.'
+                                     % m.number]},
+                         json.loads(response.content)['errors'])
+        response = self.client.post(url, json.dumps({'votes': [
+            {'motion': n.number, 'vote': True, 'voter': 'nobody',
+             'justification': 'Asked by mail'},
+        ]}), content_type='application/json',
+            SSL_CLIENT_CERT=self.CLIENT_CERT)
+        self.assertEqual({n.number: ['There is no member nobody.']},
+                         json.loads(response.content)['errors'])
+        self.assertEqual(4, Vote.objects.count())
+    
+    def test_import(self):
+        '''
+        Test if archived motions are imported in batches with their numbers,
+        votes and timestamps, and invalid or existing ones are skipped
+        '''
+        motions = [self.create_motion(title=u'Archived \xe4 %d' % i)
+                   for i in range(3)]
+        motions[0].vote(True, self.alice, self.CLIENT_CERT)
+        motions[0].proxy_vote(vote=False,
+                              voter=self.bob,
+                              proxy=self.alice,
+                              justification='Vote during board meeting',
+                              certificate=self.CLIENT_CERT)
+        motions[1].vote(None, self.carole, self.CLIENT_CERT)
+        lines = list(export.jsonl_lines(export.filter_motions()))
+        
+        # Move the exported motions to a day in the past, with a gap
+        created = u'2010-03-01T09:00:00+00:00'
+        records = [json.loads(line) for line in lines]
+        for index, record in zip((1, 3, 4), records):
+            record.update(number=u'm20100301.%d' % index, created=created,
+                          modified=created, due=u'2010-03-15T09:00:00+00:00')
+        records[2]['votes'] = [{'voter': u'nobody', 'vote': True,
+                                'proxy': None, 'justification': u'',
+                                'timestamp': created}]
+        archive = [json.dumps(record) + '\n' for record in records] + [
+            lines[0], '{"number": \n', '\n',
+            json.dumps(dict(records[1], number=u'm20100302.1')) + '\n',
+        ]
+        certificate = Certificate.from_pem(self.CLIENT_CERT)
+        batches = list(importer.Importer(certificate, batch_size=2).run(
+            importer.read_jsonl(archive)))
+        self.assertEqual(5, len(batches))
+        self.assertEqual(
+            [(3, u'm20100301.4', u'There is no member nobody.'),
+             (5, None, u'Unreadable JSON: No JSON object could be decoded'),
+             (7, u'm20100302.1', u'Motion m20100302.1 was not created on the '
+                                 u'day of its number.')],
+            [problem for stats in batches for problem in stats['problems']])
+        self.assertEqual((2, 3, 1), tuple(sum(stats[key] for stats in batches)
+                                          for key in ('motions', 'votes',
+                                                      'skipped')))
+        
+        imported = Motion.objects.get(pk=u'm20100301.1')
+        self.assertEqual(datetime(2010, 3, 1, 9, tzinfo=timezone.utc),
+                         imported.created)
+        self.assertEqual(datetime(2010, 3, 1, 9, tzinfo=timezone.utc),
+                         imported.modified)
+        self.assertEqual((1, 1, 0, 1, 2), (
+            imported.ayes_count, imported.nays_count, imported.abstains_count,
+            imported.proxies_count, imported.version))
+        # JSON keeps milliseconds of the timestamps
+        votes = lambda motion: [vote[:3] + (vote[3].isoformat()[:23],)
+                                for vote in motion.vote_set.order_by('voter')
+                                .values_list('voter', 'vote', 'proxy',
+                                             'timestamp')]
+        self.assertEqual(votes(motions[0]), votes(imported))
+        self.assertEqual([u'm20100301.1'], [m.number for m in search.search(
+            Motion.objects.filter(number__startswith=u'm2010'),
+            u'Archived')][:1])
+        self.assertEqual(2, MemberStatistics.objects.get(
+            member=self.alice).votes)
+        self.assertEqual((6, []), chain.verify(full=True)[::2])
+        # New motions of the day continue after the imported ones
+        self.assertEqual(4, MotionSequence.next_index(date(2010, 3, 1)))
+        # Members were told about the results of archived motions before
+        call_command('finalize_motions', verbosity=0)
+        self.assertTrue(Motion.objects.get(pk=u'm20100301.1').finalized)
+        self.assertFalse(Notification.objects.filter(
+            event=notifications.RESULT, sent__isnull=True).exists())
+        
+        # Running the import again only skips
+        stats = list(importer.Importer(certificate).run(
+            importer.read_jsonl(archive[:2])))
+        self.assertEqual([(0, 2)], [(s['motions'], s['skipped'])
+                                    for s in stats])
+        
+        # The CSV format, through the command
+        rows = list(csv.reader(StringIO(''.join(
+            export.csv_lines(export.filter_motions(
+                since=timezone.now().date()))))))
+        number, created_column = rows[0].index('number'), \
+                                 rows[0].index('created')
+        for row in rows[1:]:
+            row[number] = row[number].replace(timezone.now()
+                                              .strftime('m%Y%m%d'),
+                                              'm20100402')
+            row[created_column] = '2010-04-02T12:00:00+00:00'
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        archive, pem = [os.path.join(directory, name)
+                        for name in ('archive.csv', 'client.pem')]
+        with open(archive, 'wb') as f:
+            csv.writer(f).writerows(rows)
+        with open(pem, 'w') as f:
+            f.write(self.CLIENT_CERT)
+        out = StringIO()
+        call_command('import_motions', archive, format='csv',
+                     member='alice', certificate=pem, stdout=out)
+        self.assertIn('Imported 3 motion(s) with 3 vote(s)', out.getvalue())
+        self.assertEqual(
+            [(u'm20100402.1', 2), (u'm20100402.2', 1), (u'm20100402.3', 0)],
+            [(m.number, m.ayes_count + m.nays_count + m.abstains_count)
+             for m in Motion.objects.filter(number__startswith=u'm20100402')
+                                    .order_by('number')])
+        self.assertEqual([], chain.verify(full=True)[2])
+        out = StringIO()
+        call_command('import_motions', archive, format='csv', member='alice',
+                     certificate=pem, dry_run=True, stdout=out)
+        self.assertIn('3 existing skipped', out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('import_motions', archive, format='jsonl',
+                         member='alice', certificate=pem, stdout=StringIO(),
+                         stderr=StringIO())
+        
+        # Rules and quorums are kept, outcomes have to match the votes
+        strict = self.create_motion(due=timezone.now() - timedelta(days=1),
+                                    rule='two_thirds', quorum=5)
+        for voter, vote in zip((self.alice, self.bob, self.carole, self.dave,
+                                self.erin), (True, True, True, False, False)):
+            strict.vote(vote, voter, self.CLIENT_CERT)
+        strict.finalize()
+        strict = Motion.objects.filter(pk=strict.pk)
+        record = json.loads(list(export.jsonl_lines(strict))[0])
+        self.assertEqual((u'two_thirds', 5, False), (
+            record['rule'], record['quorum'], record['approved']))
+        created = u'2010-05-01T09:00:00+00:00'
+        records = [dict(record, number=u'm20100501.%d' % index,
+                        created=created, modified=created, **changes)
+                   for index, changes in enumerate((
+                       {}, {'rule': u'unanimous'}, {'quorum': u'some'},
+                       {'approved': True}, {'rule': u'majority'}), 1)]
+        stats = list(importer.Importer(certificate).run(
+            importer.read_jsonl([json.dumps(r) + '\n' for r in records])))
+        self.assertEqual(
+            [(2, u'm20100501.2', u"Unknown rule: u'unanimous'"),
+             (3, u'm20100501.3', u"Invalid quorum: u'some'"),
+             (4, u'm20100501.4', u'The votes do not decide the motion as '
+                                 u'archived.'),
+             (5, u'm20100501.5', u'The votes do not decide the motion as '
+                                 u'archived.')],
+            [problem for s in stats for problem in s['problems']])
+        rows = list(csv.reader(StringIO(''.join(export.csv_lines(strict)))))
+        for row in rows[1:]:
+            row[0], row[rows[0].index('created')] = \
+                'm20100502.1', '2010-05-02T09:00:00+00:00'
+        archive = StringIO()
+        csv.writer(archive).writerows(rows)
+        archive.seek(0)
+        stats = list(importer.Importer(certificate).run(
+            importer.read_csv(archive)))
+        self.assertEqual([(1, [])], [(s['motions'], s['problems'])
+                                     for s in stats])
+        self.assertEqual(
+            [(u'm20100501.1', u'two_thirds', 5),
+             (u'm20100502.1', u'two_thirds', 5)],
+            list(Motion.objects.filter(number__in=(u'm20100501.1',
+                                                   u'm20100502.1'))
+                               .order_by('number')
+                               .values_list('number', 'rule', 'quorum')))
+        call_command('finalize_motions', verbosity=0)
+        self.assertEqual([False, False], [m.result.approved for m in
+                                          Motion.objects.filter(
+                                              number__startswith=u'm201005')])
+    
+    def test_notification_failures(self):
+        '''
+        Test if a notification that cannot be sent is retried later without
+        holding up the ones queued after it
+        '''
+        members = User.objects.filter(is_active=True).exclude(email='').count()
+        first, second = self.create_motion(), self.create_motion()
+        
+        class FailingConnection(object):
+            def send_messages(self, messages):
+                if first.number in messages[0].subject:
+                    raise IOError('Connection refused')
+                mail.outbox.extend(messages)
+        get_connection = mail.get_connection
+        logger = logging.getLogger('cacert_motions.notifications')
+        mail.get_connection = lambda *args, **kwargs: FailingConnection()
+        logger.disabled = True
+        try:
+            out, err = StringIO(), StringIO()
+            call_command('send_notifications', stdout=out, stderr=err)
+        finally:
+            mail.get_connection = get_connection
+            logger.disabled = False
+        self.assertEqual('%d message(s) sent in 2 batch(es), %d failed\n'
+                         % (members, members), out.getvalue())
+        self.assertIn('%s motion: %d message(s) failed' % (first.number,
+                                                           members),
+                      err.getvalue())
+        
+        failed = first.notifications.get()
+        self.assertEqual((1, None, 0),
+                         (failed.attempts, failed.sent, failed.last_recipient))
+        self.assertGreater(failed.retry_at, timezone.now())
+        self.assertIsNotNone(second.notifications.get().sent)
+        # Not retried before its time
+        self.assertEqual([], list(notifications.send_pending()))
+        
+        failed.retry_at = timezone.now()
+        failed.save()
+        stats = list(notifications.send_pending())
+        self.assertEqual([(members, 0)],
+                         [(s['messages'], s['failed']) for s in stats])
+        failed = first.notifications.get()
+        self.assertEqual((0, None), (failed.attempts, failed.retry_at))
+        self.assertIsNotNone(failed.sent)
+
+
+class MotionNumberConcurrencyTest(TransactionTestCase):
+    
+    THREADS = 8
+    MOTIONS_PER_THREAD = 10
+    
+    def test_concurrent_motion_numbers(self):
+        '''
+        Test if motions created from parallel threads all get distinct,
+        gapless numbers
+        '''
+        if connection.vendor == 'sqlite' and \
+                connection.settings_dict['NAME'] in ('', ':memory:'):
+            self.skipTest('Threads cannot share an in-memory sqlite database, '
+                          'set TEST_NAME to run this test')
+        
+        proponent = User.objects.create_user('proponent')
+        start = threading.Event()
+        numbers = []
+        errors = []
+        
+        def create_motions():
+            start.wait()
+            try:
+                for i in range(self.MOTIONS_PER_THREAD):
+                    m = Motion(title='Concurrent motion',
+                               text='Text of the concurrent motion',
+                               proponent=proponent,
+                               due=timezone.now() + timedelta(days=3))
+                    m.save()
+                    numbers.append(m.number)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+        
+        threads = [threading.Thread(target=create_motions)
+                   for i in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual([], errors)
+        total = self.THREADS * self.MOTIONS_PER_THREAD
+        prefix = u'm{now:%Y%m%d}.'.format(now=datetime.utcnow())
+        self.assertEqual(
+            sorted(prefix + unicode(i) for i in range(1, total + 1)),
+            sorted(numbers),
+        )
+        self.assertEqual(total, Motion.objects.count())
+
+
+class MigrationTest(TransactionTestCase):
+    
+    def setUp(self):
+        # Flushing the database after a test empties the migration history
+        call_command('migrate', fake=True, verbosity=0)
+    
+    def migrate(self, target=None):
+        args = ('cacert_motions', target) if target else ()
+        call_command('migrate', *args, verbosity=0)
+    
+    def test_finalized_default(self):
+        '''
+        Test if motions existing before the motion results are not finalized
+        '''
+        self.migrate('0011')
+        self.addCleanup(self.migrate)
+        proponent = User.objects.create_user('proponent')
+        created = datetime(2014, 1, 1, tzinfo=timezone.utc)
+        connection.cursor().execute(
+            'INSERT INTO cacert_motions_motion (number, title, text, '
+            'proponent_id, withdrawn, created, modified, due, ayes_count, '
+            'nays_count, abstains_count, proxies_count) VALUES '
+            '(%s, %s, %s, %s, %s, %s, %s, %s, 0, 0, 0, 0)',
+            ['m20140101.1', 'Old motion', 'Text of the old motion',
+             proponent.pk, False, created, created,
+             created + timedelta(days=1)])
+        self.migrate()
+        
+        self.assertEqual([u'm20140101.1'], list(
+            Motion.objects.filter(finalized=False)
+                          .values_list('number', flat=True)))
+    
+    def test_past_results(self):
+        '''
+        Test if finalizing motions closed before the notification queue
+        queues no result mails
+        '''
+        self.migrate('0023')
+        self.addCleanup(self.migrate)
+        proponent = User.objects.create_user('proponent')
+        created = datetime(2014, 1, 1, tzinfo=timezone.utc)
+        Motion.objects.bulk_create([Motion(
+            number=u'm20140101.%d' % index, title=u'Old motion',
+            text=u'Text of the old motion', proponent=proponent,
+            created=created, modified=created,
+            due=created + timedelta(days=1)) for index in (1, 2)])
+        self.migrate()
+        
+        call_command('finalize_motions', verbosity=0)
+        self.assertEqual(2, Motion.objects.filter(finalized=True).count())
+        self.assertEqual([], list(Notification.objects.filter(
+            sent__isnull=True)))
+
+
+@override_settings(MOTIONS_READ_REPLICAS=['replica'])
+class ReplicaRouterTest(SimpleTestCase):
+    def setUp(self):
+        self.router = routers.ReplicaRouter()
+        self.middleware = routers.ReplicaPinningMiddleware()
+        self.factory = RequestFactory()
+        routers.reset()
+    
+    def tearDown(self):
+        routers.reset()
+    
+    def request(self, method='get', write=False, **cookies):
+        '''
+        Pass a request through the middleware
+        :rtype: (database read from during the request, HttpResponse)
+        '''
+        request = getattr(self.factory, method)('/')
+        request.COOKIES.update(cookies)
+        self.middleware.process_request(request)
+        if write:
+            self.router.db_for_write(Motion)
+        read = self.router.db_for_read(Motion)
+        return read, self.middleware.process_response(request, HttpResponse())
+    
+    def test_routing(self):
+        '''
+        Test if reads go to the replica unless the thread wrote, is in a
+        transaction or asked for the primary
+        '''
+        self.assertEqual('replica', self.router.db_for_read(Motion))
+        with routers.use_primary():
+            self.assertEqual('default', self.router.db_for_read(Vote))
+        self.assertEqual('replica', self.router.db_for_read(Vote))
+        with transaction.atomic():
+            self.assertEqual('default', self.router.db_for_read(Motion))
+        
+        self.assertEqual('default', self.router.db_for_write(Motion))
+        self.assertEqual('default', self.router.db_for_read(Motion))
+        
+        routers.reset()
+        with override_settings(MOTIONS_READ_REPLICAS=[]):
+            self.assertEqual('default', self.router.db_for_read(Motion))
+        self.assertFalse(self.router.allow_syncdb('replica', Motion))
+        self.assertIsNone(self.router.allow_syncdb('default', Motion))
+        motion, vote = Motion(), Vote()
+        motion._state.db, vote._state.db = 'replica', 'default'
+        self.assertTrue(self.router.allow_relation(motion, vote))
+    
+    def test_pinning(self):
+        '''
+        Test if clients read from the primary after they wrote
+        '''
+        read, response = self.request()
+        self.assertEqual('replica', read)
+        self.assertNotIn(routers.COOKIE, response.cookies)
+        
+        read, response = self.request('post', write=True)
+        self.assertEqual('default', read)
+        cookie = response.cookies[routers.COOKIE]
+        self.assertEqual(10, cookie['max-age'])
+        self.assertFalse(routers.pinned())
         
-        #TODO: test for president's deciding vote on a draw
+        # The write is visible to the same request and the next ones
+        read, response = self.request(write=True)
+        self.assertEqual('default', read)
+        read, response = self.request(**{routers.COOKIE: cookie.value})
+        self.assertEqual('default', read)
+        self.assertEqual('default', self.request('post')[0])
+        self.assertEqual('replica', self.request()[0])
@@ -1,9 +1,19 @@
 from django.conf.urls import patterns, url
-from django.views import generic
 
-from .models import Motion
+from . import views
+from .instrumentation import query_budget
 
 urlpatterns = patterns('',
-    url(r'^$', generic.ListView.as_view(model=Motion), name='motion_list'),
-    url(r'^(?P<pk>m\d{8}\.\d+)/$', generic.DetailView.as_view(model=Motion), name='motion_detail')
-)
\ No newline at end of file
+    url(r'^$', query_budget(3)(views.MotionListView.as_view()), name='motion_list'),
+    url(r'^(?P<pk>m\d{8}\.\d+)/$', query_budget(2)(views.MotionDetailView.as_view()), name='motion_detail'),
+    url(r'^(?P<pk>m\d{8}\.\d+)/live/$', views.MotionLiveView.as_view(), name='motion_live'),
+    url(r'^(?P<pk>m\d{8}\.\d+)/tally/$', query_budget(2)(views.MotionTallyPollView.as_view()), name='motion_tally'),
+    url(r'^members/(?P<username>[\w.@+-]+)/$', query_budget(5)(views.MemberHistoryView.as_view()), name='member_history'),
+    url(r'^statistics/$', query_budget(2)(views.StatisticsView.as_view()), name='motion_statistics'),
+    url(r'^search/$', query_budget(1)(views.MotionSearchView.as_view()), name='motion_search'),
+    url(r'^export/$', views.MotionExportView.as_view(), name='motion_export'),
+    url(r'^api/$', query_budget(3)(views.MotionListJSONView.as_view()), name='api_motion_list'),
+    url(r'^api/(?P<pk>m\d{8}\.\d+)/$', query_budget(3)(views.MotionDetailJSONView.as_view()), name='api_motion_detail'),
+    url(r'^api/ballot/$', query_budget(27)(views.BallotView.as_view()), name='api_ballot'),
+    url(r'^api/members/(?P<username>[\w.@+-]+)/$', query_budget(5)(views.MemberHistoryJSONView.as_view()), name='api_member_history'),
+)
@@ -1 +1,571 @@
-# Create your views here.
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.contrib.auth import get_user_model
+from django.db.models import Q
+from django.core.exceptions import ValidationError
+from django.http import (Http404, HttpResponse, HttpResponseBadRequest,
+                         HttpResponseForbidden, HttpResponseNotModified,
+                         StreamingHttpResponse)
+from django.utils.decorators import method_decorator
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.views import generic
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
+
+from .models import (Motion, MotionListVersion, Vote, MemberStatistics,
+                     MonthlyStatistics, member_statistics)
+from . import ballots, caching, export, live, rules, search
+
+
+class MotionListView(generic.ListView):
+    '''
+    Motions, newest first, optionally filtered by status. Pages are
+    addressed by the motion they start before or after instead of an
+    offset, so every page costs the same no matter how many motions exist.
+    '''
+    model = Motion
+    context_object_name = 'motion_list'
+    template_name = 'cacert_motions/motion_list.html'
+    page_size = 50
+    
+    def get_status(self):
+        status = self.request.GET.get('status')
+        return status if status in Motion.STATUSES else None
+    
+    def get_base_queryset(self):
+        ':rtype: cacert_motions.models.MotionQuerySet'
+        qs = Motion.objects.all()
+        status = self.get_status()
+        if status:
+            qs = getattr(qs, status)()
+        return qs
+    
+    def get_key(self, number):
+        '''
+        Sort key of the motion a page starts before or after
+        '''
+        try:
+            return Motion.objects.values_list('created', 'number').get(pk=number)
+        except Motion.DoesNotExist:
+            raise Http404
+    
+    @staticmethod
+    def newer(key):
+        return Q(created__gt=key[0]) | Q(created=key[0], number__gt=key[1])
+    
+    @staticmethod
+    def older(key):
+        return Q(created__lt=key[0]) | Q(created=key[0], number__lt=key[1])
+    
+    def get_queryset(self):
+        qs = self.get_base_queryset()
+        before = self.request.GET.get('before')
+        after = self.request.GET.get('after')
+        
+        # One more motion than needed tells whether there is a next page
+        if after:
+            page = qs.filter(self.newer(self.get_key(after))) \
+                     .order_by('created', 'number')
+        elif before:
+            page = qs.filter(self.older(self.get_key(before))) \
+                     .order_by('-created', '-number')
+        else:
+            page = qs.order_by('-created', '-number')
+        motions = list(page.select_related('proponent', 'result')
+                           .with_outcomes()[:self.page_size + 1])
+        more = len(motions) > self.page_size
+        motions = motions[:self.page_size]
+        if after:
+            motions.reverse()
+        
+        key = lambda motion: (motion.created, motion.number)
+        if not motions:
+            self.has_newer = self.has_older = False
+        elif after:
+            self.has_newer = more
+            self.has_older = qs.filter(self.older(key(motions[-1]))).exists()
+        elif before:
+            self.has_newer = qs.filter(self.newer(key(motions[0]))).exists()
+            self.has_older = more
+        else:
+            self.has_newer = False
+            self.has_older = more
+        return motions
+    
+    def get_context_data(self, **kwargs):
+        context = super(MotionListView, self).get_context_data(**kwargs)
+        motions = context['motion_list']
+        # One lookup for the cached rows of the whole page
+        caching.prefetch(motions, 'row')
+        context.update({
+            'status': self.get_status(),
+            'statuses': Motion.STATUSES,
+            'newer': motions[0].number if motions and self.has_newer else None,
+            'older': motions[-1].number if motions and self.has_older else None,
+        })
+        return context
+
+
+class MotionDetailView(generic.DetailView):
+    '''
+    A motion with all its ballots, loaded with two queries no matter how
+    many votes were cast. Rendered pages are cached until the motion or its
+    votes change, the ballots are only loaded to render the page again.
+    '''
+    def get_queryset(self):
+        return Motion.objects.select_related('proponent', 'result') \
+                             .with_outcomes()
+    
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        return caching.page(
+            self.object, type(self).__name__,
+            lambda: self.render_to_response(
+                self.get_context_data(object=self.object)))
+    
+    def get_ballots(self, motion):
+        '''
+        Votes on `motion` with their voters and, for proxy votes, proxies
+        :rtype: list of Vote
+        '''
+        votes = list(Vote.objects.filter(motion=motion)
+                                 .select_related('voter', 'proxy')
+                                 .order_by('timestamp', 'pk'))
+        for vote in votes:
+            vote.motion = motion
+        return votes
+    
+    def get_context_data(self, **kwargs):
+        context = super(MotionDetailView, self).get_context_data(**kwargs)
+        context['ballots'] = self.get_ballots(self.object)
+        return context
+
+
+class MemberHistoryView(generic.ListView):
+    '''
+    Votes a member cast, as voter or as proxy, newest first. Votes as voter
+    and as proxy are paged through their own indexes and merged, pages are
+    addressed by the vote they start before or after.
+    '''
+    context_object_name = 'vote_list'
+    template_name = 'cacert_motions/member_history.html'
+    page_size = 50
+    
+    def get_member(self):
+        if not hasattr(self, 'member'):
+            User = get_user_model()
+            try:
+                self.member = User.objects.get(
+                    **{User.USERNAME_FIELD: self.kwargs['username']})
+            except User.DoesNotExist:
+                raise Http404
+        return self.member
+    
+    def get_key(self, pk):
+        '''
+        Sort key of the vote a page starts before or after
+        '''
+        try:
+            return Vote.objects.values_list('timestamp', 'pk').get(pk=pk)
+        except (Vote.DoesNotExist, ValueError):
+            raise Http404
+    
+    def get_queryset(self):
+        member = self.get_member()
+        before = self.request.GET.get('before')
+        after = self.request.GET.get('after')
+        
+        votes = Vote.objects.select_related('motion', 'motion__result',
+                                            'voter', 'proxy')
+        # Decide the motions in the same queries
+        votes = rules.with_outcomes(votes)
+        if after:
+            key = self.get_key(after)
+            votes = votes.filter(Q(timestamp__gt=key[0]) |
+                                 Q(timestamp=key[0], pk__gt=key[1])) \
+                         .order_by('timestamp', 'pk')
+        else:
+            if before:
+                key = self.get_key(before)
+                votes = votes.filter(Q(timestamp__lt=key[0]) |
+                                     Q(timestamp=key[0], pk__lt=key[1]))
+            votes = votes.order_by('-timestamp', '-pk')
+        
+        # One more vote than needed from each index tells whether there is
+        # a next page
+        page = list(votes.filter(voter=member)[:self.page_size + 1]) + \
+               list(votes.filter(proxy=member)[:self.page_size + 1])
+        page.sort(key=lambda vote: (vote.timestamp, vote.pk),
+                  reverse=not after)
+        more = len(page) > self.page_size
+        page = page[:self.page_size]
+        if after:
+            page.reverse()
+        
+        for vote in page:
+            vote.motion.outcome = vote.outcome
+        
+        # The page the member came from is still there
+        self.has_newer = more if after else bool(before)
+        self.has_older = bool(after) or more
+        return page
+    
+    def get_context_data(self, **kwargs):
+        context = super(MemberHistoryView, self).get_context_data(**kwargs)
+        votes = context['vote_list']
+        context.update({
+            'member': self.get_member(),
+            'statistics': member_statistics(self.get_member()),
+            'newer': votes[0].pk if votes and self.has_newer else None,
+            'older': votes[-1].pk if votes and self.has_older else None,
+        })
+        return context
+
+
+class MotionSearchView(generic.ListView):
+    '''
+    Motions matching the full-text query `q`, best matches first
+    '''
+    context_object_name = 'motion_list'
+    template_name = 'cacert_motions/motion_search.html'
+    page_size = 50
+    
+    def get_query(self):
+        return self.request.GET.get('q', '').strip()
+    
+    def get_queryset(self):
+        query = self.get_query()
+        if not query:
+            return []
+        motions = Motion.objects.select_related('proponent', 'result')
+        return list(search.search(motions, query).with_outcomes()
+                          .order_by('rank', '-created')[:self.page_size])
+    
+    def get_context_data(self, **kwargs):
+        context = super(MotionSearchView, self).get_context_data(**kwargs)
+        context['query'] = self.get_query()
+        return context
+
+
+class StatisticsView(generic.TemplateView):
+    '''
+    Board statistics read from the rollup tables, two queries no matter how
+    many motions and votes exist. Participation counts the motions decided
+    from the month a member joined on.
+    '''
+    template_name = 'cacert_motions/statistics.html'
+    
+    @staticmethod
+    def ratio(part, total):
+        return float(part) / total if total else None
+    
+    def get_context_data(self, **kwargs):
+        context = super(StatisticsView, self).get_context_data(**kwargs)
+        months = list(MonthlyStatistics.objects.order_by('-month'))
+        for month in months:
+            month.approval_rate = self.ratio(month.approved, month.decided)
+            month.proxy_share = self.ratio(month.proxy_votes, month.votes)
+            month.decision_days = self.ratio(month.decision_seconds,
+                                             month.decided * 86400)
+        
+        User = get_user_model()
+        members = list(MemberStatistics.objects.select_related('member')
+                                       .order_by('member__%s'
+                                                 % User.USERNAME_FIELD))
+        for statistics in members:
+            # Custom user models may not know when members joined
+            joined = getattr(statistics.member, 'date_joined', None)
+            if joined is not None:
+                joined = MonthlyStatistics.month_of(joined)
+            decided = sum(month.decided for month in months
+                          if joined is None or month.month >= joined)
+            statistics.participation = self.ratio(statistics.decided, decided)
+            statistics.proxy_share = self.ratio(statistics.by_proxy,
+                                                statistics.votes)
+        
+        totals = dict((field, sum(getattr(month, field) for month in months))
+                      for field in MonthlyStatistics.COUNTER_FIELDS)
+        context.update({
+            'months': months,
+            'members': members,
+            'totals': totals,
+            'approval_rate': self.ratio(totals['approved'],
+                                        totals['decided']),
+            'proxy_share': self.ratio(totals['proxy_votes'], totals['votes']),
+            'decision_days': self.ratio(totals['decision_seconds'],
+                                        totals['decided'] * 86400),
+        })
+        return context
+
+
+class MotionLiveView(generic.View):
+    '''
+    Server-Sent Events with the tallies of a motion whenever they change.
+    The stream ends after MOTIONS_LIVE_DURATION seconds, browsers then
+    reconnect and send the version they know as Last-Event-ID.
+    '''
+    def get(self, request, pk):
+        if not Motion.objects.filter(pk=pk).exists():
+            raise Http404
+        last = request.META.get('HTTP_LAST_EVENT_ID', '')
+        version = int(last) if last.isdigit() else None
+        response = StreamingHttpResponse(self.events(pk, version),
+                                         content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Keep nginx from buffering the events
+        response['X-Accel-Buffering'] = 'no'
+        return response
+    
+    def events(self, pk, version):
+        yield 'retry: %d\n\n' % (1000 * live.setting('POLL_INTERVAL', 1))
+        for state in live.watch(pk, version, live.setting('DURATION', 600)):
+            if state is None:
+                yield ': keepalive\n\n'
+            else:
+                yield 'id: %d\nevent: tally\ndata: %s\n\n' % (
+                    state['version'],
+                    json.dumps(state, separators=(',', ':')),
+                )
+
+
+class MotionTallyPollView(generic.View):
+    '''
+    Long-poll fallback of `MotionLiveView`: answers with the tallies of a
+    motion as soon as its version differs from the `version` parameter, or
+    with 304 Not Modified after MOTIONS_LIVE_TIMEOUT seconds without change
+    '''
+    def get(self, request, pk):
+        if not Motion.objects.filter(pk=pk).exists():
+            raise Http404
+        version = request.GET.get('version', '')
+        version = int(version) if version.isdigit() else None
+        for state in live.watch(pk, version, live.setting('TIMEOUT', 25)):
+            if state is not None:
+                return HttpResponse(json.dumps(state, separators=(',', ':')),
+                                    content_type='application/json')
+        return HttpResponseNotModified()
+
+
+class ConditionalMixin(object):
+    '''
+    Answer conditional GET requests with 304 Not Modified before building
+    the response when `get_validators()` did not change
+    '''
+    def get_validators(self):
+        '''
+        :rtype: tuple of the ETag and the Last-Modified time, either may be
+                None
+        '''
+        raise NotImplementedError
+    
+    def dispatch(self, request, *args, **kwargs):
+        etag, last_modified = self.get_validators()
+        view = super(ConditionalMixin, self).dispatch
+        return condition(
+            etag_func=lambda request, *args, **kwargs: etag,
+            last_modified_func=lambda request, *args, **kwargs: last_modified,
+        )(view)(request, *args, **kwargs)
+
+
+class JSONResponseMixin(object):
+    def render_to_response(self, context, **response_kwargs):
+        response_kwargs.setdefault('content_type', 'application/json')
+        return HttpResponse(
+            json.dumps(self.get_data(context), cls=DjangoJSONEncoder,
+                       separators=(',', ':')),
+            **response_kwargs
+        )
+    
+    @staticmethod
+    def motion_data(motion):
+        return {
+            'number': motion.number,
+            'title': motion.title,
+            'status': motion.status(),
+            'approved': motion.approved(),
+            'due': motion.due,
+            'tally': [motion.ayes_count, motion.nays_count,
+                      motion.abstains_count, motion.proxies_count],
+            'version': motion.version,
+        }
+
+
+class MotionListJSONView(ConditionalMixin, JSONResponseMixin, MotionListView):
+    '''
+    Compact form of the motion list, every motion is one array of
+    `FIELDS`. Unchanged lists are answered with 304 Not Modified for the
+    cost of two single-row lookups, see `MotionListVersion`.
+    '''
+    FIELDS = ('number', 'title', 'status', 'approved', 'due', 'tally',
+              'version')
+    
+    def get_validators(self):
+        version, changed = MotionListVersion.current()
+        # Motions close without being written to, the last one that closed
+        # is found through the index on `due`
+        closed = Motion.objects.filter(due__lt=timezone.now()) \
+                               .order_by('-due') \
+                               .values_list('due', flat=True).first()
+        
+        etag = '%d.%s' % (version, closed.isoformat() if closed else '')
+        changes = [d for d in (changed, closed) if d is not None]
+        return etag, max(changes) if changes else None
+    
+    def get_data(self, context):
+        motions = [self.motion_data(motion) for motion in context['motion_list']]
+        return {
+            'fields': self.FIELDS,
+            'motions': [[m[f] for f in self.FIELDS] for m in motions],
+            'newer': context['newer'],
+            'older': context['older'],
+        }
+
+
+class MotionDetailJSONView(ConditionalMixin, JSONResponseMixin,
+                           MotionDetailView):
+    '''
+    A motion with its votes. Unchanged motions are answered with 304 Not
+    Modified for the cost of a single query.
+    '''
+    def get_validators(self):
+        try:
+            state = Motion.objects.only('modified', 'voted', 'version', 'due',
+                                        'withdrawn').get(pk=self.kwargs['pk'])
+        except Motion.DoesNotExist:
+            raise Http404
+        etag = '%s.%d.%s.%s' % (state.pk, state.version,
+                                state.modified.isoformat(), state.status())
+        return etag, state.last_modified()
+    
+    def get_data(self, context):
+        return export.motion_record(context['motion'], context['ballots'])
+
+
+class MotionExportView(generic.View):
+    '''
+    The whole archive or a part of it as CSV or JSON lines, streamed while
+    it is read from the database
+    '''
+    def get(self, request):
+        format = request.GET.get('format', 'csv')
+        status = request.GET.get('status') or None
+        dates = []
+        for key in ('since', 'until'):
+            value = request.GET.get(key)
+            try:
+                date = parse_date(value) if value else None
+            except ValueError:
+                date = None
+            if value and date is None:
+                return HttpResponseBadRequest('Invalid date for %s' % key)
+            dates.append(date)
+        since, until = dates
+        if format not in export.FORMATS or \
+                (status and status not in Motion.STATUSES):
+            return HttpResponseBadRequest('Invalid format or status')
+        
+        lines, content_type = export.FORMATS[format]
+        response = StreamingHttpResponse(
+            lines(export.filter_motions(status, since, until)),
+            content_type=content_type,
+        )
+        response['Content-Disposition'] = \
+            'attachment; filename="motions.%s"' % format
+        return response
+
+
+class MemberHistoryJSONView(JSONResponseMixin, MemberHistoryView):
+    '''
+    Voting history of a member with the participation statistics
+    '''
+    def get_data(self, context):
+        member = context['member']
+        return {
+            'member': member.get_username(),
+            'statistics': context['statistics'],
+            'votes': [{
+                'motion': vote.motion_id,
+                'title': vote.motion.title,
+                'approved': vote.motion.approved(),
+                'voter': vote.voter.get_username(),
+                'vote': vote.vote,
+                'proxy': vote.proxy.get_username() if vote.proxy_id else None,
+                'timestamp': vote.timestamp,
+            } for vote in context['vote_list']],
+            'newer': context['newer'],
+            'older': context['older'],
+        }
+
+
+class BallotView(generic.View):
+    '''
+    Cast a ballot of the member the client certificate belongs to, as JSON
+    object with a list of `votes`, each with the `motion`, the `vote` (true,
+    false or null to abstain) and for proxy votes the `voter` and a
+    `justification`. All votes are cast or none, problems are reported by
+    motion.
+    
+    Only JSON is accepted, which browsers do not send to other sites without
+    asking them first, so the view needs no CSRF token.
+    '''
+    @method_decorator(csrf_exempt)
+    def dispatch(self, request, *args, **kwargs):
+        return super(BallotView, self).dispatch(request, *args, **kwargs)
+    
+    def respond(self, data, status=200):
+        return HttpResponse(json.dumps(data, cls=DjangoJSONEncoder,
+                                       separators=(',', ':')),
+                            content_type='application/json', status=status)
+    
+    def post(self, request):
+        if request.META.get('CONTENT_TYPE', '').split(';')[0].strip() != \
+                'application/json':
+            return HttpResponseBadRequest('Ballots are sent as JSON')
+        try:
+            pem = ballots.client_certificate(request)
+        except ValueError:
+            return HttpResponseBadRequest('Invalid client certificate')
+        member = ballots.authenticate(pem, request.user) if pem else None
+        if member is None:
+            return HttpResponseForbidden('No valid client certificate')
+        
+        try:
+            votes = json.loads(request.body.decode('utf-8'))['votes']
+            usernames = set(vote['voter'] for vote in votes
+                            if vote.get('voter'))
+            User = get_user_model()
+            voters = dict(
+                (user.get_username(), user) for user in User.objects.filter(
+                    **{'%s__in' % User.USERNAME_FIELD: usernames}))
+            unknown = dict((vote['motion'],
+                            [u'There is no member %s.' % vote['voter']])
+                           for vote in votes if vote.get('voter') and
+                           vote['voter'] not in voters)
+            entries = [ballots.BallotEntry(
+                motion=vote['motion'],
+                vote=vote['vote'],
+                voter=voters.get(vote['voter']) if vote.get('voter') else None,
+                justification=vote.get('justification', u''),
+            ) for vote in votes]
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            return HttpResponseBadRequest('Invalid ballot: %r' % e)
+        if unknown:
+            return self.respond({'errors': unknown}, status=400)
+        
+        try:
+            votes = ballots.cast(member, entries, pem)
+        except ValidationError as e:
+            errors = e.message_dict if hasattr(e, 'error_dict') \
+                     else {'ballot': e.messages}
+            return self.respond({'errors': errors}, status=400)
+        return self.respond({'votes': [{
+            'motion': vote.motion_id,
+            'voter': vote.voter.get_username(),
+            'vote': vote.vote,
+            'proxy': vote.proxy.get_username() if vote.proxy_id else None,
+            'timestamp': vote.timestamp,
+            'tally': [vote.motion.ayes_count, vote.motion.nays_count,
+                      vote.motion.abstains_count, vote.motion.proxies_count],
+        } for vote in votes]})